@@ -0,0 +1,169 @@
+import asyncio
+import itertools
+import logging
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_REJECTED = metrics.counter("quranbot_admission_rejected_total", "Queries turned away before the AI",
+                                     ("reason",))
+
+# Weight of the latest query in the moving average of slot hold times used for ETAs.
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """A query was turned away: `reason` is "shed", "channel_quota" or "expired"."""
+
+    MESSAGE_KEYS = {"shed": "query_shed", "channel_quota": "channel_busy", "expired": "query_expired"}
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+    @property
+    def message_key(self):
+        return self.MESSAGE_KEYS[self.reason]
+
+
+class Ticket:
+    """A query's place in the admission queue, and then its slot; `release` frees the slot."""
+
+    def __init__(self, controller, channel, owner, deadline, sequence):
+        self.controller = controller
+        self.channel = channel
+        self.owner = owner
+        self.deadline = deadline  # Event loop time
+        self.sequence = sequence
+        self.granted = None  # time.monotonic() when the slot was granted
+        self.released = False
+        self.future = None
+        self.timer = None
+
+    def release(self):
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """Bounded, fair queue in front of the AI, in place of a bare semaphore.
+
+    At most `concurrency` queries hold a slot. Waiting queries are admitted owner first, then
+    from the channel with the fewest running queries, then in arrival order. A channel (or a
+    private chat) may have at most `channel_quota` queries waiting or running. Queries still
+    waiting `deadline` seconds after arrival are dropped, and new ones are shed once the queue
+    is full or their estimated wait exceeds `shed_latency` seconds.
+    """
+
+    def __init__(self, concurrency, max_queue, channel_quota, deadline, shed_latency, initial_service_time=5.0):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.channel_quota = channel_quota
+        self.deadline = deadline
+        self.shed_latency = shed_latency
+        self.service_time = initial_service_time  # Seconds a query holds its slot, moving average
+        self._waiting = []
+        self._running = 0
+        self._queued_by_channel = {}  # casefolded channel -> waiting queries
+        self._running_by_channel = {}  # casefolded channel -> running queries
+        self._sequence = itertools.count()
+        metrics.gauge("quranbot_admission_queries", "Queries waiting for or holding an AI slot", ("state",)).set_function(
+            lambda: {("waiting",): len(self._waiting), ("running",): self._running})
+
+    def estimate_wait(self, position):
+        """Seconds until the query at `position` in the queue is likely to get a slot."""
+        return position * self.service_time / self.concurrency
+
+    async def admit(self, channel, owner=False, on_wait=None):
+        """Wait for a slot and return its Ticket, or raise AdmissionRejected.
+
+        `on_wait(position, eta)` is awaited once if the query has to queue.
+        """
+        key = channel.casefold()
+        if self._queued_by_channel.get(key, 0) + self._running_by_channel.get(key, 0) >= self.channel_quota:
+            raise self._rejected("channel_quota", channel)
+        loop = asyncio.get_running_loop()
+        ticket = Ticket(self, key, owner, loop.time() + self.deadline, next(self._sequence))
+        if self._running < self.concurrency and not self._waiting:
+            self._grant(ticket)
+            return ticket
+
+        position = 1 + sum(1 for waiting in self._waiting if waiting.owner or not owner)
+        eta = self.estimate_wait(position)
+        if len(self._waiting) >= self.max_queue or (eta > self.shed_latency and not owner):
+            raise self._rejected("shed", channel, position, eta)
+        ticket.future = loop.create_future()
+        ticket.timer = loop.call_at(ticket.deadline, self._expire, ticket)
+        self._waiting.append(ticket)
+        self._queued_by_channel[key] = self._queued_by_channel.get(key, 0) + 1
+        logger.info("Queued query from %s at position %s, estimated wait %.1fs", channel, position, eta)
+        try:
+            if on_wait:
+                await on_wait(position, round(eta))
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.granted is not None:
+                ticket.release()
+            elif not self._withdraw(ticket) and ticket.future.done() and not ticket.future.cancelled():
+                ticket.future.exception()  # Expired meanwhile; mark the exception as retrieved
+            raise
+        return ticket
+
+    @staticmethod
+    def _rejected(reason, channel, position=None, eta=None):
+        ADMISSION_REJECTED.inc(reason=reason)
+        logger.warning("Rejected query from %s (%s): position %s, estimated wait %s", channel, reason, position, eta)
+        return AdmissionRejected(reason)
+
+    def _grant(self, ticket):
+        self._running += 1
+        self._running_by_channel[ticket.channel] = self._running_by_channel.get(ticket.channel, 0) + 1
+        ticket.granted = time.monotonic()
+        if ticket.timer:
+            ticket.timer.cancel()
+        if ticket.future and not ticket.future.done():
+            ticket.future.set_result(ticket)
+
+    def _withdraw(self, ticket):
+        """Take a waiting ticket out of the queue; returns False if it was not waiting."""
+        if ticket not in self._waiting:
+            return False
+        self._waiting.remove(ticket)
+        self._decrement(self._queued_by_channel, ticket.channel)
+        if ticket.timer:
+            ticket.timer.cancel()
+        return True
+
+    def _expire(self, ticket):
+        if self._withdraw(ticket):
+            ADMISSION_REJECTED.inc(reason="expired")
+            logger.warning("Dropped query from %s after waiting %ss for a slot", ticket.channel, self.deadline)
+            if not ticket.future.done():
+                ticket.future.set_exception(AdmissionRejected("expired"))
+
+    def _release(self, ticket):
+        if ticket.released or ticket.granted is None:
+            return
+        ticket.released = True
+        self._running -= 1
+        self._decrement(self._running_by_channel, ticket.channel)
+        held = time.monotonic() - ticket.granted
+        self.service_time += SERVICE_TIME_SMOOTHING * (held - self.service_time)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.concurrency and self._waiting:
+            ticket = min(self._waiting, key=lambda waiting: (
+                not waiting.owner, self._running_by_channel.get(waiting.channel, 0), waiting.sequence))
+            self._withdraw(ticket)
+            self._grant(ticket)
+
+    @staticmethod
+    def _decrement(counts, key):
+        counts[key] -= 1
+        if not counts[key]:
+            del counts[key]
+
+    def stats(self):
+        return {"running": self._running, "waiting": len(self._waiting), "service_time": round(self.service_time, 3)}
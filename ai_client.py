@@ -1,25 +1,245 @@
 # ai_client.py code
 import aiohttp
 import asyncio
+import email.utils
+import random
 import re
 import logging
+import time
+import metrics
+from language_detect import detect_language
+from query_cache import cache_key
+from references import parse_references
+from config import (
+    AI_MODEL, AI_REQUEST_TIMEOUT, AI_DEADLINE, AI_MAX_ATTEMPTS, AI_BACKOFF_BASE, AI_BACKOFF_MAX,
+    AI_BREAKER_FAILURES, AI_BREAKER_COOLDOWN, AI_HEDGE_URL, AI_HEDGE_MODEL, AI_HEDGE_API_KEY, AI_HEDGE_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+AI_REQUESTS = metrics.counter("quranbot_ai_requests_total", "AI endpoint requests by HTTP status", ("status",))
+AI_RETRIES = metrics.counter("quranbot_ai_retries_total", "AI requests retried after a failed attempt")
+AI_COALESCED = metrics.counter("quranbot_ai_coalesced_total", "Queries that joined an identical in-flight request")
+AI_REQUEST_SECONDS = metrics.histogram("quranbot_ai_request_seconds", "Duration of a single AI HTTP request")
+AI_HEDGED = metrics.counter("quranbot_ai_hedged_total", "Queries that also sent a hedge request, by the answering endpoint",
+                            ("winner",))
+AI_BREAKER_SKIPPED = metrics.counter("quranbot_ai_breaker_skipped_total", "Queries not sent because the circuit was open",
+                                     ("endpoint",))
+
+_LANGUAGE_RE = re.compile(r"Language:\s*(\w+)(?::(\w+))?;")
+
+# Upper bound on Ayats taken from a single AI answer.
+MAX_RESPONSE_AYATS = 500
+
+# HTTP statuses worth retrying; any other non-200 status fails the query at once.
+RETRY_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delta-seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures of an endpoint.
+
+    While open, requests are skipped except for one probe every `cooldown` seconds; a
+    successful probe closes the breaker again.
+    """
+
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            return False
+        self.opened_at = now  # Let this request probe; others wait for the next cooldown
+        logger.info("Probing AI endpoint %s after %ss with the circuit open.", self.name, self.cooldown)
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("AI endpoint %s recovered; circuit closed.", self.name)
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None:
+            self.opened_at = time.monotonic()
+        elif self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            logger.warning("AI endpoint %s failed %s times in a row; circuit opened for %ss.",
+                           self.name, self.failures, self.cooldown)
+
+
+class _Endpoint:
+    """A chat-completions URL and model, with its own credentials and circuit breaker."""
+
+    def __init__(self, name, url, model, api_key, breaker):
+        self.name = name
+        self.url = url
+        self.model = model
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.breaker = breaker
+
 
 class AIClient:
-    def __init__(self, api_url, api_key):
+    def __init__(self, api_url, api_key, cache=None, pool_size=10, keepalive_timeout=30,
+                 request_timeout=AI_REQUEST_TIMEOUT, model=AI_MODEL, deadline=AI_DEADLINE,
+                 max_attempts=AI_MAX_ATTEMPTS, backoff_base=AI_BACKOFF_BASE, backoff_max=AI_BACKOFF_MAX,
+                 breaker_failures=AI_BREAKER_FAILURES, breaker_cooldown=AI_BREAKER_COOLDOWN,
+                 hedge_url=AI_HEDGE_URL, hedge_model=AI_HEDGE_MODEL, hedge_api_key=AI_HEDGE_API_KEY,
+                 hedge_delay=AI_HEDGE_DELAY):
         self.api_url = api_url
         self.api_key = api_key
-        self.surah_ayat_patterns = [
-            r"Surah\s*:\s*(\d+)\s*,\s*Ayat\s*:\s*(\d+)",
-            r"(\d+)\s*:\s*(\d+)",
-            r"(\d+)\s*:\s*(\d+)\s*-\s*(\d+)",
-            r"\((\d+)\s*:\s*(\d+)\)",
-            r"\((\d+)\s*:\s*(\d+)\s*-\s*(\d+)\)",
-            r"(\d+)\s*-\s*(\d+)"  # Pattern to match ranges like "62:9-11"
-        ]
-
-    async def query_quran(self, query):
-        payload = {
-            "model": "mistral-small-latest",
+        self.cache = cache  # Optional QueryCache in front of the AI endpoint
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.deadline = deadline  # Seconds a query may spend on the AI, retries and backoff included
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.primary = _Endpoint("primary", api_url, model, api_key,
+                                 CircuitBreaker("primary", breaker_failures, breaker_cooldown))
+        self.hedge = None
+        if hedge_delay > 0 and (hedge_url or hedge_model):
+            self.hedge = _Endpoint("hedge", hedge_url or api_url, hedge_model or model, hedge_api_key or api_key,
+                                   CircuitBreaker("hedge", breaker_failures, breaker_cooldown))
+        self.hedge_delay = hedge_delay
+        self.session = None  # Shared, long-lived HTTP session (see open/close)
+        self._inflight = {}  # Normalized query -> task, for single-flight coalescing
+        metrics.gauge("quranbot_ai_circuit_open", "1 while an AI endpoint's circuit breaker is open",
+                      ("endpoint",)).set_function(
+            lambda: {(endpoint.name,): int(endpoint.breaker.is_open) for endpoint in (self.primary, self.hedge) if endpoint})
+
+    async def open(self):
+        """Create the shared HTTP session with a bounded keep-alive connection pool."""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+            )
+            logger.info("Opened AI HTTP session with pool size %s.", self.pool_size)
+        return self.session
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        self._inflight.clear()
+        if self.session and not self.session.closed:
+            await self.session.close()
+            logger.info("Closed AI HTTP session.")
+        self.session = None
+
+    async def query_quran(self, query, cache_checked=False):
+        """Query the AI, sharing one in-flight request between identical normalized queries.
+
+        `cache_checked` skips the cache lookup for a caller that has just missed it; the answer is
+        still stored.
+        """
+        key = cache_key(query)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._query_cached(query, cache_checked))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget_inflight(key, done))
+        else:
+            AI_COALESCED.inc()
+            logger.info("Coalescing query with in-flight request: %s", key)
+        # Shield the shared task so one waiter's !stop does not cancel the others.
+        return await asyncio.shield(task)
+
+    def _forget_inflight(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    async def _query_cached(self, query, cache_checked=False):
+        if self.cache and not cache_checked:
+            cached = await self.cache.get(query)
+            if cached is not None:
+                return cached
+
+        result = await self._request_quran(query)
+        if self.cache and result:
+            await self.cache.put(query, result)
+        return result
+
+    async def _request_quran(self, query):
+        """Ask the AI within the query's deadline, hedging to the second endpoint when configured.
+
+        Returns the parsed answer, or None when the endpoints failed or are skipped by their
+        circuit breakers (the caller then searches locally). Raises asyncio.TimeoutError when
+        the deadline ran out on a request that timed out.
+        """
+        deadline = asyncio.get_running_loop().time() + self.deadline
+        primary = asyncio.create_task(self._request_endpoint(self.primary, query, deadline))
+        if not self.hedge:
+            return await primary
+        return await self._request_hedged(primary, query, deadline)
+
+    async def _request_hedged(self, primary, query, deadline):
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay)
+            # Hedge when the first request is slow, and fail over when it gave up early.
+            hedge = None
+            if not done or (primary.exception() is None and not primary.result()):
+                logger.info("Primary AI endpoint %s; sending the query to the hedge endpoint.",
+                            "is slow" if not done else "gave no answer")
+                hedge = asyncio.create_task(self._request_endpoint(self.hedge, query, deadline))
+                pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif task.result():
+                        if hedge:
+                            AI_HEDGED.inc(winner=self.hedge.name if task is hedge else self.primary.name)
+                        return task.result()
+            if error is not None:
+                raise error
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff, so retries from many queries do not line up."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _payload(self, query, model):
+        return {
+            "model": model,
             "messages": [
                 {
                     "role": "system",
@@ -39,54 +259,79 @@ class AIClient:
             ]
         }
 
-        logging.info(f"Sending structured query to AI: {payload}")
+    async def _request_endpoint(self, endpoint, query, deadline):
+        """Try `endpoint` until it answers, the attempts or the deadline run out, or its circuit opens."""
+        if not endpoint.breaker.allow():
+            AI_BREAKER_SKIPPED.inc(endpoint=endpoint.name)
+            logger.warning("Skipping AI endpoint %s: circuit open.", endpoint.name)
+            return None
+        payload = self._payload(query, endpoint.model)
+        logger.info("Sending query to AI (%s): %s", endpoint.name, query)
+        logger.debug("AI request payload: %s", payload)
 
-        for attempt in range(10):
+        loop = asyncio.get_running_loop()
+        session = await self.open()
+        status = "error"
+        for attempt in range(self.max_attempts):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            if attempt:
+                AI_RETRIES.inc()
+            status = "error"
+            retry_after = None
+            started = time.perf_counter()
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        self.api_url,
-                        headers={"Authorization": f"Bearer {self.api_key}"},
-                        json=payload,
-                        timeout=10
-                    ) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            logging.info(f"Received response from AI: {data}")
-                            return self.parse_response(data['choices'][0]['message']['content'])
-                        else:
-                            logging.error(f"AI request failed with status code: {response.status}. Retrying...")
+                async with session.post(endpoint.url, json=payload, headers=endpoint.headers,
+                                        timeout=aiohttp.ClientTimeout(total=min(self.request_timeout, remaining))) as response:
+                    status = response.status
+                    if response.status == 200:
+                        data = await response.json()
+                        logger.debug("Received response from AI: %s", data)
+                        endpoint.breaker.record_success()
+                        return self.parse_response(data['choices'][0]['message']['content'], query)
+                    logger.error("AI request to %s failed with status code: %s.", endpoint.name, response.status)
+                    if response.status not in RETRY_STATUSES:
+                        endpoint.breaker.record_failure()
+                        return None
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            except asyncio.CancelledError:
+                status = "cancelled"  # Lost a hedge race, or the query was stopped
+                raise
+            except asyncio.TimeoutError:
+                status = "timeout"
+                logger.error("AI request to %s timed out after %.1fs.", endpoint.name, time.perf_counter() - started)
             except aiohttp.ClientError as e:
-                logging.error(f"Error during AI request: {e}. Retrying...")
+                logger.error("Error during AI request to %s: %s.", endpoint.name, e)
+            finally:
+                AI_REQUESTS.inc(status=status)
+                AI_REQUEST_SECONDS.observe(time.perf_counter() - started)
 
-            await asyncio.sleep(2 ** attempt)  # Exponential backoff
+            endpoint.breaker.record_failure()
+            if endpoint.breaker.is_open:
+                return None
+            delay = max(self._backoff(attempt), retry_after or 0)
+            if attempt + 1 == self.max_attempts or loop.time() + delay >= deadline:
+                break
+            await asyncio.sleep(delay)
 
-        logging.error("Failed to get a valid response after multiple attempts.")
+        if status == "timeout":
+            raise asyncio.TimeoutError()
+        logger.error("No valid AI response from %s within %s attempt(s) and %ss.",
+                     endpoint.name, self.max_attempts, self.deadline)
         return None
 
-    def parse_response(self, response):
-        logging.info(f"Parsing AI response: {response}")
-        language_match = re.search(r"Language:\s*(\w+)(?::(\w+))?;", response)
-        language = language_match.group(1) if language_match else 'arabic'
-        is_rtl = language_match.group(2) == 'RTL' if language_match else False
-        logging.info(f"Extracted language: {language}, RTL: {is_rtl}")
-
-        ayats = []
-        for pattern in self.surah_ayat_patterns:
-            matches = re.findall(pattern, response)
-            for match in matches:
-                if len(match) == 2:
-                    surah = int(match[0])
-                    ayat = int(match[1])
-                    ayats.append((surah, ayat))
-                    logging.info(f"Extracted Surah:Ayat pair: {surah}:{ayat}")
-                elif len(match) == 3:
-                    surah = int(match[0])
-                    start_ayat = int(match[1])
-                    end_ayat = int(match[2])
-                    for ayat in range(start_ayat, end_ayat + 1):
-                        ayats.append((surah, ayat))
-                        logging.info(f"Extracted Surah:Ayat range: {surah}:{start_ayat}-{end_ayat}")
-
-        logging.info(f"All extracted Ayats: {ayats}")
+    def parse_response(self, response, query=""):
+        """Parse the AI's answer; without a "Language:" header the language is detected from `query`."""
+        logger.debug("Parsing AI response: %s", response)
+        language_match = _LANGUAGE_RE.search(response)
+        if language_match:
+            language = language_match.group(1)
+            is_rtl = language_match.group(2) == 'RTL'
+        else:
+            language, is_rtl = detect_language(query)
+        logger.info("Extracted language: %s, RTL: %s", language, is_rtl)
+
+        ayats = parse_references(response, max_total=MAX_RESPONSE_AYATS)
+        logger.info("All extracted Ayats: %s", ayats)
         return {'language': language, 'rtl': is_rtl, 'ayats': ayats}
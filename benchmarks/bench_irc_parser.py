@@ -0,0 +1,128 @@
+"""Measure inbound IRC line throughput (lines/sec) on a busy-network trace.
+
+Compares the previous decode-and-split handling with irc_parser.parse_line on every line and
+with the peek_command fast path that drops unhandled commands before decoding.
+
+Usage: python benchmarks/bench_irc_parser.py [--lines N] [--log bot.log]
+"""
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from irc_parser import HANDLED_COMMANDS, parse_line, peek_command  # noqa: E402
+
+_LOG_RECEIVED_RE = re.compile(r" - DEBUG - Received: (.*)$")
+
+# Rough command mix of a large network channel: mostly membership and mode noise.
+_SYNTHETIC_TEMPLATES = [
+    (30, ":{nick}!~{nick}@{host} JOIN :#{channel}"),
+    (25, ":{nick}!~{nick}@{host} QUIT :Quit: Leaving"),
+    (10, ":{nick}!~{nick}@{host} PART #{channel} :bye"),
+    (8, ":ChanServ!service@dal.net MODE #{channel} +v {nick}"),
+    (5, ":{nick}!~{nick}@{host} NICK :{nick}_away"),
+    (5, ":irc.dal.net 353 Falah = #{channel} :@{nick} +{nick}2 {nick}3 {nick}4"),
+    (2, "@time=2025-03-02T17:45:07.000Z;account={nick} :{nick}!~{nick}@{host} TAGMSG #{channel}"),
+    (12, ":{nick}!~{nick}@{host} PRIVMSG #{channel} :assalam o alaikum everyone, how are you?"),
+    (2, ":{nick}!~{nick}@{host} PRIVMSG #{channel} :!Quran Surah Al-Fateha in Urdu"),
+    (1, "PING :irc.dal.net"),
+]
+
+
+def synthetic_trace(count, seed=7):
+    rng = random.Random(seed)
+    weights = [weight for weight, _ in _SYNTHETIC_TEMPLATES]
+    templates = [template for _, template in _SYNTHETIC_TEMPLATES]
+    lines = []
+    for template in rng.choices(templates, weights, k=count):
+        nick = f"user{rng.randrange(5000)}"
+        line = template.format(nick=nick, host=f"{rng.randrange(255)}.{rng.randrange(255)}.ip",
+                               channel=rng.choice(["Margalla", "Pakistan", "Islam"]))
+        lines.append(line.encode("utf-8") + b"\r\n")
+    return lines
+
+
+def log_trace(path):
+    lines = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for entry in f:
+            match = _LOG_RECEIVED_RE.search(entry.rstrip("\n"))
+            if match:
+                lines.append(match.group(1).encode("utf-8") + b"\r\n")
+    return lines
+
+
+def legacy(lines):
+    """The previous IRCClient.run/handle_message path, including its eager DEBUG f-strings."""
+    handled = 0
+    for data in lines:
+        message = data.decode(errors="replace").strip()
+        if message:
+            logging.debug(f"Received: {message}")
+            logging.debug(f"Handling message: {message}")
+            parts = message.split()
+            if message.startswith("PING"):
+                handled += 1
+            elif len(parts) > 1 and parts[1] in ("001", "433", "439"):
+                handled += 1
+            elif len(parts) > 1 and parts[1] == "PRIVMSG":
+                sender_nick = parts[0].lstrip(':').split('!', 1)[0]
+                target = parts[2].lstrip(':')
+                msg_content = ' '.join(parts[3:]).lstrip(':')
+                handled += bool(sender_nick and target and msg_content is not None)
+    return handled
+
+
+def parse_all(lines):
+    handled = 0
+    for data in lines:
+        message = parse_line(data)
+        if message and message.command.encode() in HANDLED_COMMANDS:
+            handled += 1
+    return handled
+
+
+def fast_path(lines):
+    handled = 0
+    for data in lines:
+        if peek_command(data) not in HANDLED_COMMANDS:
+            continue
+        if parse_line(data):
+            handled += 1
+    return handled
+
+
+def measure(name, fn, lines, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        handled = fn(lines)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<12} {len(lines) / best:>14,.0f} lines/sec  ({handled} handled of {len(lines)})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=200_000, help="synthetic trace length")
+    parser.add_argument("--log", help="also replay 'Received:' lines from a bot.log file")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    traces = [("synthetic", synthetic_trace(args.lines))]
+    if args.log:
+        traces.append((os.path.basename(args.log), log_trace(args.log)))
+    for trace_name, lines in traces:
+        print(f"== {trace_name}: {len(lines)} lines ==")
+        measure("legacy", legacy, lines, args.repeat)
+        measure("parse_line", parse_all, lines, args.repeat)
+        measure("fast_path", fast_path, lines, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""Replay !Quran traffic against QuranIRCBot using a local fake IRC server and a stub AI endpoint.
+
+The fake IRC server registers the bot's connections, echoes its JOINs, injects queries as private messages from
+simulated users and records every PRIVMSG the bot sends. Outbound traffic is checked against a
+per-connection flood bucket, so throttling problems show up as flood events. The stub AI endpoint
+mimics the Mistral chat-completions API with configurable latency and error rate.
+
+Reported: end-to-end query latency and time-to-first-line percentiles, lines/sec out, flood events.
+
+Usage:
+    python benchmarks/load_test.py --queries 50 --rate 2 --ai-latency 0.8 --ai-error-rate 0.05
+    python benchmarks/load_test.py --from-log bot.log --bot-rate 2 --bot-burst 5
+    python benchmarks/load_test.py --queries 40 --rate 4 --connections 3
+    python benchmarks/load_test.py --queries 40 --rate 4 --workers 2
+
+Run from the repository root: bot.py reads logging_config.yaml from the working directory.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BOT_NICK = "QuranBot"
+CHANNEL = "#loadtest"
+
+_LOG_QUERY_RE = re.compile(r"PRIVMSG \S+ :(!Quran\s+.+)$")
+
+SYNTHETIC_QUERIES = [
+    "Surah Al-Fateha in Urdu",
+    "Ayatul Kursi",
+    "Surah Al-Ikhlas in English",
+    "verses about patience",
+    "Yaseen first ten ayat",
+    "what does the Quran say about parents",
+    "2:255",
+    "Surah Al-Baqarah last two ayat",
+    "verses about charity in Bahasa",
+    "story of Musa",
+]
+
+# Canned AI answers; the stub picks one per query deterministically.
+STUB_ANSWERS = [
+    "Language: ur:RTL; 1:1-7",
+    "Language: en:LTR; 2:255",
+    "Language: en:LTR; 112:1-4",
+    "Language: en:LTR; 2:153, 2:155-157, 3:200, 39:10",
+    "Language: en:LTR; 36:1-10",
+    "Language: en:LTR; 17:23-24, 31:14",
+    "Language: en:LTR; 2:285-286",
+    "Language: id:LTR; 2:261-262, 2:274",
+    "Language: en:LTR; 20:9-24",
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_fixture_db(path):
+    """A synthetic Quran database with the real surah/verse layout and placeholder text."""
+    from references import SURAH_AYAT_COUNTS
+
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE surahs (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT, "
+                 "name_en_translation TEXT, type TEXT)")
+    conn.execute("CREATE TABLE arabic (number INTEGER PRIMARY KEY, surah_id INTEGER, number_in_surah INTEGER, text TEXT)")
+    for table in ("english", "urdu", "indonesian"):
+        conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, ayah_id INTEGER, data TEXT)")
+    number = 0
+    for surah, count in enumerate(SURAH_AYAT_COUNTS[1:], 1):
+        conn.execute("INSERT INTO surahs VALUES (?, ?, ?, ?, ?)",
+                     (surah, f"سورة {surah}", f"Surah-{surah}", f"Chapter {surah}",
+                      "Meccan" if surah % 2 else "Medinan"))
+        for ayat in range(1, count + 1):
+            number += 1
+            conn.execute("INSERT INTO arabic VALUES (?, ?, ?, ?)",
+                         (number, surah, ayat, "بِسْمِ ٱللَّهِ ٱلرَّحْمَٰنِ ٱلرَّحِيمِ " * (1 + ayat % 4)))
+            conn.execute("INSERT INTO english (ayah_id, data) VALUES (?, ?)",
+                         (number, f"Placeholder translation of {surah}:{ayat}. " * (1 + ayat % 3)))
+            conn.execute("INSERT INTO urdu (ayah_id, data) VALUES (?, ?)", (number, f"ترجمہ {surah}:{ayat}"))
+            conn.execute("INSERT INTO indonesian (ayah_id, data) VALUES (?, ?)", (number, f"Terjemahan {surah}:{ayat}"))
+    conn.commit()
+    conn.close()
+
+
+class StubAI:
+    """Minimal chat-completions endpoint with latency, jitter and injected errors."""
+
+    def __init__(self, latency, jitter, error_rate, seed):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.runner = None
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        self.requests += 1
+        payload = await request.json()
+        query = payload["messages"][-1]["content"]
+        await asyncio.sleep(max(0.0, self.rng.gauss(self.latency, self.jitter)))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            status = self.rng.choice([429, 500, 503])
+            return web.json_response({"error": "injected"}, status=status, headers={"Retry-After": "1"})
+        answer = STUB_ANSWERS[sum(map(ord, query)) % len(STUB_ANSWERS)]
+        return web.json_response({"choices": [{"message": {"role": "assistant", "content": answer}}]})
+
+    async def start(self, host="127.0.0.1"):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class QueryRecord:
+    __slots__ = ("nick", "query", "sent", "first_line", "done", "lines")
+
+    def __init__(self, nick, query, sent):
+        self.nick = nick
+        self.query = query
+        self.sent = sent
+        self.first_line = None
+        self.done = None
+        self.lines = 0
+
+
+class FakeConnection:
+    """Server-side state of one bot connection, with its own flood bucket."""
+
+    def __init__(self, writer, flood_burst):
+        self.writer = writer
+        self.nick = None
+        self.tokens = float(flood_burst)
+        self.tokens_updated = time.monotonic()
+
+    def send(self, line):
+        if not self.writer.is_closing():
+            self.writer.write(line.encode("utf-8") + b"\r\n")
+
+
+class FakeIRCServer:
+    """Registers the bot's connections, injects queries and records every PRIVMSG they send."""
+
+    def __init__(self, flood_rate, flood_burst):
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.completion_texts = []
+        self.notice_texts = []
+        self.connections = {}  # nick -> FakeConnection
+        self.joined = asyncio.Event()
+        self.records = {}
+        self.lines_out = 0
+        self.lines_by_nick = {}
+        self.first_out = None
+        self.last_out = None
+        self.flood_events = 0
+        self.server = None
+
+    async def start(self, host="127.0.0.1"):
+        self.server = await asyncio.start_server(self.handle_client, host, 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def wait_registered(self, count, timeout=30):
+        deadline = time.monotonic() + timeout
+        while len(self.connections) < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        await asyncio.wait_for(self.joined.wait(), max(0.1, deadline - time.monotonic()))
+
+    def inject_query(self, nick, query):
+        self.records[nick] = QueryRecord(nick, query, time.monotonic())
+        self.connections[BOT_NICK].send(f":{nick}!~{nick}@load.test PRIVMSG {BOT_NICK} :!Quran {query}")
+
+    def _flood_check(self, connection):
+        now = time.monotonic()
+        connection.tokens = min(self.flood_burst, connection.tokens + (now - connection.tokens_updated) * self.flood_rate)
+        connection.tokens_updated = now
+        connection.tokens -= 1
+        if connection.tokens < 0:
+            self.flood_events += 1
+            connection.send(f":fake.server 439 {connection.nick} {CHANNEL} :Target change too fast. Please wait.")
+
+    def on_privmsg(self, connection, target, text):
+        now = time.monotonic()
+        self.lines_out += 1
+        self.lines_by_nick[connection.nick] = self.lines_by_nick.get(connection.nick, 0) + 1
+        self.first_out = self.first_out or now
+        self.last_out = now
+        self._flood_check(connection)
+        record = self.records.get(target)
+        if not record or record.done:
+            return
+        if any(text.startswith(notice) for notice in self.notice_texts):
+            return
+        record.lines += 1
+        if record.first_line is None:
+            record.first_line = now
+        if any(text.startswith(done) for done in self.completion_texts):
+            record.done = now
+
+    async def handle_client(self, reader, writer):
+        connection = FakeConnection(writer, self.flood_burst)
+        while True:
+            data = await reader.readline()
+            if not data:
+                break
+            line = data.decode("utf-8", "replace").rstrip("\r\n")
+            command, _, rest = line.partition(" ")
+            nick = connection.nick
+            if command == "NICK":
+                connection.nick = rest.strip()
+            elif command == "USER":
+                self.connections[nick] = connection
+                connection.send(f":fake.server 001 {nick} :Welcome to the load test {nick}!~{nick}@127.0.0.1")
+            elif command == "JOIN":
+                connection.send(f":{nick}!~{nick}@127.0.0.1 JOIN :{rest}")
+                if nick == BOT_NICK:
+                    self.joined.set()
+            elif command == "PING":
+                connection.send(f":fake.server PONG fake.server {rest}")
+            elif command == "PRIVMSG":
+                target, _, text = rest.partition(" :")
+                self.on_privmsg(connection, target, text)
+
+
+def load_queries(args):
+    if args.from_log:
+        with open(args.from_log, encoding="utf-8", errors="replace") as f:
+            queries = [m.group(1).split(None, 1)[1] for m in map(_LOG_QUERY_RE.search, f) if m]
+        if not queries:
+            sys.exit(f"No !Quran queries found in {args.from_log}")
+    else:
+        queries = SYNTHETIC_QUERIES
+    rng = random.Random(args.seed)
+    return [rng.choice(queries) for _ in range(args.queries)]
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="quranbot-load-")
+    db_path = args.db or os.path.join(workdir, "quran_kb.db")
+    if not args.db:
+        build_fixture_db(db_path)
+
+    stub = StubAI(args.ai_latency, args.ai_jitter, args.ai_error_rate, args.seed)
+    ai_url = await stub.start()
+
+    # config.py reads the environment at import time, so everything is set before importing the bot.
+    from_env = {
+        "IRC_SERVER": "127.0.0.1", "BOT_NICK": BOT_NICK, "BOT_CHANNELS": CHANNEL, "BOT_OWNER": "LoadOwner",
+        "AI_API_URL": ai_url, "AI_API_KEY": "stub", "DB_PATH": db_path,
+        "AI_CACHE_MAX_ENTRIES": "0" if args.no_cache else "5000", "METRICS_PORT": "0",
+    }
+    if args.connections > 1:
+        from_env["IRC_CONNECTIONS"] = ",".join(f"{BOT_NICK}{index}" for index in range(2, args.connections + 1))
+    if args.workers:
+        from_env["QUERY_WORKERS"] = str(args.workers)
+    if args.bot_rate:
+        from_env["OUTBOUND_RATE"] = str(args.bot_rate)
+    if args.bot_burst:
+        from_env["OUTBOUND_BURST"] = str(args.bot_burst)
+
+    server = FakeIRCServer(args.server_rate, args.server_burst)
+    from_env["IRC_PORT"] = str(await server.start())
+    os.environ.update(from_env)
+    import bot as bot_module
+    from config import MESSAGES
+
+    bot_module.configure_logging()
+
+    server.completion_texts = [MESSAGES[key] for key in ("completion_message", "no_results_found", "api_timeout",
+                                                         "wrong_command", "query_shed", "query_expired",
+                                                         "channel_busy")]
+    server.notice_texts = [MESSAGES[key] for key in ("query_queued", "flood_protection")]
+    server.notice_texts.append(MESSAGES["query_position"].split("{")[0])
+    bot = bot_module.QuranIRCBot()
+    bot_task = asyncio.create_task(bot.start())
+    await server.wait_registered(args.connections)
+
+    rng = random.Random(args.seed)
+    queries = load_queries(args)
+    for index in range(len(queries)):
+        # Simulated users have already seen the first-contact help text, so it does not skew the numbers.
+        bot.help_sent[f"user{index}"] = True
+    started = time.monotonic()
+    for index, query in enumerate(queries):
+        server.inject_query(f"user{index}", query)
+        await asyncio.sleep(rng.expovariate(args.rate))
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline and any(r.done is None for r in server.records.values()):
+        await asyncio.sleep(0.1)
+    elapsed = time.monotonic() - started
+
+    bot_task.cancel()
+    try:
+        await bot_task
+    except (asyncio.CancelledError, Exception):
+        pass
+    await bot.pool.quit()
+    if bot._retention_task:
+        bot._retention_task.cancel()
+    if bot.workers:
+        await bot.workers.stop()
+    await bot.ai_client.close()
+    await bot.stats.stop()
+    bot.database.close()
+    await server.stop()
+    await stub.stop()
+    report(args, server, stub, elapsed)
+    if args.stages:
+        import metrics
+
+        print("\n".join(metrics.REGISTRY.summary()))
+
+
+def report(args, server, stub, elapsed):
+    records = list(server.records.values())
+    finished = [r for r in records if r.done is not None]
+    latencies = [r.done - r.sent for r in finished]
+    first_lines = [r.first_line - r.sent for r in records if r.first_line is not None]
+    send_window = (server.last_out - server.first_out) if server.first_out and server.last_out else 0.0
+
+    print(f"queries: {len(records)} sent, {len(finished)} completed, {len(records) - len(finished)} unfinished "
+          f"in {elapsed:.1f}s")
+    print(f"AI stub: {stub.requests} requests, {stub.errors} injected errors")
+    for name, values in (("end-to-end latency", latencies), ("time to first line", first_lines)):
+        if values:
+            print(f"{name:<20} p50={percentile(values, 0.5):.2f}s p90={percentile(values, 0.9):.2f}s "
+                  f"p99={percentile(values, 0.99):.2f}s max={max(values):.2f}s mean={statistics.mean(values):.2f}s")
+        else:
+            print(f"{name:<20} no samples")
+    rate = server.lines_out / send_window if send_window else 0.0
+    per_connection = ", ".join(f"{nick}={count}" for nick, count in sorted(server.lines_by_nick.items()))
+    print(f"lines out: {server.lines_out} ({rate:.2f} lines/sec; {per_connection})")
+    print(f"flood events: {server.flood_events} (server limit {args.server_burst} burst, {args.server_rate}/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=1.0, help="query arrival rate (Poisson, per second)")
+    parser.add_argument("--from-log", help="replay !Quran queries found in a bot.log file")
+    parser.add_argument("--db", help="use an existing Quran database instead of a synthetic fixture")
+    parser.add_argument("--ai-latency", type=float, default=0.8, help="mean stub AI latency in seconds")
+    parser.add_argument("--ai-jitter", type=float, default=0.2)
+    parser.add_argument("--ai-error-rate", type=float, default=0.0)
+    parser.add_argument("--server-rate", type=float, default=0.5, help="fake server flood limit, lines/sec")
+    parser.add_argument("--server-burst", type=int, default=5)
+    parser.add_argument("--connections", type=int, default=1, help="IRC connections the bot opens")
+    parser.add_argument("--workers", type=int, default=0, help="query worker processes (QUERY_WORKERS)")
+    parser.add_argument("--bot-rate", type=float, help="override OUTBOUND_RATE for the bot")
+    parser.add_argument("--bot-burst", type=int, help="override OUTBOUND_BURST for the bot")
+    parser.add_argument("--no-cache", action="store_true", help="disable the persistent AI answer cache")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for results")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stages", action="store_true", help="also print the bot's internal metrics")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
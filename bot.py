@@ -4,35 +4,79 @@ import logging
 import logging.config
 import yaml
 import os
+import re
 import sys
 import time
+from contextlib import aclosing
 
-from irc_client import IRCClient
+import metrics
+from admission import AdmissionController, AdmissionRejected
+from irc_pool import ConnectionPool, parse_connection_spec, parse_server_list
 from ai_client import AIClient
 from database import Database
+from query_cache import QueryCache
+from render_cache import RenderCache
+from stats_aggregator import StatsAggregator
+from linepack import pack_lines, split_text
+from metrics import MetricsExporter
+from query_pipeline import is_phrase_query, local_search, render_verse_lines, response_pairs
+from query_workers import WorkerPool
+from resolver import Resolver
+from outbound_journal import OutboundJournal
+from outbound import PRIORITY_CONTROL, PRIORITY_OWNER, PRIORITY_NORMAL, PRIORITY_BULK
 from utils import setup_logging
 from config import (
-    IRC_SERVER, IRC_PORT, BOT_NICK, BOT_PASSWORD, BOT_CHANNELS, BOT_OWNER,
-    AI_API_URL, AI_API_KEY, DB_PATH, MESSAGES, HELP_CONTENT, LANGUAGE_TABLE_MAPPING
+    IRC_SERVER, IRC_PORT, BOT_NICK, ALT_NICK, BOT_PASSWORD, BOT_CHANNELS, BOT_OWNER, IRC_CONNECTIONS, IRC_FALLBACK_SERVERS,
+    AI_API_URL, AI_API_KEY, DB_PATH, MESSAGES, HELP_CONTENT, LANGUAGE_TABLE_MAPPING,
+    AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES, AI_POOL_SIZE, AI_KEEPALIVE_TIMEOUT, CORPUS_MEMORY_CAP, RENDER_CACHE_MAX_BYTES,
+    STATS_FLUSH_INTERVAL, STATS_FLUSH_EVENTS, METRICS_HOST, METRICS_PORT, METRICS_FILE, METRICS_DUMP_INTERVAL,
+    QUERY_WORKERS, QUERY_CONCURRENCY, QUERY_QUEUE_MAX, QUERY_CHANNEL_QUOTA, QUERY_DEADLINE, QUERY_SHED_LATENCY,
+    QUERY_HISTORY_RETENTION_DAYS, QUERY_HOURLY_RETENTION_DAYS, QUERY_RETENTION_INTERVAL, OUTBOUND_RESUME_MAX_AGE
 )
 
-# Load logging configuration
-with open('logging_config.yaml', 'r') as f:
-    logging_config = yaml.safe_load(f)
-    setup_logging(logging_config)
+def configure_logging(path='logging_config.yaml'):
+    """Load the logging configuration. Only the bot process calls this: query workers are spawned
+    and re-import this module as __mp_main__, and they ship their records to the bot process instead."""
+    with open(path, 'r') as f:
+        return setup_logging(yaml.safe_load(f))
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+# bot.py runs as __main__, so its logger is named explicitly.
+logger = logging.getLogger("bot")
+
+QUERY_STAGE_SECONDS = metrics.histogram("quranbot_query_stage_seconds", "Time spent in each stage of a !Quran query",
+                                        ("stage",))
+QUERIES = metrics.counter("quranbot_queries_total", "!Quran queries by outcome", ("outcome",))
+
+# !counts time windows such as 24h, 7d or 4w.
+COUNTS_WINDOW_RE = re.compile(r"^(\d+)([hdw])$", re.IGNORECASE)
+COUNTS_WINDOW_UNITS = {"h": 3600, "d": 86400, "w": 7 * 86400}
 
 class QuranIRCBot:
     def __init__(self):
-        self.semaphore = asyncio.Semaphore(5)
-        self.irc_client = IRCClient(IRC_SERVER, IRC_PORT, BOT_NICK, BOT_PASSWORD, BOT_CHANNELS)
-        self.ai_client = AIClient(AI_API_URL, AI_API_KEY)
+        self.admission = AdmissionController(QUERY_CONCURRENCY, QUERY_QUEUE_MAX, QUERY_CHANNEL_QUOTA,
+                                             QUERY_DEADLINE, QUERY_SHED_LATENCY)
+        specs = [parse_connection_spec(entry, IRC_SERVER, IRC_PORT, BOT_PASSWORD)
+                 for entry in [BOT_NICK] + IRC_CONNECTIONS]
+        self.pool = ConnectionPool.from_specs(specs, BOT_CHANNELS, alt_nick=ALT_NICK,
+                                              fallback_servers=parse_server_list(IRC_FALLBACK_SERVERS, IRC_PORT))
         self.database = Database(DB_PATH)
+        self.database.load_corpus(CORPUS_MEMORY_CAP)
+        self.resolver = Resolver.from_database(self.database)
+        self.stats = StatsAggregator(self.database, STATS_FLUSH_INTERVAL, STATS_FLUSH_EVENTS)
+        self.query_cache = QueryCache(self.database, AI_CACHE_TTL, AI_CACHE_MAX_ENTRIES)
+        self.render_cache = RenderCache(self.database, RENDER_CACHE_MAX_BYTES)
+        # Unsent result lines are journaled so they can be resumed after a reconnect or restart.
+        self.journal = OutboundJournal(self.database, OUTBOUND_RESUME_MAX_AGE) if OUTBOUND_RESUME_MAX_AGE > 0 else None
+        self.pool.set_journal(self.journal)
+        self.ai_client = AIClient(AI_API_URL, AI_API_KEY, cache=self.query_cache,
+                                  pool_size=AI_POOL_SIZE, keepalive_timeout=AI_KEEPALIVE_TIMEOUT)
+        self.metrics_exporter = MetricsExporter(METRICS_HOST, METRICS_PORT, METRICS_FILE or None, METRICS_DUMP_INTERVAL)
+        # Optional worker processes for AI lookups and verse formatting; the cache stays here.
+        self.workers = None
+        if QUERY_WORKERS > 0:
+            self.workers = WorkerPool(QUERY_WORKERS, DB_PATH, CORPUS_MEMORY_CAP, dict(
+                api_url=AI_API_URL, api_key=AI_API_KEY, pool_size=AI_POOL_SIZE, keepalive_timeout=AI_KEEPALIVE_TIMEOUT))
+        self._retention_task = None
         self.commands = {
             '!Quran': self.handle_quran,
             '!stop': self.handle_stop,
@@ -41,6 +85,8 @@ class QuranIRCBot:
             '!join': self.handle_join,
             '!part': self.handle_part,
             '!counts': self.handle_counts,
+            '!corpus': self.handle_corpus,
+            '!stats': self.handle_stats,
             '!msg': self.handle_msg
         }
         self.forward_bot_nick = 'Cheer'
@@ -48,19 +94,24 @@ class QuranIRCBot:
         self.active_tasks = {}
         self.help_sent = {}
         self.private_query_success = set()
-        self.irc_client.set_bot(self)
+        self.pool.set_bot(self)
 
     async def start(self):
-        logging.info("Starting the bot...")
-        await self.irc_client.connect()
-        await self.irc_client.run()
+        logger.info("Starting the bot...")
+        await self.ai_client.open()
+        self.stats.start()
+        await self.metrics_exporter.start()
+        self._retention_task = asyncio.create_task(self.run_query_retention())
+        if self.workers:
+            self.workers.start()
+        await self.pool.run()
 
     async def handle_quran(self, nick, channel, query):
-        logging.info(f"Handling !Quran command from {nick} in {channel} with query: {query}")
+        logger.info("Handling !Quran command from %s in %s with query: %s", nick, channel, query)
         # Enforce one active query per user.
         if nick in self.active_tasks:
-            logging.warning(f"Existing query detected for {nick}. Sending query_exists message.")
-            await self.irc_client.send_message(channel, MESSAGES["query_exists"])
+            logger.warning("Existing query detected for %s. Sending query_exists message.", nick)
+            await self.pool.client_for(channel).send_message(channel, MESSAGES["query_exists"], PRIORITY_CONTROL)
             return
 
         # Create and store the active query task.
@@ -71,122 +122,312 @@ class QuranIRCBot:
         try:
             await task
             success = True
-            await asyncio.to_thread(self.database.update_user_stats, nick, 0, 1, 0, time.time())
+            self.stats.record_user(nick, 0, 1, 0, time.time())
             # Do NOT send completion message here; process_quran_query sends it.
         except asyncio.CancelledError:
             success = False
-            logging.info(f"Query for {nick} was cancelled.")
-            await self.irc_client.send_message(channel, MESSAGES["stop_success"])
-            await asyncio.to_thread(self.database.update_user_stats, nick, 0, 0, 1, time.time())
+            logger.info("Query for %s was cancelled.", nick)
+            if not self.active_tasks.get(nick, {}).get("abandoned"):
+                await self.pool.client_for(channel).send_message(channel, MESSAGES["stop_success"], PRIORITY_CONTROL)
+            self.stats.record_user(nick, 0, 0, 1, time.time())
             raise
         except Exception as e:
             success = False
-            logging.error(f"Query failed for {nick}: {str(e)}")
-            await self.irc_client.send_message(channel, MESSAGES["no_results_found"])
-            await asyncio.to_thread(self.database.update_user_stats, nick, 0, 0, 1, time.time())
+            logger.error("Query failed for %s: %s", nick, e)
+            await self.pool.client_for(channel).send_message(channel, MESSAGES["no_results_found"], PRIORITY_BULK, nick)
+            self.stats.record_user(nick, 0, 0, 1, time.time())
         finally:
             # Log the query into the query_history table.
             chunks_sent = self.active_tasks[nick]["chunks_sent"] if nick in self.active_tasks else 0
+            self.end_journal_result(channel, nick)
             await asyncio.to_thread(self.database.log_query, nick, channel, query, success, chunks_sent)
-            logging.info(f"Cleaning up resources for {nick}.")
+            logger.info("Cleaning up resources for %s.", nick)
             self.active_tasks.pop(nick, None)
 
     async def process_quran_query(self, nick, channel, query):
         target = channel
-        logging.info(f"Processing query for {nick} in {channel} with query: {query}")
+        logger.info("Processing query for %s in %s with query: %s", nick, channel, query)
         if not query:
-            logging.warning("Empty query for !Quran command.")
-            await self.irc_client.send_message(target, MESSAGES["wrong_command"])
+            logger.warning("Empty query for !Quran command.")
+            await self.pool.client_for(target).send_message(target, MESSAGES["wrong_command"], PRIORITY_CONTROL)
             return
-        if channel != BOT_NICK:
-            await self.irc_client.send_message(target, MESSAGES["query_queued"])
+        if not self.pool.is_own_nick(channel):
+            await self.pool.client_for(target).send_message(target, MESSAGES["query_queued"], PRIORITY_CONTROL)
+        started = time.perf_counter()
+        outcome = "no_results"
         try:
-            async with self.semaphore:
-                response = await self.ai_client.query_quran(query)
-            logging.info(f"Received AI response: {response}")
-            if self._should_cancel(nick):
-                logging.info(f"Query for {nick} was cancelled after AI response.")
-                raise asyncio.CancelledError()
-            if response:
-                language = response.get('language', 'arabic')
-                is_rtl = response.get('rtl', False)
-                ayats_info = sorted(set(response.get('ayats', [])), key=lambda x: (x[0], x[1]))
-                logging.info(f"Extracted language: {language}, RTL: {is_rtl}, Ayats: {ayats_info}")
-                if ayats_info:
-                    formatted_response = self.database.fetch_ayats(ayats_info, language, is_rtl)
-                    logging.info(f"Formatted response from database: {formatted_response}")
-                    if formatted_response:
-                        grouped_ayats = self.group_ayats_by_surah(formatted_response)
-                        for surah_name, ayats in grouped_ayats.items():
-                            await self.irc_client.send_message(target, surah_name)
-                            for ayat in ayats:
-                                if self._should_cancel(nick):
-                                    logging.info(f"Query for {nick} cancelled during chunking.")
-                                    raise asyncio.CancelledError()
-                                await self.send_chunked_message(target, ayat, nick)
-                                self.active_tasks[nick]["chunks_sent"] += 1
-                        await self.irc_client.send_message(target, MESSAGES["completion_message"])
-                        if channel == nick and nick not in self.private_query_success:
-                            logging.info(f"Sending channel invite to {nick} after successful query.")
-                            await self.irc_client.send_message(target, MESSAGES["channel_invite"])
-                            self.private_query_success.add(nick)
-                    else:
-                        logging.warning("Formatted response is empty.")
-                        await self.irc_client.send_message(target, MESSAGES["no_results_found"])
-                else:
-                    logging.warning("No Ayats found in AI response.")
-                    await self.irc_client.send_message(target, MESSAGES["no_results_found"])
+            if self.workers:
+                response, lines_sent = await self.process_in_worker(target, nick, query)
             else:
-                logging.warning("AI response is empty or invalid.")
-                await self.irc_client.send_message(target, MESSAGES["no_results_found"])
+                response, lines_sent = await self.process_locally(target, nick, query)
+            outcome = await self.send_result_status(target, nick, response, lines_sent)
+        except AdmissionRejected as e:
+            outcome = e.reason
+            await self.pool.client_for(target).send_message(target, MESSAGES[e.message_key], PRIORITY_CONTROL)
         except asyncio.TimeoutError:
-            logging.error("AI request timed out.")
-            await self.irc_client.send_message(target, MESSAGES["api_timeout"])
+            outcome = "timeout"
+            logger.error("AI request timed out.")
+            await self.pool.client_for(target).send_message(target, MESSAGES["api_timeout"], PRIORITY_BULK, nick)
         except asyncio.CancelledError:
+            outcome = "cancelled"
             raise
         except Exception as e:
-            logging.error(f"Error processing !Quran command: {e}")
-            await self.irc_client.send_message(target, MESSAGES["wrong_command"])
+            outcome = "error"
+            logger.error("Error processing !Quran command: %s", e)
+            await self.pool.client_for(target).send_message(target, MESSAGES["wrong_command"], PRIORITY_BULK, nick)
+        finally:
+            QUERIES.inc(outcome=outcome)
+            QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="total")
         # Note: Active task cleanup is handled by handle_quran.
 
+    async def process_locally(self, target, nick, query):
+        """Answer `query` in this process and send its verses; returns (response, lines sent)."""
+        response = self.resolve_locally(query)
+        if response is None and is_phrase_query(query):
+            # Exact phrases are answered from the local full-text index without the AI.
+            with QUERY_STAGE_SECONDS.time(stage="local_search"):
+                response = await local_search(self.database, query)
+        elif response is None:
+            response = await self.query_cache.get(query)
+            if response is None:
+                # Only a cache miss takes an admission slot, so cached answers never queue behind the AI.
+                ticket = await self.admit_query(target, nick)
+                try:
+                    with QUERY_STAGE_SECONDS.time(stage="ai"):
+                        response = await self.ai_client.query_quran(query, cache_checked=True)
+                finally:
+                    ticket.release()
+                if not response:
+                    logger.warning("AI response unavailable, falling back to local search.")
+                    with QUERY_STAGE_SECONDS.time(stage="local_search"):
+                        response = await local_search(self.database, query)
+        logger.info("Received AI response: %s", response)
+        if self._should_cancel(nick):
+            logger.info("Query for %s was cancelled after AI response.", nick)
+            raise asyncio.CancelledError()
+        if not response or not response.get('ayats'):
+            return response, 0
+        language = response.get('language', 'arabic')
+        is_rtl = response.get('rtl', False)
+        ayats_info = response_pairs(response)
+        logger.info("Extracted language: %s, RTL: %s, Ayats: %s", language, is_rtl, ayats_info)
+        with QUERY_STAGE_SECONDS.time(stage="send"):
+            lines_sent = await self.send_verse_lines(target, nick, ayats_info, language, is_rtl)
+        return response, lines_sent
+
+    async def process_in_worker(self, target, nick, query):
+        """Answer `query` in a worker process and send the lines it streams back; returns (response, lines sent)."""
+        cached = self.resolve_locally(query)
+        if cached is None and not is_phrase_query(query):
+            cached = await self.query_cache.get(query)
+        budget = self.pool.client_for(target).line_budget(target)
+        key = rendered = None
+        if cached and cached.get('ayats'):
+            key = self.render_key(cached, budget)
+            rendered = self.render_cache.get(key)
+            if rendered:
+                # A known answer already rendered for this budget needs no worker at all.
+                self.journal_result(target, nick, response_pairs(cached), cached.get('language', 'arabic'),
+                                    cached.get('rtl', False), budget)
+                return cached, await self.send_rendered_lines(target, nick, rendered)
+        # Only queries that may reach the AI take an admission slot, held until the answer is in.
+        ticket = await self.admit_query(target, nick) if cached is None and not is_phrase_query(query) else None
+        started = time.perf_counter()
+        response = None
+        lines = []
+        sent = 0
+        try:
+            async with aclosing(self.workers.run(query, budget, cached)) as events:
+                async for kind, *payload in events:
+                    if kind == "response":
+                        if ticket:
+                            ticket.release()
+                        response, fresh = payload
+                        QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="worker")
+                        logger.info("Received AI response: %s", response)
+                        if fresh:
+                            await self.query_cache.put(query, response)
+                        if self._should_cancel(nick):
+                            logger.info("Query for %s was cancelled after AI response.", nick)
+                            raise asyncio.CancelledError()
+                        if response and response.get('ayats'):
+                            self.journal_result(target, nick, response_pairs(response),
+                                                response.get('language', 'arabic'), response.get('rtl', False), budget)
+                            if key is None:
+                                key = self.render_key(response, budget)
+                                rendered = self.render_cache.get(key)
+                                if rendered:
+                                    break  # Closing the event stream cancels the worker's rendering
+                        started = time.perf_counter()
+                    else:
+                        if not sent:
+                            QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="first_line")
+                        await self.send_line(target, payload[0], nick, PRIORITY_BULK)
+                        lines.append(payload[0])
+                        sent += 1
+                else:
+                    if key and lines:
+                        self.render_cache.put(key, lines)
+        finally:
+            if ticket:
+                ticket.release()
+        if rendered:
+            return response, await self.send_rendered_lines(target, nick, rendered)
+        if sent:
+            QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="send")
+        return response, sent
+
+    def render_key(self, response, budget):
+        return self.render_cache.key(response_pairs(response), response.get('language', 'arabic'),
+                                     response.get('rtl', False), budget)
+
+    def resolve_locally(self, query):
+        """Answer plain Surah names and verse references without the AI, or return None."""
+        with QUERY_STAGE_SECONDS.time(stage="resolve"):
+            response = self.resolver.resolve(query)
+        if response:
+            logger.info("Resolved query locally to %s Ayat(s): %s", len(response['ayats']), query)
+        return response
+
+    async def admit_query(self, target, nick):
+        """Wait for an AI slot, telling the user their queue position and ETA if they have to wait."""
+        async def report_position(position, eta):
+            await self.pool.client_for(target).send_message(
+                target, MESSAGES["query_position"].format(position=position, eta=eta), PRIORITY_CONTROL)
+
+        queued = time.perf_counter()
+        ticket = await self.admission.admit(target, owner=self.is_owner(nick), on_wait=report_position)
+        QUERY_STAGE_SECONDS.observe(time.perf_counter() - queued, stage="queue_wait")
+        return ticket
+
+    async def send_result_status(self, target, nick, response, lines_sent):
+        """Close a query with the completion or no-results message; returns the query outcome."""
+        self.end_journal_result(target, nick)  # Every result line is queued; a restart replays the rest as is
+        client = self.pool.client_for(target)
+        if lines_sent:
+            await client.send_message(target, MESSAGES["completion_message"], PRIORITY_BULK, nick)
+            if target == nick and nick not in self.private_query_success:
+                logger.info("Sending channel invite to %s after successful query.", nick)
+                await client.send_message(target, MESSAGES["channel_invite"], PRIORITY_BULK, nick)
+                self.private_query_success.add(nick)
+            return "success"
+        if not response:
+            logger.warning("AI response is empty or invalid.")
+        elif not response.get('ayats'):
+            logger.warning("No Ayats found in AI response.")
+        else:
+            logger.warning("None of the extracted Ayats were found in the database.")
+        await client.send_message(target, MESSAGES["no_results_found"], PRIORITY_BULK, nick)
+        return "no_results"
+
+    def abandon_query(self, nick):
+        """Stop `nick`'s running query without the usual stop notice; its connection has already
+        told the user the result could not be resumed."""
+        task_data = self.active_tasks.get(nick)
+        if task_data and not task_data["task"].done():
+            task_data["cancel_requested"] = True
+            task_data["abandoned"] = True
+            task_data["task"].cancel()
+
     def _should_cancel(self, nick):
-        logging.debug(f"Checking if query should be cancelled for {nick}.")
         return self.active_tasks.get(nick, {}).get("cancel_requested", False)
 
-    def group_ayats_by_surah(self, formatted_response):
-        logging.debug("Grouping ayats by surah.")
-        grouped_ayats = {}
-        current_surah = None
-        for line in formatted_response:
-            if line.startswith("Surah"):
-                current_surah = line
-                grouped_ayats[current_surah] = []
-            elif current_surah and line.startswith("Ayat"):
-                grouped_ayats[current_surah].append(line)
-            elif current_surah and line.startswith("Translation"):
-                grouped_ayats[current_surah].append(line)
-        return grouped_ayats
+    def journal_result(self, target, nick, surah_ayat_pairs, language, is_rtl, budget):
+        """Journal what a result is rendered from, so a restart can send the lines it never queued."""
+        if self.journal:
+            self.journal.begin_result(self.pool.client_for(target).name, target, nick, surah_ayat_pairs,
+                                      language, is_rtl, budget)
+
+    def end_journal_result(self, target, nick):
+        if self.journal:
+            self.journal.end_result(self.pool.client_for(target).name, target, nick)
+
+    def resume_result(self, target, nick, result):
+        """Send the rest of a result an earlier run was cut off in the middle of, as a query !stop can stop."""
+        if nick in self.active_tasks:
+            logger.warning("Not resuming result for %s in %s: a newer query is running.", nick, target)
+            return
+        task = asyncio.create_task(self.continue_result(target, nick, result))
+        self.active_tasks[nick] = {"task": task, "cancel_requested": False, "chunks_sent": 0}
+
+    async def continue_result(self, target, nick, result):
+        surah_ayat_pairs, language, is_rtl, budget, queued = result
+        logger.info("Continuing result for %s in %s after %s journaled line(s).", nick, target, queued)
+        try:
+            rendered = 0
+            # Rendering again with the journaled budget reproduces the earlier run's lines exactly.
+            async with aclosing(render_verse_lines(self.database, surah_ayat_pairs, language, is_rtl,
+                                                   budget)) as lines:
+                async for line in lines:
+                    rendered += 1
+                    if rendered > queued:
+                        await self.send_line(target, line, nick, PRIORITY_BULK)
+            await self.send_result_status(target, nick, {'ayats': surah_ayat_pairs}, rendered)
+        except asyncio.CancelledError:
+            logger.info("Resumed result for %s was cancelled.", nick)
+            raise
+        except Exception as e:
+            logger.error("Resuming result failed for %s: %s", nick, e)
+            await self.pool.client_for(target).send_message(target, MESSAGES["no_results_found"], PRIORITY_BULK, nick)
+        finally:
+            self.end_journal_result(target, nick)
+            self.active_tasks.pop(nick, None)
+
+    async def send_verse_lines(self, target, nick, surah_ayat_pairs, language, is_rtl):
+        """Stream verses from the database into the outbound queue and return the number of lines sent.
+
+        Results already rendered for this budget are sent from the render cache; a fresh result is
+        cached once all of its lines have been sent.
+        """
+        budget = self.pool.client_for(target).line_budget(target)
+        key = self.render_cache.key(surah_ayat_pairs, language, is_rtl, budget)
+        self.journal_result(target, nick, surah_ayat_pairs, language, is_rtl, budget)
+        rendered = self.render_cache.get(key)
+        if rendered:
+            return await self.send_rendered_lines(target, nick, rendered)
+        started = time.perf_counter()
+        sent = []
+        async with aclosing(render_verse_lines(self.database, surah_ayat_pairs, language, is_rtl, budget)) as lines:
+            async for line in lines:
+                if not sent:
+                    QUERY_STAGE_SECONDS.observe(time.perf_counter() - started, stage="first_line")
+                await self.send_line(target, line, nick, PRIORITY_BULK)
+                sent.append(line)
+        self.render_cache.put(key, sent)
+        return len(sent)
+
+    async def send_rendered_lines(self, target, nick, lines):
+        """Send lines from the render cache; returns the number sent."""
+        logger.info("Sending %s cached result line(s) to %s.", len(lines), target)
+        with QUERY_STAGE_SECONDS.time(stage="send_cached"):
+            for line in lines:
+                await self.send_line(target, line, nick, PRIORITY_BULK)
+        return len(lines)
 
     async def handle_stop(self, nick, channel, query):
-        logging.info(f"Handling stop command from {nick} in {channel}.")
-        target = channel if channel != BOT_NICK else nick
+        logger.info("Handling stop command from %s in %s.", nick, channel)
+        target = nick if self.pool.is_own_nick(channel) else channel
         try:
             if nick in self.active_tasks:
                 task_data = self.active_tasks[nick]
                 task_data["cancel_requested"] = True
+                self.pool.discard(target, tag=nick)
                 if not task_data["task"].done():
                     task_data["task"].cancel()
-                    await self.irc_client.send_message(target, MESSAGES["stop_success"])
+                    await self.pool.client_for(target).send_message(target, MESSAGES["stop_success"], PRIORITY_CONTROL)
                 else:
-                    await self.irc_client.send_message(target, MESSAGES["stop_failure"])
+                    await self.pool.client_for(target).send_message(target, MESSAGES["stop_failure"], PRIORITY_CONTROL)
+            elif self.pool.discard(target, tag=nick):
+                # A result resumed after a reconnect or restart has no running query left to cancel.
+                await self.pool.client_for(target).send_message(target, MESSAGES["stop_success"], PRIORITY_CONTROL)
             else:
-                await self.irc_client.send_message(target, MESSAGES["stop_failure"])
+                await self.pool.client_for(target).send_message(target, MESSAGES["stop_failure"], PRIORITY_CONTROL)
         except Exception as e:
-            logging.error(f"Error stopping query for {nick}: {e}")
-            await self.irc_client.send_message(target, MESSAGES["stop_failure"])
+            logger.error("Error stopping query for %s: %s", nick, e)
+            await self.pool.client_for(target).send_message(target, MESSAGES["stop_failure"], PRIORITY_CONTROL)
 
     async def handle_help(self, nick, channel, query):
-        logging.info(f"Handling help command from {nick} in {channel}.")
+        logger.info("Handling help command from %s in %s.", nick, channel)
         content_type = 'private' if nick == channel else 'channel'
         content_lines = HELP_CONTENT.get(content_type, [MESSAGES["wrong_command"]])
         for line in content_lines:
@@ -197,9 +438,10 @@ class QuranIRCBot:
             )
 
     async def handle_quit(self, nick, channel, query):
-        logging.info(f"Handling quit command from {nick} in {channel}.")
+        logger.info("Handling quit command from %s in %s.", nick, channel)
         if self.is_owner(nick) and channel == BOT_OWNER:
-            await self.irc_client.send_message(channel, MESSAGES["shutting_down"])
+            self.pool.discard()
+            await self.pool.client_for(channel).send_message(channel, MESSAGES["shutting_down"], PRIORITY_OWNER)
             for task_data in list(self.active_tasks.values()):
                 task_data["cancel_requested"] = True
                 if not task_data["task"].done():
@@ -207,43 +449,99 @@ class QuranIRCBot:
             await self.shutdown()
 
     async def handle_join(self, nick, channel, query):
-        logging.debug(f"Configured owner: {BOT_OWNER}, Command sender: {nick}, Channel: {channel}")
+        logger.debug("Configured owner: %s, Command sender: %s, Channel: %s", BOT_OWNER, nick, channel)
         if self.is_owner(nick) and channel == BOT_OWNER and query:
-            logging.info(f"Attempting to join channel: {query}")
-            await self.irc_client.join_channel(query)
-            await asyncio.to_thread(self.database.update_channel_stats, query, 0, time.time())
+            logger.info("Attempting to join channel: %s", query)
+            await self.pool.least_busy(self.pool.primary.server).join_channel(query)
+            self.stats.record_channel(query, 0, time.time())
 
     async def handle_part(self, nick, channel, query):
-        logging.debug(f"Configured owner: {BOT_OWNER}, Command sender: {nick}, Channel: {channel}")
+        logger.debug("Configured owner: %s, Command sender: %s, Channel: %s", BOT_OWNER, nick, channel)
         if self.is_owner(nick) and channel == BOT_OWNER and query:
-            logging.info(f"Attempting to leave channel: {query}")
-            await self.irc_client.part_channel(query)
-            await asyncio.to_thread(self.database.update_channel_stats, query, 0, time.time())
+            logger.info("Attempting to leave channel: %s", query)
+            await self.pool.for_channel(query).part_channel(query)
+            self.stats.record_channel(query, 0, time.time())
 
     async def handle_counts(self, nick, channel, query):
-        logging.info(f"Handling counts command from {nick} in {channel}.")
+        """!counts [#channel] [24h|7d|4w]: query totals and the busiest users and channels."""
+        logger.info("Handling counts command from %s in %s.", nick, channel)
+        if not (self.is_owner(nick) and channel == BOT_OWNER):
+            return
+        client = self.pool.client_for(nick)
+        since = scope_channel = None
+        scope = []
+        for word in query.split():
+            window = COUNTS_WINDOW_RE.match(word)
+            if window and since is None:
+                since = time.time() - int(window.group(1)) * COUNTS_WINDOW_UNITS[window.group(2).lower()]
+                scope.append(f"last {word.lower()}")
+            elif word[0] in "#&" and scope_channel is None:
+                scope_channel = word
+                scope.insert(0, word)
+            else:
+                await client.send_message(nick, MESSAGES["counts_usage"], PRIORITY_OWNER)
+                return
+        try:
+            counts = await asyncio.to_thread(self.database.get_usage_counts, since, scope_channel)
+        except Exception as e:
+            logger.error("Failed to fetch usage counts: %s", e)
+            await client.send_message(nick, MESSAGES["counts_failure"].format(error=e), PRIORITY_OWNER)
+            return
+        message = MESSAGES["usage_counts"].format(
+            scope=f" ({', '.join(scope)})" if scope else "",
+            total=counts["total_count"], successful=counts["successful"],
+            users=", ".join(f"{name} {count}" for name, count in counts["user_counts"]) or "-",
+            channels=", ".join(f"{name} {count}" for name, count in counts["channel_counts"]) or "-")
+        await self.send_chunked_message(nick, message, nick, priority=PRIORITY_OWNER)
+
+    async def run_query_retention(self):
+        """Archive old query history and prune old hourly counts every QUERY_RETENTION_INTERVAL seconds."""
+        while True:
+            now = time.time()
+            raw_before = now - QUERY_HISTORY_RETENTION_DAYS * 86400 if QUERY_HISTORY_RETENTION_DAYS > 0 else None
+            try:
+                archived, dropped = await asyncio.to_thread(
+                    self.database.compact_query_history, raw_before, now - QUERY_HOURLY_RETENTION_DAYS * 86400)
+                if archived or dropped:
+                    logger.info("Archived %s query history row(s) and dropped %s hourly count row(s).",
+                                archived, dropped)
+            except Exception as e:
+                logger.error("Query history retention failed: %s", e)
+            await asyncio.sleep(QUERY_RETENTION_INTERVAL)
+
+    async def handle_corpus(self, nick, channel, query):
+        logger.info("Handling corpus command from %s in %s.", nick, channel)
         if self.is_owner(nick) and channel == BOT_OWNER:
-            counts = self.database.get_usage_counts()
-            await self.irc_client.send_message(nick, f"Usage counts: {counts}")
+            report = self.database.corpus.memory_report() if self.database.corpus else {}
+            report['rendered_results'] = self.render_cache.bytes
+            await self.pool.client_for(nick).send_message(nick, MESSAGES["corpus_memory"].format(report=report), PRIORITY_OWNER)
+
+    async def handle_stats(self, nick, channel, query):
+        logger.info("Handling stats command from %s in %s.", nick, channel)
+        if self.is_owner(nick) and channel == BOT_OWNER:
+            lines = metrics.REGISTRY.summary() or [MESSAGES["stats_empty"]]
+            for line in lines:
+                await self.send_chunked_message(nick, line, nick, priority=PRIORITY_OWNER)
 
     async def handle_msg(self, nick, channel, query):
-        logging.info(f"Handling msg command from {nick} in {channel} with query: {query}.")
+        logger.info("Handling msg command from %s in %s with query: %s.", nick, channel, query)
         if self.is_owner(nick) and channel == BOT_OWNER and ' ' in query:
             target, message = query.split(' ', 1)
-            await self.send_chunked_message(target, message, nick)
+            await self.send_chunked_message(target, message, nick, priority=PRIORITY_OWNER)
 
-    async def on_message(self, nick, channel, message):
-        logging.debug(f"Processing message: nick={nick}, channel={channel}, message={message}")
-        await asyncio.to_thread(self.database.update_channel_stats, channel, 1, time.time())
-        await asyncio.to_thread(self.database.update_user_stats, nick, 1, 0, 0, time.time())
-        if channel == BOT_NICK:
+    async def on_message(self, client, nick, channel, message):
+        logger.debug("Processing message: nick=%s, channel=%s, message=%s", nick, channel, message)
+        self.stats.record_channel(channel, 1, time.time())
+        self.stats.record_user(nick, 1, 0, 0, time.time())
+        if channel.casefold() == client.nick.casefold():
             target = nick
+            self.pool.route_private(nick, client, keep=nick in self.active_tasks)
             if nick not in self.help_sent:
                 self.help_sent[nick] = True
                 await self.handle_help(nick, nick, '')
         else:
             target = channel
-            if BOT_NICK in message and nick not in self.help_sent:
+            if client.nick in message and nick not in self.help_sent:
                 self.help_sent[nick] = True
                 await self.handle_help(nick, nick, '')
         words = message.split()
@@ -253,33 +551,55 @@ class QuranIRCBot:
             if command in self.commands:
                 await self.commands[command](nick, target, args)
             else:
-                logging.info(f"Ignoring non-command message with '!': {message}")
+                logger.info("Ignoring non-command message with '!': %s", message)
 
-    async def send_chunked_message(self, target, message, nick, chunk_size=350):
-        logging.info(f"Sending chunked message to {target}: {message}")
+    async def send_chunked_message(self, target, message, nick, priority=PRIORITY_NORMAL):
+        logger.debug("Sending chunked message to %s: %s", target, message)
         if not message.strip():
             return
-        for i in range(0, len(message), chunk_size):
-            await asyncio.sleep(0)
-            if self._should_cancel(nick):
-                logging.info(f"Cancellation detected in send_chunked_message for {nick}")
-                raise asyncio.CancelledError()
-            chunk = message[i:i+chunk_size]
-            if chunk.strip():
-                await self.irc_client.send_message(target, chunk)
-                await asyncio.to_thread(self.database.update_channel_stats, target, 1, time.time())
+        await self.send_packed_lines(target, [message], nick, priority, pack=False)
+
+    async def send_packed_lines(self, target, lines, nick, priority=PRIORITY_NORMAL, pack=True):
+        """Send lines split to the real per-line byte budget, joining short ones when `pack` is set."""
+        budget = self.pool.client_for(target).line_budget(target)
+        if pack:
+            chunks = pack_lines(lines, budget)
+        else:
+            chunks = [chunk for line in lines for chunk in split_text(line, budget)]
+        for chunk in chunks:
+            await self.send_line(target, chunk, nick, priority)
+
+    async def send_line(self, target, line, nick, priority=PRIORITY_NORMAL):
+        """Send one line that already fits the line budget, stopping if the query was cancelled."""
+        await asyncio.sleep(0)
+        if self._should_cancel(nick):
+            logger.info("Cancellation detected while sending to %s for %s", target, nick)
+            raise asyncio.CancelledError()
+        await self.pool.client_for(target).send_message(target, line, priority, nick)
+        if nick in self.active_tasks:
+            self.active_tasks[nick]["chunks_sent"] += 1
+        self.stats.record_channel(target, 1, time.time())
 
     async def shutdown(self):
-        logging.info("Shutting down the bot...")
-        await self.irc_client.quit()
-        logging.info("Bot shutdown complete.")
+        logger.info("Shutting down the bot...")
+        await self.pool.quit()
+        if self._retention_task:
+            self._retention_task.cancel()
+        if self.workers:
+            await self.workers.stop()
+        await self.ai_client.close()
+        await self.stats.stop()
+        await self.metrics_exporter.stop()
+        self.database.close()
+        logger.info("Bot shutdown complete.")
         sys.exit(0)
 
     def is_owner(self, nick):
-        logging.debug(f"Checking ownership: received nick='{nick}', configured owner='{BOT_OWNER}'")
+        logger.debug("Checking ownership: received nick='%s', configured owner='%s'", nick, BOT_OWNER)
         return nick.strip().lower() == BOT_OWNER.strip().lower()
 
 if __name__ == "__main__":
-    logging.info("Starting the bot application.")
+    configure_logging()
+    logger.info("Starting the bot application.")
     bot = QuranIRCBot()
     asyncio.run(bot.start())
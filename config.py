@@ -9,19 +9,101 @@ ALT_NICK = os.getenv("ALT_NICK", "AltNick")
 BOT_PASSWORD = os.getenv("BOT_PASSWORD", "PassWord")
 BOT_CHANNELS = os.getenv("BOT_CHANNELS", "#Margalla").split(",")
 BOT_OWNER = os.getenv("BOT_OWNER", "OwnerNick")
+# Extra connections, comma separated: nick[:password]@server[:port][/#channel/#channel...]
+# Connections to IRC_SERVER without pinned channels share BOT_CHANNELS with the primary nick.
+IRC_CONNECTIONS = [entry for entry in os.getenv("IRC_CONNECTIONS", "").split(",") if entry.strip()]
+# Other servers of the same network, comma separated host[:port]; connections to IRC_SERVER move
+# to the next one in turn whenever a connection fails or is lost
+IRC_FALLBACK_SERVERS = [entry for entry in os.getenv("IRC_FALLBACK_SERVERS", "").split(",") if entry.strip()]
+# Connection health: a PING every interval must be answered within the lag threshold (seconds)
+IRC_PING_INTERVAL = int(os.getenv("IRC_PING_INTERVAL", 30))
+IRC_LAG_THRESHOLD = int(os.getenv("IRC_LAG_THRESHOLD", 60))
+IRC_CONNECT_TIMEOUT = int(os.getenv("IRC_CONNECT_TIMEOUT", 15))  # Seconds to open the TCP connection
+IRC_REGISTER_TIMEOUT = int(os.getenv("IRC_REGISTER_TIMEOUT", 90))  # Seconds until 001; ident lookups can take 30+
+# Reconnect backoff after consecutive failures: base seconds, doubling up to the max; reset once registered
+IRC_RECONNECT_BASE = float(os.getenv("IRC_RECONNECT_BASE", 1))
+IRC_RECONNECT_MAX = int(os.getenv("IRC_RECONNECT_MAX", 60))
+
+# Outbound flood control: burst of lines, then a steady rate (lines per second)
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", 0.5))
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", 4))
+OUTBOUND_MAX_PENDING = int(os.getenv("OUTBOUND_MAX_PENDING", 5))  # Queued result lines per target
+OUTBOUND_FLOOD_PENALTY = int(os.getenv("OUTBOUND_FLOOD_PENALTY", 15))  # Seconds of silence after 439
+# Unsent result lines are journaled to the database and resumed after a reconnect or restart,
+# unless older than this many seconds. 0 disables the journal and the age limit: results cut off
+# by a reconnect still continue from memory, however long it took, but nothing survives a restart
+OUTBOUND_RESUME_MAX_AGE = int(os.getenv("OUTBOUND_RESUME_MAX_AGE", 600))
 
 # AI API Configuration
 AI_API_URL = os.getenv("AI_API_URL", "https://api.mistral.ai/v1/chat/completions")
 AI_API_KEY = os.getenv("AI_API_KEY", "actualKey")
+AI_POOL_SIZE = int(os.getenv("AI_POOL_SIZE", 10))  # Max concurrent connections to the AI endpoint
+AI_KEEPALIVE_TIMEOUT = int(os.getenv("AI_KEEPALIVE_TIMEOUT", 30))  # Seconds
+AI_MODEL = os.getenv("AI_MODEL", "mistral-small-latest")
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", 10))  # Seconds per HTTP attempt
+AI_DEADLINE = float(os.getenv("AI_DEADLINE", 20))  # Seconds per query, retries included
+AI_MAX_ATTEMPTS = int(os.getenv("AI_MAX_ATTEMPTS", 4))
+AI_BACKOFF_BASE = float(os.getenv("AI_BACKOFF_BASE", 0.5))  # Seconds; jittered and doubled per retry
+AI_BACKOFF_MAX = float(os.getenv("AI_BACKOFF_MAX", 8))  # Seconds
+# Circuit breaker: after N consecutive failures the endpoint is skipped, with one probe per cooldown
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", 5))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", 30))  # Seconds
+# Optional hedge: a second request to another endpoint/model when the first is slower than the delay
+AI_HEDGE_URL = os.getenv("AI_HEDGE_URL", "")  # Defaults to AI_API_URL when only the model differs
+AI_HEDGE_MODEL = os.getenv("AI_HEDGE_MODEL", "")
+AI_HEDGE_API_KEY = os.getenv("AI_HEDGE_API_KEY", "")  # Defaults to AI_API_KEY
+AI_HEDGE_DELAY = float(os.getenv("AI_HEDGE_DELAY", 0))  # Seconds; 0 disables hedging
+# Processes that run AI lookups and verse formatting for the IRC process; 0 runs them in-process
+QUERY_WORKERS = int(os.getenv("QUERY_WORKERS", 0))
+
+# Query Admission Configuration
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", 5))  # Queries waiting on the AI at once
+QUERY_QUEUE_MAX = int(os.getenv("QUERY_QUEUE_MAX", 50))  # Queries waiting for a slot
+QUERY_CHANNEL_QUOTA = int(os.getenv("QUERY_CHANNEL_QUOTA", 5))  # Waiting + running queries per channel
+QUERY_DEADLINE = int(os.getenv("QUERY_DEADLINE", 60))  # Seconds a query may wait before it is dropped
+QUERY_SHED_LATENCY = int(os.getenv("QUERY_SHED_LATENCY", 30))  # Estimated wait in seconds that sheds new queries
 
 # Database Configuration
 DB_PATH = os.getenv("DB_PATH", "quran_kb.db")
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 4))  # Read-only connections for queries
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))  # Milliseconds
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")  # Safe with WAL journal mode
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", -16000))  # Pages, or KiB when negative
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))  # Bytes
+AYAT_STREAM_BATCH = int(os.getenv("AYAT_STREAM_BATCH", 32))  # Max Ayats read per step while streaming results
+# Memory cap for lazily loaded translations in the in-process verse corpus
+CORPUS_MEMORY_CAP = int(os.getenv("CORPUS_MEMORY_CAP_MB", 16)) * 1024 * 1024
+# Memory cap for formatted result lines kept ready to resend (popular Surahs and verses)
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_MB", 8)) * 1024 * 1024
+# Channel/user stats are buffered and written every N seconds or N events
+STATS_FLUSH_INTERVAL = int(os.getenv("STATS_FLUSH_INTERVAL", 10))
+STATS_FLUSH_EVENTS = int(os.getenv("STATS_FLUSH_EVENTS", 200))
+# Query history retention: raw rows older than this are archived (0 keeps them), hourly counts are
+# pruned after their own retention (daily counts are kept), and the job runs every interval seconds
+QUERY_HISTORY_RETENTION_DAYS = int(os.getenv("QUERY_HISTORY_RETENTION_DAYS", 90))
+QUERY_HOURLY_RETENTION_DAYS = int(os.getenv("QUERY_HOURLY_RETENTION_DAYS", 14))
+QUERY_RETENTION_INTERVAL = int(os.getenv("QUERY_RETENTION_INTERVAL", 3600))
+QUERY_ARCHIVE_BATCH = int(os.getenv("QUERY_ARCHIVE_BATCH", 2000))  # Rows archived per write transaction
+
+# AI Answer Cache Configuration
+AI_CACHE_TTL = int(os.getenv("AI_CACHE_TTL", 7 * 24 * 3600))  # Seconds
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", 5000))
+
+# Metrics Configuration
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9464))  # Prometheus text at /metrics; 0 disables
+METRICS_FILE = os.getenv("METRICS_FILE", "")  # Optional file dump of the same text
+METRICS_DUMP_INTERVAL = int(os.getenv("METRICS_DUMP_INTERVAL", 60))  # Seconds
 
 # Messages Configuration
 MESSAGES = {
     "no_results_found": "Sorry! No relevant Ayat found for your query. Please try different phrase or words for better results.",
     "api_timeout": "Sorry! Request timed out, please try again.",
     "query_queued": "Your query has been queued. You will receive a response shortly.",
+    "query_position": "Your query is number {position} in the queue and should start in about {eta} seconds.",
+    "query_shed": "Sorry! I am very busy right now, please try again in a few minutes.",
+    "query_expired": "Sorry! Your query waited too long in the queue, please try again.",
+    "channel_busy": "Too many queries from here are already waiting, please try again shortly.",
     "completion_message": "The possible result(s) for the query has been processed. It is always the best approach to cross-check from other authentic sources too.",
     "query_exists": "You already have an active query",
     "flood_protection": "To avoid flooding, responses are sent in parts. Please be patient.",
@@ -45,7 +127,12 @@ MESSAGES = {
     "msg_success": "Message sent to {nick}/{channel}",
     "msg_failure": "Cannot send message to {nickname}/{channel} : {reason}",
     "counts_failure": "Cannot fetch counts {error}",
+    "counts_usage": "Usage: !counts [#channel] [24h|7d|4w]",
+    "usage_counts": "Queries{scope}: {total} ({successful} successful). Top users: {users}. Top channels: {channels}.",
+    "corpus_memory": "Corpus memory (bytes): {report}",
+    "stats_empty": "No metrics recorded yet.",
     "resume_failure": "Cannot resume result for {nickname}/{channel} : {reason}",
+    "resume_expired": "the connection was down for too long, please ask again",
     "reconnecting": "Reconnecting to IRC server...",
     "connection_failed": "Connection to IRC server failed. Retrying in 10 seconds...",
     "part_failure": "Cannot leave {channel} : {error}.",
@@ -0,0 +1,144 @@
+import array
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TextColumn:
+    """Verse texts packed into one UTF-8 buffer plus an offset array, indexed by verse position."""
+
+    __slots__ = ('data', 'offsets')
+
+    def __init__(self, texts):
+        offsets = array.array('I', [0])
+        encoded = []
+        position = 0
+        for text in texts:
+            chunk = text.encode('utf-8') if text else b''
+            encoded.append(chunk)
+            position += len(chunk)
+            offsets.append(position)
+        self.data = b''.join(encoded)
+        self.offsets = offsets
+
+    def get(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        if start == end:
+            return None
+        return self.data[start:end].decode('utf-8')
+
+    def nbytes(self):
+        return len(self.data) + self.offsets.itemsize * len(self.offsets)
+
+
+class QuranCorpus:
+    """In-process verse store: Arabic text and surah metadata are resident, translations load lazily.
+
+    Translation columns are kept in LRU order and evicted once their combined size exceeds
+    `memory_cap` bytes. The Arabic column and surah metadata are never evicted.
+    """
+
+    def __init__(self, database, memory_cap):
+        self.database = database
+        self.memory_cap = memory_cap
+        self.surahs = {}
+        self.surah_start = array.array('I')
+        self.surah_count = array.array('H')
+        self.arabic = None
+        self._position_by_number = {}
+        self._translations = OrderedDict()
+        self._lock = threading.Lock()
+        self.loaded = False
+
+    def load(self):
+        started = time.perf_counter()
+        rows = self.database.load_arabic_rows()
+        if not rows:
+            logger.warning("Arabic table is empty or missing; verse corpus not loaded.")
+            return False
+
+        texts = []
+        surah_start = {}
+        surah_count = {}
+        for position, (number, surah_id, number_in_surah, text) in enumerate(rows):
+            if number_in_surah == 1:
+                surah_start[surah_id] = position
+            surah_count[surah_id] = max(surah_count.get(surah_id, 0), number_in_surah)
+            self._position_by_number[number] = position
+            texts.append(text)
+
+        max_surah = max(surah_count)
+        self.surah_start = array.array('I', (surah_start.get(s, 0) for s in range(max_surah + 1)))
+        self.surah_count = array.array('H', (surah_count.get(s, 0) for s in range(max_surah + 1)))
+        self.arabic = TextColumn(texts)
+        self.surahs = {row[0]: tuple(row[1:]) for row in self.database.load_surah_rows()}
+        self.loaded = True
+        logger.info("Loaded verse corpus with %s Ayats in %.1f ms (%s bytes of Arabic text)",
+                    len(texts), (time.perf_counter() - started) * 1000, self.arabic.nbytes())
+        return True
+
+    def verse_count(self, surah):
+        if 0 < surah < len(self.surah_count):
+            return self.surah_count[surah]
+        return 0
+
+    def position(self, surah, ayat):
+        if 0 < ayat <= self.verse_count(surah):
+            return self.surah_start[surah] + ayat - 1
+        return None
+
+    def translation(self, table):
+        with self._lock:
+            column = self._translations.get(table)
+            if column is not None:
+                self._translations.move_to_end(table)
+                return column
+
+            texts = [None] * len(self._position_by_number)
+            for ayah_id, data in self.database.load_translation_rows(table):
+                position = self._position_by_number.get(ayah_id)
+                if position is not None and texts[position] is None:
+                    texts[position] = data
+            column = TextColumn(texts)
+            self._translations[table] = column
+            logger.info("Loaded %s translation into corpus (%s bytes)", table, column.nbytes())
+            self._evict(keep=table)
+            return column
+
+    def _evict(self, keep):
+        total = sum(column.nbytes() for column in self._translations.values())
+        while total > self.memory_cap and len(self._translations) > 1:
+            table, column = next(iter(self._translations.items()))
+            if table == keep:
+                break
+            del self._translations[table]
+            total -= column.nbytes()
+            logger.info("Evicted %s translation from corpus (%s bytes)", table, column.nbytes())
+
+    def fetch_rows(self, surah_ayat_pairs, translation_table):
+        """Return rows shaped like Database.fetch_ayat_rows, served from memory."""
+        translations = self.translation(translation_table)
+        rows = []
+        for surah, ayat in surah_ayat_pairs:
+            position = self.position(surah, ayat)
+            surah_info = self.surahs.get(surah)
+            if position is None or surah_info is None:
+                continue
+            rows.append((surah, ayat, self.arabic.get(position), translations.get(position)) + surah_info)
+        return rows
+
+    def memory_report(self):
+        """Resident bytes per language, plus the fixed Arabic text and surah metadata."""
+        report = {
+            'arabic': self.arabic.nbytes() if self.arabic else 0,
+            'surahs': sum(sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value)
+                          for value in self.surahs.values())
+        }
+        with self._lock:
+            for table, column in self._translations.items():
+                report[table] = column.nbytes()
+        return report
@@ -1,17 +1,249 @@
+import asyncio
+import json
 import sqlite3
 import logging
+import queue
+import re
+import threading
 import time
-from config import LANGUAGE_TABLE_MAPPING
+import zlib
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from config import (
+    LANGUAGE_TABLE_MAPPING, DB_READ_POOL_SIZE, DB_BUSY_TIMEOUT, DB_SYNCHRONOUS, DB_CACHE_SIZE, DB_MMAP_SIZE,
+    AYAT_STREAM_BATCH, QUERY_ARCHIVE_BATCH, QUERY_HOURLY_RETENTION_DAYS
+)
+from corpus import QuranCorpus
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_SECONDS = metrics.histogram("quranbot_db_query_seconds", "Database call duration by operation",
+                                     ("operation",))
+
+# Query count rollups maintained by log_query: (table, seconds per bucket).
+HOURLY_ROLLUP = ("query_counts_hourly", 3600)
+DAILY_ROLLUP = ("query_counts_daily", 86400)
+# Users and channels listed by !counts.
+USAGE_TOP_ENTRIES = 10
+# Search indexes built with the schema at startup; other translations are indexed on first search.
+STARTUP_SEARCH_TABLES = ('arabic', 'english')
+
+# One Ayat with its translation and surah details, in the column order of fetch_ayat_rows.
+VerseRecord = namedtuple("VerseRecord", [
+    "surah", "ayat", "arabic", "translation",
+    "surah_name_ar", "surah_name_en", "surah_name_en_translation", "surah_type"
+])
+
+
+def format_surah_header(record):
+    return (f"Surah {record.surah_name_en} ({record.surah_name_en_translation}) - "
+            f"{record.surah_type} - {record.surah_name_ar}")
+
+
+def format_ayat_lines(record, is_rtl=False):
+    arabic_text = record.arabic
+    translation = record.translation if record.translation is not None else "Translation not available"
+    if is_rtl:
+        arabic_text = f"\u202B{arabic_text}\u202C"
+        translation = f"\u202A{translation}\u202C"
+    return [f"Ayat {record.ayat}: {arabic_text}", f"Translation: {translation}"]
+
+# Tashkeel, Quranic annotation marks, superscript alef and tatweel are dropped for search.
+_ARABIC_DIACRITICS_RE = re.compile(r"[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+# Hamza carriers and alef variants are folded onto their base letters.
+_ARABIC_FOLDING = str.maketrans({
+    "\u0622": "\u0627",  # Alef with madda
+    "\u0623": "\u0627",  # Alef with hamza above
+    "\u0625": "\u0627",  # Alef with hamza below
+    "\u0671": "\u0627",  # Alef wasla
+    "\u0624": "\u0648",  # Waw with hamza
+    "\u0626": "\u064A",  # Yeh with hamza
+    "\u0649": "\u064A",  # Alef maksura
+    "\u0629": "\u0647",  # Teh marbuta
+    "\u0621": None,       # Standalone hamza
+})
+_ARABIC_SCRIPT_RE = re.compile(r"[\u0600-\u06FF]")
+_SEARCH_TOKEN_RE = re.compile(r"\w+")
+
+# Requested pairs are passed as one JSON array so any number of verses is a single round trip.
+_FETCH_AYATS_SQL = """
+    WITH requested(position, surah_id, number_in_surah) AS (
+        SELECT key, json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+    )
+    SELECT r.surah_id, r.number_in_surah, a.text,
+           (SELECT data FROM {table} WHERE ayah_id = a.number LIMIT 1),
+           s.name_ar, s.name_en, s.name_en_translation, s.type
+    FROM requested r
+    JOIN arabic a ON a.surah_id = r.surah_id AND a.number_in_surah = r.number_in_surah
+    JOIN surahs s ON s.id = r.surah_id
+    ORDER BY r.position
+"""
+
+
+def normalize_arabic(text):
+    """Strip Arabic diacritics and fold hamza/alef variants so searches ignore tashkeel."""
+    if not text:
+        return ""
+    return _ARABIC_DIACRITICS_RE.sub("", text).translate(_ARABIC_FOLDING)
+
+
+def _configure_connection(conn, synchronous, cache_size, mmap_size, busy_timeout):
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA cache_size = {int(cache_size)}")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.create_function("normalize_arabic", 1, normalize_arabic, deterministic=True)
+
+
+class _WriterThread(threading.Thread):
+    """Owns the only write connection and applies queued writes in order.
+
+    Writes that are queued together are committed in a single transaction; each caller's
+    Future resolves once its write is committed.
+    """
+
+    def __init__(self, conn, max_batch=100):
+        super().__init__(name="db-writer", daemon=True)
+        self.conn = conn
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self._stopping = False
+        self._stop_lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        future = Future()
+        # Nothing drains the queue after the stop marker, so a late write would never resolve.
+        with self._stop_lock:
+            if self._stopping:
+                raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+            self.queue.put((fn, args, future))
+        return future
+
+    def stop(self):
+        with self._stop_lock:
+            self._stopping = True
+            self.queue.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.queue.put(None)  # Stop after this batch
+                    break
+                batch.append(item)
+            self._apply(batch)
+        self.conn.close()
+
+    def _apply(self, batch):
+        results = []
+        for fn, args, future in batch:
+            try:
+                results.append((future, fn(self.conn, *args), None))
+            except Exception as e:
+                results.append((future, None, e))
+        try:
+            self.conn.commit()
+        except Exception as e:
+            logger.error("Database commit failed: %s", e)
+            self.conn.rollback()
+            results = [(future, None, error or e) for future, _, error in results]
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+class _ReadPool:
+    """A fixed set of read-only connections shared by threads; WAL lets them read during writes."""
+
+    def __init__(self, db_path, size, **pragmas):
+        uri = Path(db_path).absolute().as_uri() + "?mode=ro"
+        self._connections = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            _configure_connection(conn, **pragmas)
+            self._connections.put(conn)
+        self.size = size
+
+    @contextmanager
+    def connection(self):
+        conn = self._connections.get()
+        try:
+            yield conn
+        finally:
+            self._connections.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self._connections.get().close()
+
 
 class Database:
-    def __init__(self, db_path):
-        # Allow multi-threaded access
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+    def __init__(self, db_path, read_pool_size=DB_READ_POOL_SIZE, synchronous=DB_SYNCHRONOUS,
+                 cache_size=DB_CACHE_SIZE, mmap_size=DB_MMAP_SIZE, busy_timeout=DB_BUSY_TIMEOUT, read_only=False):
+        pragmas = dict(synchronous=synchronous, cache_size=cache_size, mmap_size=mmap_size,
+                       busy_timeout=busy_timeout)
+        self.corpus = None  # Optional in-memory QuranCorpus, see load_corpus
+        self.content_signature = None  # Quran text fingerprint taken by load_corpus
+        self._closed = False
+        self._writer = None
+        self._search_tables = set()  # Search tables known to be built
+        self._search_build_lock = threading.Lock()
+        if not read_only:
+            # One writer connection owned by a dedicated thread, plus a pool of read-only connections.
+            writer_conn = sqlite3.connect(db_path, check_same_thread=False)
+            journal_mode = writer_conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if journal_mode.lower() != 'wal':
+                logger.warning("Database journal mode is %s, expected WAL.", journal_mode)
+            _configure_connection(writer_conn, **pragmas)
+            self._writer = _WriterThread(writer_conn)
+            self._writer.start()
+            self.create_tables()
+        # Read-only instances (query worker processes) leave the schema and all writes to the bot process.
+        self._readers = _ReadPool(db_path, read_pool_size, **pragmas)
+        if not read_only:
+            self.create_indexes()
+
+    @property
+    def read_only(self):
+        return self._writer is None
+
+    def submit_write(self, fn, *args):
+        """Queue `fn(conn, *args)` on the writer thread; returns a Future resolved after commit."""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        if self._writer is None:
+            raise sqlite3.OperationalError("attempt to write a readonly database")
+        return self._writer.submit(fn, *args)
+
+    def execute_write(self, fn, *args):
+        """Run `fn(conn, *args)` on the writer thread and wait for it to be committed."""
+        return self.submit_write(fn, *args).result()
+
+    @contextmanager
+    def reader(self):
+        with self._readers.connection() as conn:
+            yield conn
 
     def create_tables(self):
-        self.cursor.execute("""
+        self.execute_write(self._create_tables)
+
+    @staticmethod
+    def _create_tables(conn):
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS channel_stats (
                 channel TEXT PRIMARY KEY,
                 join_count INTEGER DEFAULT 0,
@@ -20,7 +252,7 @@ class Database:
                 last_activity REAL DEFAULT 0
             )
         """)
-        self.cursor.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS user_stats (
                 nick TEXT PRIMARY KEY,
                 total_commands INTEGER DEFAULT 0,
@@ -29,7 +261,7 @@ class Database:
                 last_seen REAL DEFAULT 0
             )
         """)
-        self.cursor.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS query_history (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 nick TEXT,
@@ -40,63 +272,223 @@ class Database:
                 timestamp REAL
             )
         """)
-        self.conn.commit()
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_query_history_timestamp ON query_history(timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_query_history_nick ON query_history(nick, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_query_history_channel ON query_history(channel, timestamp)")
+        for table, _ in (HOURLY_ROLLUP, DAILY_ROLLUP):
+            # bucket is the Unix time divided by the table's bucket width.
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    nick TEXT NOT NULL,
+                    queries INTEGER DEFAULT 0,
+                    successes INTEGER DEFAULT 0,
+                    chunks_sent INTEGER DEFAULT 0,
+                    PRIMARY KEY (bucket, channel, nick)
+                ) WITHOUT ROWID
+            """)
+        # Raw query rows past retention, one zlib-compressed JSON list per day, channel and nick.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_history_archive (
+                day INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                nick TEXT NOT NULL,
+                row_count INTEGER NOT NULL,
+                rows BLOB NOT NULL,
+                PRIMARY KEY (day, channel, nick)
+            ) WITHOUT ROWID
+        """)
+        if conn.execute(f"SELECT 1 FROM {DAILY_ROLLUP[0]} LIMIT 1").fetchone() is None:
+            # First start with rollups: count the history logged before they existed.
+            for table, width in (HOURLY_ROLLUP, DAILY_ROLLUP):
+                conn.execute(f"""
+                    INSERT INTO {table} (bucket, channel, nick, queries, successes, chunks_sent)
+                    SELECT CAST(timestamp / ? AS INTEGER), COALESCE(channel, ''), COALESCE(nick, ''),
+                           COUNT(*), TOTAL(success), TOTAL(chunks_sent)
+                    FROM query_history WHERE timestamp IS NOT NULL GROUP BY 1, 2, 3
+                """, (width,))
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS ai_cache (
+                query_key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hit_count INTEGER DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_cache_last_access ON ai_cache(last_access)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS search_index_meta (
+                name TEXT PRIMARY KEY,
+                row_count INTEGER,
+                built REAL
+            )
+        """)
+        # Result lines queued for sending, kept until sent so they survive a disconnect or restart.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbound_journal (
+                seq INTEGER PRIMARY KEY,
+                connection TEXT NOT NULL,
+                target TEXT NOT NULL,
+                tag TEXT,
+                line TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbound_journal_target "
+                     "ON outbound_journal(connection, target, seq)")
+        # Last journal line sent per connection and target.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbound_cursor (
+                connection TEXT NOT NULL,
+                target TEXT NOT NULL,
+                sent_seq INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (connection, target)
+            ) WITHOUT ROWID
+        """)
+        # Results still being queued, with what they are rendered from and how many lines are journaled,
+        # so a restart can render the lines an earlier run never queued.
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbound_result (
+                connection TEXT NOT NULL,
+                target TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                ayats TEXT NOT NULL,
+                language TEXT NOT NULL,
+                rtl INTEGER NOT NULL,
+                budget INTEGER NOT NULL,
+                queued INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (connection, target, tag)
+            ) WITHOUT ROWID
+        """)
+
+    def create_indexes(self):
+        """Index the verse lookup columns of the bundled Quran tables, if present, and build STARTUP_SEARCH_TABLES."""
+        statements = []
+        if self.table_exists('arabic'):
+            statements.append("CREATE INDEX IF NOT EXISTS idx_arabic_surah_ayat ON arabic(surah_id, number_in_surah)")
+        for table in sorted(set(LANGUAGE_TABLE_MAPPING.values())):
+            if self.table_exists(table):
+                statements.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_ayah_id ON {table}(ayah_id)")
+        if statements:
+            self.execute_write(lambda conn: [conn.execute(statement) for statement in statements])
+        self.build_search_index([table for table in STARTUP_SEARCH_TABLES if self.table_exists(table)])
+
+    def table_exists(self, name):
+        with self.reader() as conn:
+            row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+        return row is not None
 
+    @DB_QUERY_SECONDS.timed(operation="fetch_ayats")
     def fetch_ayats(self, surah_ayat_pairs, language='arabic', is_rtl=False):
-        logging.info(f"Fetching Ayats for pairs: {surah_ayat_pairs} in language: {language}")
+        """The whole result as formatted lines, grouped by surah. Query results use stream_ayats."""
+        records = self.fetch_verse_records(surah_ayat_pairs, language)
+        by_surah = {}
+        for record in records:
+            by_surah.setdefault(record.surah, []).append(record)
+
         formatted_response = []
-        surah_ayats_map = {}
-
-        for surah_number, ayat_number in surah_ayat_pairs:
-            self.cursor.execute("SELECT text, number FROM arabic WHERE surah_id = ? AND number_in_surah = ?",
-                                (surah_number, ayat_number))
-            arabic_text_result = self.cursor.fetchone()
-            if not arabic_text_result:
-                logging.warning(f"No Arabic text found for Surah {surah_number}, Ayat {ayat_number}")
-                continue
-            arabic_text, number = arabic_text_result
-
-            translation_table = LANGUAGE_TABLE_MAPPING.get(language, 'english')
-            self.cursor.execute(f"SELECT data FROM {translation_table} WHERE ayah_id = ?", (number,))
-            translation_result = self.cursor.fetchone()
-            translation = translation_result[0] if translation_result else "Translation not available"
-
-            self.cursor.execute("SELECT name_ar, name_en, name_en_translation, type FROM surahs WHERE id = ?",
-                                (surah_number,))
-            surah_info_result = self.cursor.fetchone()
-            if not surah_info_result:
-                logging.warning(f"No Surah information found for Surah {surah_number}")
-                continue
-            surah_name_ar, surah_name_en, surah_name_en_translation, surah_type = surah_info_result
-
-            if surah_number not in surah_ayats_map:
-                surah_ayats_map[surah_number] = {
-                    "surah_name_en": surah_name_en,
-                    "surah_name_ar": surah_name_ar,
-                    "surah_name_en_translation": surah_name_en_translation,
-                    "surah_type": surah_type,
-                    "ayats": []
-                }
-
-            if is_rtl:
-                arabic_text = f"\u202B{arabic_text}\u202C"
-                translation = f"\u202A{translation}\u202C"
-
-            surah_ayats_map[surah_number]["ayats"].append((ayat_number, arabic_text, translation))
-
-        for surah_number, surah_data in surah_ayats_map.items():
-            formatted_response.append(
-                f"Surah {surah_data['surah_name_en']} ({surah_data['surah_name_en_translation']}) - {surah_data['surah_type']} - {surah_data['surah_name_ar']}"
-            )
-            for ayat_number, arabic_text, translation in surah_data["ayats"]:
-                formatted_response.append(f"Ayat {ayat_number}: {arabic_text}")
-                formatted_response.append(f"Translation: {translation}")
+        for surah_records in by_surah.values():
+            formatted_response.append(format_surah_header(surah_records[0]))
+            for record in surah_records:
+                formatted_response.extend(format_ayat_lines(record, is_rtl))
 
-        logging.info(f"Completed fetching and formatting Ayats: {formatted_response}")
+        logger.info("Formatted %s line(s) for %s Ayat(s) in %s", len(formatted_response), len(records), language)
+        logger.debug("Formatted Ayats: %s", formatted_response)
         return formatted_response
 
+    @DB_QUERY_SECONDS.timed(operation="fetch_verse_records")
+    def fetch_verse_records(self, surah_ayat_pairs, language='arabic'):
+        """VerseRecords for the pairs that exist, in request order."""
+        logger.debug("Fetching Ayats for pairs: %s in language: %s", surah_ayat_pairs, language)
+        translation_table = LANGUAGE_TABLE_MAPPING.get(language, 'english')
+        if self.corpus:
+            rows = self.corpus.fetch_rows(surah_ayat_pairs, translation_table)
+        else:
+            rows = self.fetch_ayat_rows(surah_ayat_pairs, translation_table)
+        missing = set(surah_ayat_pairs) - {(row[0], row[1]) for row in rows}
+        for surah_number, ayat_number in sorted(missing):
+            logger.warning("No Arabic text or Surah information found for Surah %s, Ayat %s", surah_number, ayat_number)
+        return [VerseRecord(*row) for row in rows]
+
+    async def stream_ayats(self, surah_ayat_pairs, language='arabic', batch_size=AYAT_STREAM_BATCH):
+        """Yield VerseRecords in request order, reading them off the event loop in small batches.
+
+        The first batch is small so the first verse is out quickly; batches then double up to
+        `batch_size`. Nothing is read ahead of the consumer, so closing the generator or
+        cancelling the task iterating it stops the remaining reads.
+        """
+        size = min(4, batch_size)
+        start = 0
+        while start < len(surah_ayat_pairs):
+            batch = surah_ayat_pairs[start:start + size]
+            start += size
+            size = min(size * 2, batch_size)
+            for record in await asyncio.to_thread(self.fetch_verse_records, batch, language):
+                yield record
+
+    def fetch_ayat_rows(self, surah_ayat_pairs, translation_table):
+        """Fetch verse, translation and surah rows for all pairs in a single query, in request order."""
+        if not surah_ayat_pairs:
+            return []
+        # The statement text only depends on the table, so sqlite3's statement cache reuses it.
+        with self.reader() as conn:
+            return conn.execute(_FETCH_AYATS_SQL.format(table=translation_table),
+                                (json.dumps([[int(s), int(a)] for s, a in surah_ayat_pairs]),)).fetchall()
+
+    def load_corpus(self, memory_cap):
+        """Serve fetch_ayats from an in-memory corpus instead of SQLite once it is loaded.
+
+        Also (re)takes `content_signature`, which caches of rendered verses compare against.
+        """
+        self.content_signature = self.compute_content_signature()
+        corpus = QuranCorpus(self, memory_cap)
+        if corpus.load():
+            self.corpus = corpus
+        return self.corpus
+
+    def compute_content_signature(self):
+        """Fingerprint of the Quran tables only: row count, last rowid and text length of each.
+
+        Stats, history, caches and the journal share the database file, so its size and
+        modification time change with ordinary traffic; this does not.
+        """
+        columns = {'surahs': "name_ar || name_en || name_en_translation", 'arabic': "text"}
+        columns.update((table, "data") for table in sorted(set(LANGUAGE_TABLE_MAPPING.values())))
+        signature = []
+        with self.reader() as conn:
+            for table, column in columns.items():
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                (table,)).fetchone():
+                    signature.append((table,) + tuple(conn.execute(
+                        f"SELECT COUNT(*), MAX(rowid), TOTAL(LENGTH({column})) FROM {table}").fetchone()))
+        return tuple(signature)
+
+    def load_arabic_rows(self):
+        if not self.table_exists('arabic'):
+            return []
+        with self.reader() as conn:
+            return conn.execute("SELECT number, surah_id, number_in_surah, text FROM arabic "
+                                "ORDER BY surah_id, number_in_surah").fetchall()
+
+    def load_surah_rows(self):
+        if not self.table_exists('surahs'):
+            return []
+        with self.reader() as conn:
+            return conn.execute("SELECT id, name_ar, name_en, name_en_translation, type FROM surahs").fetchall()
+
+    def load_translation_rows(self, table):
+        if not self.table_exists(table):
+            logger.warning("Translation table %s does not exist.", table)
+            return []
+        with self.reader() as conn:
+            return conn.execute(f"SELECT ayah_id, data FROM {table}").fetchall()
+
     def update_user_stats(self, nick, inc_total, inc_success, inc_fail, last_seen):
-        self.cursor.execute("""
+        self.execute_write(lambda conn: conn.execute("""
             INSERT INTO user_stats (nick, total_commands, successful_queries, failed_queries, last_seen)
             VALUES (?, ?, ?, ?, ?)
             ON CONFLICT(nick) DO UPDATE SET
@@ -105,39 +497,356 @@ class Database:
                 failed_queries = failed_queries + ?,
                 last_seen = ?
         """, (nick, inc_total, inc_success, inc_fail, last_seen,
-              inc_total, inc_success, inc_fail, last_seen))
-        self.conn.commit()
+              inc_total, inc_success, inc_fail, last_seen)))
 
     def update_channel_stats(self, channel, inc_message, last_activity):
-        self.cursor.execute("""
+        self.execute_write(lambda conn: conn.execute("""
             INSERT INTO channel_stats (channel, message_count, last_activity)
             VALUES (?, ?, ?)
             ON CONFLICT(channel) DO UPDATE SET
                 message_count = message_count + ?,
                 last_activity = ?
-        """, (channel, inc_message, last_activity, inc_message, last_activity))
-        self.conn.commit()
+        """, (channel, inc_message, last_activity, inc_message, last_activity)))
+
+    @DB_QUERY_SECONDS.timed(operation="apply_stats_batch")
+    def apply_stats_batch(self, channel_rows, user_rows):
+        """Apply aggregated (channel, messages, last_activity) and
+        (nick, total, success, fail, last_seen) increments in one transaction."""
+        self.execute_write(self._apply_stats_batch, channel_rows, user_rows)
 
+    @staticmethod
+    def _apply_stats_batch(conn, channel_rows, user_rows):
+        conn.executemany("""
+            INSERT INTO channel_stats (channel, message_count, last_activity)
+            VALUES (?1, ?2, ?3)
+            ON CONFLICT(channel) DO UPDATE SET
+                message_count = message_count + ?2,
+                last_activity = MAX(last_activity, ?3)
+        """, channel_rows)
+        conn.executemany("""
+            INSERT INTO user_stats (nick, total_commands, successful_queries, failed_queries, last_seen)
+            VALUES (?1, ?2, ?3, ?4, ?5)
+            ON CONFLICT(nick) DO UPDATE SET
+                total_commands = total_commands + ?2,
+                successful_queries = successful_queries + ?3,
+                failed_queries = failed_queries + ?4,
+                last_seen = MAX(last_seen, ?5)
+        """, user_rows)
+
+    @DB_QUERY_SECONDS.timed(operation="log_query")
     def log_query(self, nick, channel, query, success, chunks_sent):
-        self.cursor.execute("""
+        self.execute_write(self._log_query, nick, channel, query, success, chunks_sent, time.time())
+
+    @staticmethod
+    def _log_query(conn, nick, channel, query, success, chunks_sent, timestamp):
+        """Insert the raw row and bump its hourly and daily counts in the same transaction."""
+        conn.execute("""
             INSERT INTO query_history (nick, channel, query, success, chunks_sent, timestamp)
             VALUES (?, ?, ?, ?, ?, ?)
-        """, (nick, channel, query, success, chunks_sent, time.time()))
-        self.conn.commit()
-
-    def get_usage_counts(self):
-        self.cursor.execute("SELECT COUNT(*) FROM query_history")
-        total_count = self.cursor.fetchone()[0]
-        self.cursor.execute("SELECT nick, COUNT(*) FROM query_history GROUP BY nick")
-        user_counts = self.cursor.fetchall()
-        self.cursor.execute("SELECT channel, COUNT(*) FROM query_history GROUP BY channel")
-        channel_counts = self.cursor.fetchall()
+        """, (nick, channel, query, success, chunks_sent, timestamp))
+        for table, width in (HOURLY_ROLLUP, DAILY_ROLLUP):
+            conn.execute(f"""
+                INSERT INTO {table} (bucket, channel, nick, queries, successes, chunks_sent)
+                VALUES (?1, ?2, ?3, 1, ?4, ?5)
+                ON CONFLICT(bucket, channel, nick) DO UPDATE SET
+                    queries = queries + 1,
+                    successes = successes + ?4,
+                    chunks_sent = chunks_sent + ?5
+            """, (int(timestamp // width), channel or '', nick or '', int(bool(success)), chunks_sent or 0))
+
+    @DB_QUERY_SECONDS.timed(operation="get_usage_counts")
+    def get_usage_counts(self, since=None, channel=None, top=USAGE_TOP_ENTRIES,
+                         hourly_retention=QUERY_HOURLY_RETENTION_DAYS * 86400):
+        """Query totals and the busiest users and channels, from the rollup tables.
+
+        `since` (Unix time) limits the counts to a window, rounded down to the start of its hour,
+        or of its day once it is older than the hourly rollups; `channel` limits them to one
+        channel or private chat, compared case-insensitively.
+        """
+        if since is not None and since >= time.time() - hourly_retention:
+            table, width = HOURLY_ROLLUP
+        else:
+            table, width = DAILY_ROLLUP
+        first_bucket = int(since // width) if since is not None else 0
+        where = "bucket >= ?1 AND (?2 IS NULL OR channel = ?2 COLLATE NOCASE)"
+        params = (first_bucket, channel)
+        with self.reader() as conn:
+            total_count, successful = conn.execute(
+                f"SELECT TOTAL(queries), TOTAL(successes) FROM {table} WHERE {where}", params).fetchone()
+            user_counts = conn.execute(
+                f"SELECT nick, SUM(queries) AS n FROM {table} WHERE {where} GROUP BY nick ORDER BY n DESC LIMIT ?3",
+                params + (top,)).fetchall()
+            channel_counts = conn.execute(
+                f"SELECT channel, SUM(queries) AS n FROM {table} WHERE {where} GROUP BY channel ORDER BY n DESC LIMIT ?3",
+                params + (top,)).fetchall()
         return {
-            "total_count": total_count,
+            "total_count": int(total_count),
+            "successful": int(successful),
             "user_counts": user_counts,
             "channel_counts": channel_counts
         }
 
+    def compact_query_history(self, raw_before, hourly_before, batch_size=QUERY_ARCHIVE_BATCH):
+        """Archive raw query rows older than `raw_before` and drop hourly counts older than
+        `hourly_before` (both Unix times; None skips that step). Returns (rows archived, hourly rows dropped).
+
+        Rows are moved `batch_size` at a time so other writes are not held up behind one long transaction.
+        """
+        archived = 0
+        if raw_before is not None:
+            while True:
+                moved = self.execute_write(self._archive_query_rows, raw_before, batch_size)
+                archived += moved
+                if moved < batch_size:
+                    break
+        dropped = 0
+        if hourly_before is not None:
+            dropped = self.execute_write(lambda conn: conn.execute(
+                f"DELETE FROM {HOURLY_ROLLUP[0]} WHERE bucket < ?", (int(hourly_before // HOURLY_ROLLUP[1]),)).rowcount)
+        return archived, dropped
+
+    @staticmethod
+    def _archive_query_rows(conn, before, limit):
+        rows = conn.execute("""
+            SELECT id, timestamp, COALESCE(channel, ''), COALESCE(nick, ''), query, success, chunks_sent
+            FROM query_history WHERE timestamp < ? ORDER BY timestamp LIMIT ?
+        """, (before, limit)).fetchall()
+        groups = {}
+        for _, timestamp, channel, nick, query, success, chunks_sent in rows:
+            groups.setdefault((int(timestamp // DAILY_ROLLUP[1]), channel, nick), []).append(
+                [timestamp, query, bool(success), chunks_sent])
+        for key, entries in groups.items():
+            existing = conn.execute("SELECT rows FROM query_history_archive WHERE day = ? AND channel = ? AND nick = ?",
+                                    key).fetchone()
+            if existing:
+                entries = json.loads(zlib.decompress(existing[0])) + entries
+            payload = zlib.compress(json.dumps(entries, ensure_ascii=False).encode('utf-8'))
+            conn.execute("INSERT OR REPLACE INTO query_history_archive (day, channel, nick, row_count, rows) "
+                         "VALUES (?, ?, ?, ?, ?)", key + (len(entries), payload))
+        conn.executemany("DELETE FROM query_history WHERE id = ?", [(row[0],) for row in rows])
+        return len(rows)
+
+    @DB_QUERY_SECONDS.timed(operation="get_cached_answer")
+    def get_cached_answer(self, query_key, min_created, now):
+        with self.reader() as conn:
+            row = conn.execute("SELECT answer FROM ai_cache WHERE query_key = ? AND created >= ?",
+                               (query_key, min_created)).fetchone()
+        if not row:
+            return None
+        # Recording the access does not need to hold up the reply.
+        self.submit_write(lambda conn: conn.execute(
+            "UPDATE ai_cache SET last_access = ?, hit_count = hit_count + 1 WHERE query_key = ?",
+            (now, query_key)))
+        return row[0]
+
+    def count_cached_answers(self):
+        with self.reader() as conn:
+            return conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+
+    @DB_QUERY_SECONDS.timed(operation="store_cached_answer")
+    def store_cached_answer(self, query_key, answer, now, max_entries):
+        """Store an answer, evicting the least recently used beyond `max_entries`; returns the entry count."""
+        return self.execute_write(self._store_cached_answer, query_key, answer, now, max_entries)
+
+    @staticmethod
+    def _store_cached_answer(conn, query_key, answer, now, max_entries):
+        conn.execute("""
+            INSERT INTO ai_cache (query_key, answer, created, last_access, hit_count)
+            VALUES (?, ?, ?, ?, 0)
+            ON CONFLICT(query_key) DO UPDATE SET
+                answer = excluded.answer,
+                created = excluded.created,
+                last_access = excluded.last_access
+        """, (query_key, answer, now, now))
+        # Evict least recently used entries beyond the configured size.
+        conn.execute("""
+            DELETE FROM ai_cache WHERE query_key IN (
+                SELECT query_key FROM ai_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+        """, (max_entries,))
+        return conn.execute("SELECT COUNT(*) FROM ai_cache").fetchone()[0]
+
+    def append_journal_line(self, seq, connection, target, tag, line, now):
+        """Queue a journal insert, counted against the tag's journaled result, without waiting;
+        returns the writer Future."""
+        return self.submit_write(self._append_journal_line, seq, connection, target, tag, line, now)
+
+    @staticmethod
+    def _append_journal_line(conn, seq, connection, target, tag, line, now):
+        conn.execute(
+            "INSERT INTO outbound_journal (seq, connection, target, tag, line, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (seq, connection, target, tag, line, now))
+        conn.execute("UPDATE outbound_result SET queued = queued + 1, updated = ? "
+                     "WHERE connection = ? AND target = ? AND tag = ?", (now, connection, target, tag))
+
+    def begin_journal_result(self, connection, target, tag, surah_ayat_pairs, language, is_rtl, budget, now):
+        """Record what a result about to be queued is rendered from, without waiting."""
+        return self.submit_write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO outbound_result (connection, target, tag, ayats, language, rtl, budget, "
+            "queued, updated) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+            (connection, target, tag, json.dumps(surah_ayat_pairs), language, int(bool(is_rtl)), budget, now)))
+
+    def end_journal_result(self, connection, target, tag):
+        """Forget a result whose lines have all been queued, without waiting."""
+        return self.submit_write(lambda conn: conn.execute(
+            "DELETE FROM outbound_result WHERE connection = ? AND target = ? AND tag = ?", (connection, target, tag)))
+
+    def advance_journal_cursor(self, connection, target, seq, now):
+        """Record `seq` as sent for the target and drop its journal lines up to it, without waiting."""
+        return self.submit_write(self._advance_journal_cursor, connection, target, seq, now)
+
+    @staticmethod
+    def _advance_journal_cursor(conn, connection, target, seq, now):
+        conn.execute("""
+            INSERT INTO outbound_cursor (connection, target, sent_seq, updated) VALUES (?1, ?2, ?3, ?4)
+            ON CONFLICT(connection, target) DO UPDATE SET sent_seq = MAX(sent_seq, ?3), updated = ?4
+        """, (connection, target, seq, now))
+        conn.execute("DELETE FROM outbound_journal WHERE connection = ? AND target = ? AND seq <= ?",
+                     (connection, target, seq))
+
+    def discard_journal_lines(self, connection, target=None, tag=None):
+        """Drop unsent journal lines and their results, as OutboundScheduler.discard does for queued
+        lines, without waiting."""
+        return self.submit_write(self._discard_journal_lines, connection, target, tag)
+
+    @staticmethod
+    def _discard_journal_lines(conn, connection, target, tag):
+        for table in ("outbound_journal", "outbound_result"):
+            conn.execute(f"DELETE FROM {table} WHERE connection = ?1 AND (?2 IS NULL OR target = ?2) "
+                         "AND (?3 IS NULL OR tag = ?3)", (connection, target, tag))
+
+    @DB_QUERY_SECONDS.timed(operation="load_journal")
+    def load_journal(self, min_created):
+        """Drop journal lines and cursors older than `min_created`, then return the remaining lines as
+        (seq, connection, target, tag, line, created) in order, the highest sequence number used, and
+        the unfinished results as (connection, target, tag, pairs, language, rtl, budget, queued, updated).
+
+        Results are returned whatever their age, so the caller can tell their targets they expired.
+        """
+        return self.execute_write(self._load_journal, min_created)
+
+    @staticmethod
+    def _load_journal(conn, min_created):
+        conn.execute("DELETE FROM outbound_journal WHERE created < ?", (min_created,))
+        conn.execute("DELETE FROM outbound_cursor WHERE updated < ?", (min_created,))
+        rows = conn.execute("SELECT seq, connection, target, tag, line, created FROM outbound_journal "
+                            "ORDER BY seq").fetchall()
+        last_seq = conn.execute("SELECT MAX(seq) FROM (SELECT MAX(seq) AS seq FROM outbound_journal "
+                                "UNION ALL SELECT MAX(sent_seq) FROM outbound_cursor)").fetchone()[0]
+        results = [(connection, target, tag, [tuple(pair) for pair in json.loads(ayats)], language, bool(rtl),
+                    budget, queued, updated)
+                   for connection, target, tag, ayats, language, rtl, budget, queued, updated in conn.execute(
+                       "SELECT connection, target, tag, ayats, language, rtl, budget, queued, updated "
+                       "FROM outbound_result")]
+        return rows, last_seq or 0, results
+
+    def build_search_index(self, tables=None, rebuild=False):
+        """Build FTS5 indexes over `arabic.text` and the translation tables' `data` column."""
+        if tables is None:
+            tables = ['arabic'] + sorted(set(LANGUAGE_TABLE_MAPPING.values()))
+        for table in tables:
+            self._build_search_table(table, rebuild)
+
+    def _build_search_table(self, table, rebuild=False):
+        fts_table = f"fts_{table}"
+        if not self.table_exists(table):
+            logger.warning("Cannot build search index, table %s does not exist.", table)
+            return False
+        if not rebuild and self._search_index_built(fts_table):
+            return True
+        if self.read_only:
+            logger.warning("Search index %s is not built yet; the bot process builds it.", fts_table)
+            return False
+        # One build at a time: concurrent first searches wait for it instead of queueing their own.
+        with self._search_build_lock:
+            if not rebuild and self._search_index_built(fts_table):
+                return True
+            started = time.perf_counter()
+            row_count = self.execute_write(self._create_search_table, table, fts_table)
+            self._search_tables.add(fts_table)
+        logger.info("Built search index %s with %s rows in %.1f ms",
+                    fts_table, row_count, (time.perf_counter() - started) * 1000)
+        return True
+
+    def _search_index_built(self, fts_table):
+        if fts_table in self._search_tables:
+            return True
+        with self.reader() as conn:
+            built = conn.execute("SELECT 1 FROM search_index_meta WHERE name = ?", (fts_table,)).fetchone()
+        if built and self.table_exists(fts_table):
+            self._search_tables.add(fts_table)
+            return True
+        return False
+
+    @staticmethod
+    def _create_search_table(conn, table, fts_table):
+        conn.execute(f"DROP TABLE IF EXISTS {fts_table}")
+        conn.execute(f"""
+            CREATE VIRTUAL TABLE {fts_table} USING fts5(
+                text,
+                surah_id UNINDEXED,
+                number_in_surah UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        if table == 'arabic':
+            cursor = conn.execute(f"""
+                INSERT INTO {fts_table} (text, surah_id, number_in_surah)
+                SELECT normalize_arabic(text), surah_id, number_in_surah FROM arabic
+            """)
+        else:
+            cursor = conn.execute(f"""
+                INSERT INTO {fts_table} (text, surah_id, number_in_surah)
+                SELECT normalize_arabic(t.data), a.surah_id, a.number_in_surah
+                FROM {table} t JOIN arabic a ON a.number = t.ayah_id
+            """)
+        row_count = cursor.rowcount
+        conn.execute("""
+            INSERT INTO search_index_meta (name, row_count, built) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET row_count = excluded.row_count, built = excluded.built
+        """, (fts_table, row_count, time.time()))
+        return row_count
+
+    @staticmethod
+    def build_match_expression(query):
+        """Turn a user query into an FTS5 MATCH expression: a phrase if quoted, else all keywords."""
+        query = normalize_arabic(query.strip())
+        if len(query) > 1 and query[0] == query[-1] and query[0] in "\"'":
+            tokens = _SEARCH_TOKEN_RE.findall(query[1:-1])
+            return f'"{" ".join(tokens)}"' if tokens else None
+        tokens = _SEARCH_TOKEN_RE.findall(query)
+        return " ".join(f'"{token}"' for token in tokens) if tokens else None
+
+    @DB_QUERY_SECONDS.timed(operation="search")
+    def search(self, query, language=None, limit=20):
+        """Return ranked (surah, ayat) pairs matching a keyword or quoted phrase query."""
+        match = self.build_match_expression(query)
+        if not match:
+            return []
+        if _ARABIC_SCRIPT_RE.search(query) and language not in ('ur', 'ug', 'ku', 'dv'):
+            table = 'arabic'
+        else:
+            table = LANGUAGE_TABLE_MAPPING.get(language, 'english')
+        if not self._build_search_table(table):
+            return []
+        try:
+            with self.reader() as conn:
+                rows = conn.execute(f"""
+                    SELECT surah_id, number_in_surah FROM fts_{table}
+                    WHERE fts_{table} MATCH ? ORDER BY bm25(fts_{table}) LIMIT ?
+                """, (match, limit)).fetchall()
+        except sqlite3.OperationalError as e:
+            logger.error("Search failed for query %r: %s", query, e)
+            return []
+        results = [(int(surah), int(ayat)) for surah, ayat in rows]
+        logger.info("Local search for %r in %s returned %s result(s)", query, table, len(results))
+        return results
+
     def close(self):
-        if self.conn:
-            self.conn.close()
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer:
+            self._writer.stop()
+            self._writer = None
+        self._readers.close()
@@ -1,195 +1,405 @@
 import asyncio
+import itertools
 import logging
+import random
 import time
-from config import BOT_OWNER, MESSAGES
+import metrics
+from config import (
+    BOT_OWNER, MESSAGES, OUTBOUND_RATE, OUTBOUND_BURST, OUTBOUND_MAX_PENDING, OUTBOUND_FLOOD_PENALTY,
+    OUTBOUND_RESUME_MAX_AGE, IRC_PING_INTERVAL, IRC_LAG_THRESHOLD, IRC_CONNECT_TIMEOUT, IRC_REGISTER_TIMEOUT,
+    IRC_RECONNECT_BASE, IRC_RECONNECT_MAX
+)
+from irc_parser import HANDLED_COMMANDS, parse_line, peek_command
+from linepack import default_hostmask, line_budget
+from outbound import OutboundScheduler, PRIORITY_CONTROL, PRIORITY_OWNER, PRIORITY_NORMAL, PRIORITY_BULK
+
+logger = logging.getLogger(__name__)
+
+FLOOD_EVENTS = metrics.counter("quranbot_flood_events_total", "Excess Flood (439) warnings from the server",
+                               ("connection",))
+DISCONNECTS = metrics.counter("quranbot_irc_disconnects_total", "Failed or lost IRC connections",
+                              ("connection", "reason"))
 
 class IRCClient:
-    def __init__(self, server, port, nick, password, channels, alt_nick=None):
-        self.server = server
+    def __init__(self, server, port, nick, password, channels, alt_nick=None, fallback_servers=()):
+        self.server = server  # The network this connection belongs to, also when failed over
         self.port = port
+        # (host, port) pairs tried in turn, starting with the configured server.
+        self.servers = [(server, port)] + [address for address in fallback_servers if address != (server, port)]
+        self._server_index = 0
         self.nick = nick
         self.password = password
-        self.channels = channels
+        self.channels = list(channels)  # Channels this connection joins and answers in
         self.alt_nick = alt_nick or f"{nick}_"
+        self.name = f"{nick}@{server}"
         self.reader = None
         self.writer = None
         self.bot = None  # Reference to the bot instance
+        self.hostmask = None  # Our nick!user@host as seen by others, learned from the server
         self.connected = False
         self.authenticated = False
-        self.flood_warning_detected = False
         self.last_ping_time = time.time()
-        self._keep_alive_task = None
-        self.current_delay = 1.5  # Initial delay in seconds
-        self.max_delay = 5  # Maximum delay in seconds
-        self.retry_count = 0
-        self.max_reconnect_delay = 300
+        self.rtt = None  # Seconds, round trip of the last answered health PING
+        self._ping = None  # (token, monotonic time sent) of the PING awaiting its PONG
+        self._ping_tokens = itertools.count(1)
+        self._pong = asyncio.Event()
+        self._registered = asyncio.Event()
+        self._health_task = None
+        self._drop_reason = None
+        self._message_tasks = set()  # In-flight PRIVMSG handlers, so the read loop never waits on them
+        self.outbound = OutboundScheduler(self.send_command, OUTBOUND_RATE, OUTBOUND_BURST, OUTBOUND_MAX_PENDING,
+                                          name=self.name, on_sent=self._on_line_sent)
+        self.outbound.pause()  # Until the server has registered us
+        self.journal = None  # Optional OutboundJournal for result lines
+        self.resume_max_age = OUTBOUND_RESUME_MAX_AGE
+        self._registered_before = False
+        self.failures = 0  # Consecutive failed or lost connections, reset once registered
+        self.quitting = False  # Set by quit(); the connection is then not re-established
 
     async def connect(self):
+        host, port = self.servers[self._server_index]
         try:
-            self.reader, self.writer = await asyncio.open_connection(self.server, self.port)
-            await self.send_command("CAP LS")
-            await self.send_command(f"PASS {self.password}")
-            await self.send_command(f"NICK {self.nick}")
-            await self.send_command(f"USER {self.nick} 0 * :{self.nick}")
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(host, port), IRC_CONNECT_TIMEOUT)
             self.connected = True
-            logging.info("Successfully connected to IRC server.")
-            await asyncio.sleep(5)  # Delay to avoid flooding
+            self.authenticated = False
+            self._registered.clear()
+            self._drop_reason = None
+            for command in ("CAP LS", f"PASS {self.password}", f"NICK {self.nick}",
+                            f"USER {self.nick} 0 * :{self.nick}"):
+                if not await self.send_command(command):
+                    logger.error("Failed to register with IRC server %s:%s.", host, port)
+                    await self.connection_lost("connect_failed")
+                    return
+            self.outbound.start()
+            await self._cancel_health_task()  # At most one monitor per connection
+            self._health_task = asyncio.create_task(self.monitor_health())
+            logger.info("Connected to IRC server %s:%s as %s.", host, port, self.nick)
         except Exception as e:
-            logging.error(f"Failed to connect to IRC server: {e}")
-            self.connected = False
-            await self.shutdown()
+            logger.error("Failed to connect to IRC server %s:%s: %s", host, port, e)
+            await self.connection_lost("connect_failed")
 
     async def run(self):
-        retry_count = 0
-        while True:
+        """Read from the server until cancelled, reconnecting whenever the connection fails or is lost.
+
+        Each consecutive failure moves on to the next server in `servers` and waits longer before
+        the attempt (see reconnect_delay); registering with a server resets the count.
+        """
+        while not self.quitting:
             if not self.connected:
+                delay = self.reconnect_delay()
+                if delay:
+                    logger.info("Reconnecting %s to %s:%s in %.1fs.", self.name, *self.servers[self._server_index], delay)
+                    await asyncio.sleep(delay)
                 await self.connect()
-                delay = min(10 * (2 ** retry_count), self.max_reconnect_delay)
-                await asyncio.sleep(delay)  # Wait before retrying
-                retry_count += 1
-
+                continue
             try:
-                while self.connected:
-                    data = await self.reader.readline()
-                    message = data.decode().strip()
-                    if message:  # Only log and process non-empty messages
-                        logging.debug(f"Received: {message}")
-                        await self.handle_message(message)
+                await self.read_messages()
+                reason = "closed"  # Closed on our side, e.g. after a failed send
             except asyncio.CancelledError:
-                logging.info("IRC connection cancelled.")
+                logger.info("IRC connection cancelled.")
                 break
             except (ConnectionResetError, ConnectionAbortedError) as e:
-                logging.error(f"Error in IRC connection: {e}")
-                self.connected = False
-                await self.shutdown()
+                logger.error("Error in IRC connection: %s", e)
+                reason = "closed"
             except Exception as e:
-                logging.error(f"Unexpected error in IRC connection: {e}")
-                self.connected = False
-                await self.shutdown()
+                logger.error("Unexpected error in IRC connection: %s", e)
+                reason = "error"
+            if self.quitting:
+                break
+            await self.connection_lost(self._drop_reason or reason)
 
-    async def send_command(self, command):
-        if self.writer:
+    async def read_messages(self):
+        own_prefix = f":{self.nick}!".encode()
+        while self.connected:
+            data = await self.reader.readline()
+            if not data:
+                raise ConnectionResetError("Connection closed by server")
+            # Drop JOIN/QUIT/MODE/NOTICE noise before paying for decoding and parsing.
+            command = peek_command(data)
+            if command not in HANDLED_COMMANDS and not (command == b"JOIN" and data.startswith(own_prefix)):
+                continue
+            message = parse_line(data)
+            if message:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received: %s", message)
+                await self.handle_message(message)
+
+    def reconnect_delay(self):
+        """Seconds to wait before the next connection attempt: none at first, then IRC_RECONNECT_BASE
+        doubling with each consecutive failure up to IRC_RECONNECT_MAX, less up to half for jitter."""
+        if not self.failures:
+            return 0.0
+        delay = min(IRC_RECONNECT_BASE * 2 ** (self.failures - 1), IRC_RECONNECT_MAX)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def connection_lost(self, reason):
+        """Record a failed or lost connection, move to the next server and release the old socket."""
+        DISCONNECTS.inc(connection=self.name, reason=reason)
+        self.failures += 1
+        if len(self.servers) > 1:
+            self._server_index = (self._server_index + 1) % len(self.servers)
+            logger.warning("Connection %s lost (%s); failing over to %s:%s.", self.name, reason,
+                           *self.servers[self._server_index])
+        else:
+            logger.warning("Connection %s lost (%s).", self.name, reason)
+        await self.shutdown()
+
+    async def monitor_health(self):
+        """Check the connection with timed PINGs and drop it when it stalls, so run() reconnects.
+
+        Registration must complete within IRC_REGISTER_TIMEOUT. After that a PING goes out every
+        IRC_PING_INTERVAL seconds and its PONG must arrive within IRC_LAG_THRESHOLD; the round
+        trip is kept in `rtt`.
+        """
+        try:
+            await asyncio.wait_for(self._registered.wait(), IRC_REGISTER_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("%s was not registered within %ss.", self.name, IRC_REGISTER_TIMEOUT)
+            self._drop("register_timeout")
+            return
+        while self.connected:
+            token = f"qb{next(self._ping_tokens)}"
+            self._pong.clear()
+            self._ping = (token, time.monotonic())
+            if not await self.send_command(f"PING :{token}"):
+                return
             try:
-                self.writer.write(f"{command}\r\n".encode())
-                await self.writer.drain()
-            except Exception as e:
-                logging.error(f"Error sending command: {e}")
-                await self.shutdown()
+                await asyncio.wait_for(self._pong.wait(), IRC_LAG_THRESHOLD)
+            except asyncio.TimeoutError:
+                logger.warning("No PONG on %s for %ss; dropping the stalled connection.", self.name, IRC_LAG_THRESHOLD)
+                self._drop("stall")
+                return
+            await asyncio.sleep(IRC_PING_INTERVAL)
+
+    def _drop(self, reason):
+        """Abort the socket so the blocked read ends and run() reconnects."""
+        self._drop_reason = reason
+        if self.writer:
+            self.writer.transport.abort()
+
+    @property
+    def lag(self):
+        """Seconds of lag: the last PING round trip, or longer while the current PING is unanswered."""
+        if self._ping is None:
+            return self.rtt
+        return max(self.rtt or 0.0, time.monotonic() - self._ping[1])
+
+    async def send_command(self, command):
+        """Write one line to the server; returns False if it could not be sent."""
+        if not self.writer:
+            return False
+        try:
+            self.writer.write(f"{command}\r\n".encode())
+            await self.writer.drain()
+            return True
+        except Exception as e:
+            logger.error("Error sending command: %s", e)
+            await self.shutdown()
+            return False
 
-    async def send_message(self, target, message):
+    async def send_message(self, target, message, priority=PRIORITY_NORMAL, tag=None):
+        """Queue a PRIVMSG on the outbound scheduler.
+
+        Only bulk senders wait, and only while their target already has a full queue.
+        """
         if message:  # Only send non-empty messages
-            await self.send_command(f"PRIVMSG {target} :{message}")
-            await self.handle_delay()
-
-    async def handle_delay(self):
-        """Handle delay with exponential backoff and flood warning handling."""
-        if self.flood_warning_detected:
-            # Apply a one-time fixed delay of 15 seconds for flood warning
-            await asyncio.sleep(15)
-            self.flood_warning_detected = False  # Reset the flood warning flag
-            self.current_delay = 1.5  # Reset delay to initial value after flood warning
-        else:
-            # Apply exponential backoff for regular messages
-            await asyncio.sleep(self.current_delay)
-            self.current_delay = min(self.current_delay * 1.05, self.max_delay)
+            if priority == PRIORITY_BULK:
+                await self.outbound.wait_for_capacity(target)
+            seq = None
+            if self.journal and priority == PRIORITY_BULK and tag is not None:
+                seq = self.journal.append(self.name, target, tag, message)  # Result lines survive a disconnect
+            self.outbound.enqueue(target, f"PRIVMSG {target} :{message}", priority, tag, seq)
+
+    def _on_line_sent(self, target, tag, seq):
+        if seq is not None and self.journal:
+            self.journal.mark_sent(self.name, target, seq)
+
+    def discard(self, target=None, tag=None):
+        """Drop queued and journaled lines for `target` (all if None), optionally only those with `tag`."""
+        if self.journal:
+            self.journal.discard(self.name, target, tag)
+        return self.outbound.discard(target, tag)
+
+    async def resume_results(self):
+        """After registering, continue results cut off by a disconnect or left unsent by an earlier run.
+
+        Each such target is told "resume_start" before its remaining lines go out. Results an
+        earlier run had not finished queueing are handed to the bot, which renders and sends the
+        rest of them. Results whose oldest unsent line is older than `resume_max_age` are dropped
+        instead, their queries are stopped and the target gets "resume_failure". A `resume_max_age`
+        of 0 or less (journal disabled) never expires a result: the queued lines simply continue
+        after a reconnect.
+        """
+        recovered, expired, results = self.journal.take_recovered(self.name) if self.journal else ({}, {}, {})
+        for target, lines in recovered.items():
+            logger.info("Requeueing %s journaled result line(s) for %s on %s", len(lines), target, self.name)
+            for seq, tag, line in lines:
+                self.outbound.enqueue(target, f"PRIVMSG {target} :{line}", PRIORITY_BULK, tag, seq)
+        now = time.monotonic()
+        resumed = set()
+        for target, (oldest, tags) in self.outbound.backlog(PRIORITY_BULK).items():
+            if not (self._registered_before or target in recovered):
+                continue
+            if 0 < self.resume_max_age < now - oldest:
+                expired.setdefault(target, set()).update(tags)
+                for tag in tags:
+                    self.discard(target, tag)
+            else:
+                logger.info("Resuming result for %s on %s", target, self.name)
+                await self.send_message(target, MESSAGES["resume_start"], PRIORITY_CONTROL)
+                resumed.add(target)
+        for target, tag_results in results.items():
+            for tag, result in tag_results.items():
+                if tag in expired.get(target, ()):
+                    continue
+                if target not in resumed:
+                    logger.info("Resuming result for %s on %s", target, self.name)
+                    await self.send_message(target, MESSAGES["resume_start"], PRIORITY_CONTROL)
+                    resumed.add(target)
+                if self.bot:
+                    self.bot.resume_result(target, tag, result)
+        for target, tags in expired.items():
+            for tag in tags - {None}:
+                logger.warning("Dropped result for %s in %s: unsent for over %ss", tag, target, self.resume_max_age)
+                if self.bot:
+                    self.bot.abandon_query(tag)
+                await self.send_message(target, MESSAGES["resume_failure"].format(
+                    nickname=tag, channel=target, reason=MESSAGES["resume_expired"]), PRIORITY_CONTROL)
+
+    def line_budget(self, target):
+        """Bytes of text that fit in one PRIVMSG to `target` after the server adds our hostmask."""
+        return line_budget(target, self.hostmask or default_hostmask(self.nick))
 
     async def handle_message(self, message):
-        logging.debug(f"Handling message: {message}")
-        if message.startswith("PING"):
-            ping_value = message.split()[1]
-            await self.send_command(f"PONG {ping_value}")
+        command = message.command
+        params = message.params
+        if command == "PING":
+            ping_value = params[-1] if params else ""
+            await self.send_command(f"PONG :{ping_value}")
             self.last_ping_time = time.time()
-        else:
-            parts = message.split()
-            if len(parts) > 1:
-                if parts[1] == "001":  # RPL_WELCOME
-                    self.authenticated = True
-                    logging.info(f"Successfully authenticated with nick: {self.nick}")
-                    for channel in self.channels:
-                        await self.join_channel(channel)
-                elif parts[1] == "433":  # ERR_NICKNAMEINUSE
-                    logging.error("Nickname is already in use. Attempting to ghost the nick.")
-                    await self.send_command(f"NICK {self.alt_nick}")
-                    await self.send_command(f"NickServ :RECOVER {self.nick} {self.password}")
-                    await asyncio.sleep(2)  # Wait for recovery
-                    await self.send_command(f"NickServ :RELEASE {self.nick} {self.password}")
-                    await asyncio.sleep(2)  # Wait before changing nick
-                    await self.send_command(f"NICK {self.nick}")
-                elif parts[1] == "PRIVMSG":
-                    prefix = parts[0].lstrip(':')
-                    sender_nick = self.parse_nick_from_prefix(prefix)
-                    logging.debug(f"Parsed sender_nick: {sender_nick}")
-                    target = parts[2].lstrip(':')
-                    msg_content = ' '.join(parts[3:]).lstrip(':')
-
-                    logging.debug(f"Parsed PM/msg: {sender_nick} -> {target}: {msg_content}")
-                    await self.bot.on_message(sender_nick.strip(), target.strip(), msg_content)
-                elif parts[1] == "439":
-                    await self.handle_excess_flood(target)
+        elif command == "PONG":
+            if self._ping and params and params[-1] == self._ping[0]:
+                self.rtt = time.monotonic() - self._ping[1]
+                self._ping = None
+                self._pong.set()
+        elif command == "PRIVMSG" and len(params) > 1:
+            # Run the handler as a task so long queries never block reading (and PONGs).
+            task = asyncio.create_task(self.bot.on_message(self, message.nick.strip(), params[0].strip(), params[1]))
+            self._message_tasks.add(task)
+            task.add_done_callback(self._message_tasks.discard)
+        elif command == "001":  # RPL_WELCOME
+            self.authenticated = True
+            welcome_target = params[-1].split()[-1] if params and params[-1] else ""
+            if '!' in welcome_target and '@' in welcome_target:
+                self.hostmask = welcome_target
+            self.failures = 0
+            self._registered.set()
+            logger.info("Successfully authenticated with nick: %s", self.nick)
+            for channel in self.channels:
+                await self.join_channel(channel)
+            await self.resume_results()
+            self._registered_before = True
+            self.outbound.resume()
+        elif command == "433":  # ERR_NICKNAMEINUSE
+            logger.error("Nickname is already in use. Attempting to ghost the nick.")
+            await self.send_command(f"NICK {self.alt_nick}")
+            await self.send_command(f"NickServ :RECOVER {self.nick} {self.password}")
+            await asyncio.sleep(2)  # Wait for recovery
+            await self.send_command(f"NickServ :RELEASE {self.nick} {self.password}")
+            await asyncio.sleep(2)  # Wait before changing nick
+            await self.send_command(f"NICK {self.nick}")
+        elif command == "JOIN":
+            if message.nick == self.nick:
+                self.hostmask = message.prefix  # Our own JOIN echo carries the exact hostmask
+        elif command == "439":
+            target = params[1] if len(params) > 2 else None
+            await self.handle_excess_flood(target)
+        elif command == "ERROR":
+            raise ConnectionResetError(params[-1] if params else "ERROR from server")
 
     async def handle_excess_flood(self, target):
         """Handle the Excess Flood warning by slowing down message sending."""
-        logging.warning("[WARNING] Excess Flood detected! Slowing down...")
-        self.flood_warning_detected = True
-        await self.send_message(target, MESSAGES["flood_protection"])
+        logger.warning("[WARNING] Excess Flood detected! Slowing down...")
+        FLOOD_EVENTS.inc(connection=self.name)
+        self.outbound.penalize(OUTBOUND_FLOOD_PENALTY)
+        if target:
+            await self.send_message(target, MESSAGES["flood_protection"], PRIORITY_CONTROL)
 
     async def join_channel(self, channel):
         try:
             await self.send_command(f"JOIN {channel}")
-            logging.info(f"Joining channel: {channel}")
-            await self.send_message(BOT_OWNER, MESSAGES["join_success"].format(channel=channel))  # Send message to owner
+            logger.info("Joining channel %s as %s", channel, self.name)
+            if channel.casefold() not in (joined.casefold() for joined in self.channels):
+                self.channels.append(channel)
+            await self.send_message(BOT_OWNER, MESSAGES["join_success"].format(channel=channel),
+                                    PRIORITY_OWNER)  # Send message to owner
         except Exception as e:
-            logging.error(f"Error joining channel: {e}")
-            await self.send_message(BOT_OWNER, MESSAGES["join_failure"].format(channel=channel, error=str(e)))
+            logger.error("Error joining channel: %s", e)
+            await self.send_message(BOT_OWNER, MESSAGES["join_failure"].format(channel=channel, error=str(e)),
+                                    PRIORITY_OWNER)
 
     async def part_channel(self, channel):
         try:
             await self.send_command(f"PART {channel}")
-            await self.send_message(BOT_OWNER, MESSAGES["part_success"].format(channel=channel))  # Send message to owner
+            self.channels = [joined for joined in self.channels if joined.casefold() != channel.casefold()]
+            await self.send_message(BOT_OWNER, MESSAGES["part_success"].format(channel=channel),
+                                    PRIORITY_OWNER)  # Send message to owner
         except Exception as e:
-            logging.error(f"Error leaving channel: {e}")
-            await self.send_message(BOT_OWNER, MESSAGES["part_failure"].format(channel=channel, error=str(e)))
+            logger.error("Error leaving channel: %s", e)
+            await self.send_message(BOT_OWNER, MESSAGES["part_failure"].format(channel=channel, error=str(e)),
+                                    PRIORITY_OWNER)
 
     async def quit(self):
+        self.quitting = True
+        await self.outbound.drain(timeout=5)
+        await self.outbound.stop()
         try:
             await self.send_command("QUIT")
         except Exception as e:
-            logging.error(f"Error sending QUIT command: {e}")
+            logger.error("Error sending QUIT command: %s", e)
         finally:
             if self.writer:
-                self.writer.close()
-                await self.writer.wait_closed()
-            self.connected = False
+                writer, self.writer = self.writer, None
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except Exception:
+                    pass
+            await self.shutdown()
 
     async def shutdown(self):
-        if self._keep_alive_task:
-            self._keep_alive_task.cancel()
+        self.outbound.pause()  # Queued lines wait for the next registration
+        self.connected = False
+        self.authenticated = False
+        self._ping = None
+        await self._cancel_health_task()
+        if self.writer:
+            writer, self.writer = self.writer, None
+            writer.transport.abort()  # The connection is given up, so unsent bytes are not waited for
             try:
-                await self._keep_alive_task
-            except asyncio.CancelledError:
+                await writer.wait_closed()
+            except Exception:
                 pass
-        if self.writer:
-            self.writer.close()
-            await self.writer.wait_closed()
-        self.connected = False
-        logging.info("IRC client shutdown complete.")
+        logger.info("IRC client shutdown complete.")
 
-    async def keep_alive(self):
-        """Send periodic PING messages to keep the connection alive."""
-        while self.connected:
-            await asyncio.sleep(60)  # Send PING every 60 seconds
-            await self.send_command("PING")
+    async def _cancel_health_task(self):
+        if self._health_task and self._health_task is not asyncio.current_task():
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        self._health_task = None
 
     @staticmethod
     def parse_nick_from_prefix(prefix):
         """Extracts nickname from IRC prefix (e.g., ':Nick!user@host')."""
         nick = prefix.split('!', 1)[0].lstrip(':')  # Remove leading ':'
-        logging.debug(f"Parsed nick from prefix: {nick}")
+        logger.debug("Parsed nick from prefix: %s", nick)
         return nick
 
     def set_bot(self, bot):
         self.bot = bot
 
-    async def start_keep_alive(self):
-        """Start the keep-alive task."""
-        self._keep_alive_task = asyncio.create_task(self.keep_alive())
+    def set_journal(self, journal):
+        self.journal = journal
@@ -0,0 +1,111 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Commands IRCClient acts on; everything else is dropped before the line is decoded.
+# JOIN is only of interest for our own echo, see IRCClient.run.
+HANDLED_COMMANDS = frozenset({b"PING", b"PONG", b"PRIVMSG", b"ERROR", b"001", b"433", b"439"})
+
+_TAG_UNESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+def decode(data):
+    """Decode as UTF-8, falling back to Latin-1 so a malformed line never raises."""
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        logger.debug("Received non UTF-8 data, decoding as Latin-1.")
+        return data.decode("latin-1")
+
+
+class IRCMessage:
+    """A parsed IRC line: IRCv3 tags, prefix, command and parameters (trailing included)."""
+
+    __slots__ = ("tags", "prefix", "command", "params")
+
+    def __init__(self, tags, prefix, command, params):
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+
+    @property
+    def nick(self):
+        """Nickname part of the prefix, e.g. 'Nick' for 'Nick!user@host'."""
+        return self.prefix.split("!", 1)[0] if self.prefix else None
+
+    def __repr__(self):
+        return f"IRCMessage(tags={self.tags!r}, prefix={self.prefix!r}, command={self.command!r}, params={self.params!r})"
+
+
+def _skip_spaces(line, pos):
+    while pos < len(line) and line[pos] == 0x20:
+        pos += 1
+    return pos
+
+
+def peek_command(line):
+    """Return the command of a raw line as bytes, without decoding or copying the rest."""
+    pos = 0
+    if line[:1] == b"@":
+        pos = line.find(b" ")
+        if pos == -1:
+            return b""
+        pos = _skip_spaces(line, pos)
+    if line[pos:pos + 1] == b":":
+        pos = line.find(b" ", pos)
+        if pos == -1:
+            return b""
+        pos = _skip_spaces(line, pos)
+    end = line.find(b" ", pos)
+    if end == -1:
+        return line[pos:].rstrip(b"\r\n")
+    return line[pos:end]
+
+
+def _parse_tags(raw):
+    tags = {}
+    for item in raw.split(";"):
+        if not item:
+            continue
+        key, _, value = item.partition("=")
+        if "\\" in value:
+            chars = []
+            escaped = False
+            for char in value:
+                if escaped:
+                    chars.append(_TAG_UNESCAPES.get(char, char))
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                else:
+                    chars.append(char)
+            value = "".join(chars)
+        tags[key] = value
+    return tags
+
+
+def parse_line(line):
+    """Parse one raw IRC line (bytes) into an IRCMessage, or None if it has no command."""
+    line = line.rstrip(b"\r\n")
+    tags = {}
+    if line[:1] == b"@":
+        raw_tags, _, line = line[1:].partition(b" ")
+        tags = _parse_tags(decode(raw_tags))
+        line = line.lstrip(b" ")
+    prefix = None
+    if line[:1] == b":":
+        raw_prefix, _, line = line[1:].partition(b" ")
+        prefix = decode(raw_prefix)
+        line = line.lstrip(b" ")
+    trailing = None
+    split_at = line.find(b" :")
+    if split_at != -1:
+        line, trailing = line[:split_at], line[split_at + 2:]
+    parts = line.split()
+    if not parts:
+        return None
+    params = [decode(part) for part in parts[1:]]
+    if trailing is not None:
+        params.append(decode(trailing))
+    return IRCMessage(tags, prefix, parts[0].decode("ascii", "replace").upper(), params)
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+import metrics
+from irc_client import IRCClient
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_PREFIXES = "#&+!"
+
+# One IRC connection: its nick and credentials, network, and channels pinned to it.
+ConnectionSpec = namedtuple("ConnectionSpec", ["nick", "password", "server", "port", "channels"])
+
+
+def parse_connection_spec(entry, default_server, default_port, default_password):
+    """Parse 'nick[:password]@server[:port][/#channel/#channel...]'; omitted parts use the defaults."""
+    entry, *channels = entry.strip().split("/")
+    identity, _, address = entry.partition("@")
+    nick, _, password = identity.partition(":")
+    server, _, port = address.partition(":")
+    return ConnectionSpec(nick, password or default_password, server or default_server,
+                          int(port) if port else default_port, tuple(c for c in channels if c))
+
+
+def parse_server_list(entries, default_port):
+    """Parse 'host[:port]' entries into (host, port) pairs."""
+    servers = []
+    for entry in entries:
+        host, _, port = entry.strip().partition(":")
+        servers.append((host, int(port) if port else default_port))
+    return servers
+
+
+def assign_channels(specs, shared_channels):
+    """Channels per spec: pinned ones, plus `shared_channels` spread round-robin over the
+    connections to the first spec's network that have no channels pinned."""
+    assigned = [list(spec.channels) for spec in specs]
+    sharing = [index for index, spec in enumerate(specs)
+               if spec.server == specs[0].server and not spec.channels]
+    for position, channel in enumerate(shared_channels):
+        assigned[sharing[position % len(sharing)]].append(channel)
+    return assigned
+
+
+def is_channel(target):
+    return target[:1] in CHANNEL_PREFIXES
+
+
+class ConnectionPool:
+    """The bot's IRC connections, each with its own nick and flood budget.
+
+    Replies to a channel go out on the connection that joined it. A user's private-message
+    result goes out on the least busy connection to the network the user wrote to, and stays
+    there while that user's query is running, so the lines of one result keep their order.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.primary = clients[0]
+        self._private_routes = {}  # casefolded nick -> IRCClient
+        metrics.gauge("quranbot_irc_connections", "IRC connections that are registered with the server").set_function(
+            lambda: sum(1 for client in self.clients if client.connected and client.authenticated))
+        metrics.gauge("quranbot_irc_lag_seconds", "PING round trip of each registered IRC connection",
+                      ("connection",)).set_function(
+            lambda: {(client.name,): client.lag for client in self.clients
+                     if client.authenticated and client.lag is not None})
+
+    @classmethod
+    def from_specs(cls, specs, shared_channels, alt_nick=None, fallback_servers=()):
+        """Build the pool; `fallback_servers` are (host, port) alternatives for connections to the
+        first spec's server."""
+        channels = assign_channels(specs, shared_channels)
+        clients = [IRCClient(spec.server, spec.port, spec.nick, spec.password, assigned,
+                             alt_nick=alt_nick if index == 0 else None,
+                             fallback_servers=fallback_servers if spec.server == specs[0].server else ())
+                   for index, (spec, assigned) in enumerate(zip(specs, channels))]
+        return cls(clients)
+
+    def set_bot(self, bot):
+        for client in self.clients:
+            client.set_bot(bot)
+
+    def set_journal(self, journal):
+        for client in self.clients:
+            client.set_journal(journal)
+
+    def is_own_nick(self, name):
+        name = name.casefold()
+        return any(client.nick.casefold() == name for client in self.clients)
+
+    def for_channel(self, channel):
+        channel = channel.casefold()
+        for client in self.clients:
+            if any(joined.casefold() == channel for joined in client.channels):
+                return client
+        return self.primary
+
+    def least_busy(self, server=None):
+        candidates = [client for client in self.clients
+                      if (server is None or client.server == server) and client.connected] or [self.primary]
+        return min(candidates, key=lambda client: client.outbound.stats()["queued"])
+
+    def route_private(self, nick, origin, keep=False):
+        """Choose the connection for replies to `nick`; with `keep`, an existing route is kept."""
+        key = nick.casefold()
+        if not (keep and key in self._private_routes):
+            self._private_routes[key] = self.least_busy(origin.server)
+        return self._private_routes[key]
+
+    def client_for(self, target):
+        if is_channel(target):
+            return self.for_channel(target)
+        return self._private_routes.get(target.casefold(), self.primary)
+
+    def discard(self, target=None, tag=None):
+        return sum(client.discard(target, tag) for client in self.clients)
+
+    async def run(self):
+        """Connect every client and read from all of them until cancelled."""
+        await asyncio.gather(*(self._run_client(client) for client in self.clients))
+
+    @staticmethod
+    async def _run_client(client):
+        await client.run()  # Connects, and reconnects whenever the connection is lost
+
+    async def quit(self):
+        await asyncio.gather(*(client.quit() for client in self.clients), return_exceptions=True)
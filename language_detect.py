@@ -0,0 +1,174 @@
+import re
+import unicodedata
+
+from config import LANGUAGE_TABLE_MAPPING
+
+DEFAULT_LANGUAGE = 'en'
+
+# Right-to-left languages: the Arabic-script ones and Divehi (Thaana).
+RTL_LANGUAGES = frozenset({'ar', 'ur', 'ug', 'ku', 'dv'})
+
+# Language names accepted in an "in <Language>" suffix, besides the translation table names.
+LANGUAGE_ALIASES = {
+    'arabic': 'ar', 'bahasa': 'id', 'bahasa indonesia': 'id', 'bahasa melayu': 'ms', 'bangla': 'bn',
+    'bengali': 'bn', 'mandarin': 'zh', 'deutsch': 'de', 'espanol': 'es', 'turkce': 'tr',
+    'melayu': 'ms', 'sorani': 'ku', 'dhivehi': 'dv', 'norsk': 'no', 'svenska': 'sv', 'nederlands': 'nl',
+    'portugues': 'pt', 'italiano': 'it', 'polski': 'pl', 'cestina': 'cs', 'shqip': 'sq', 'kiswahili': 'sw',
+    'اردو': 'ur', 'عربی': 'ar', 'العربية': 'ar', 'русский': 'ru', 'हिन्दी': 'hi', 'हिंदी': 'hi',
+}
+LANGUAGE_NAMES = {table: code for code, table in LANGUAGE_TABLE_MAPPING.items()}
+LANGUAGE_NAMES.update(LANGUAGE_ALIASES)
+
+# Scripts used by a single language among the translations: (first, last code point, language).
+SCRIPT_RANGES = (
+    (0x0780, 0x07BF, 'dv'),  # Thaana
+    (0x0900, 0x097F, 'hi'),  # Devanagari
+    (0x0980, 0x09FF, 'bn'),  # Bengali
+    (0x0B80, 0x0BFF, 'ta'),  # Tamil
+    (0x0D00, 0x0D7F, 'ml'),  # Malayalam
+    (0x0D80, 0x0DFF, 'si'),  # Sinhala
+    (0x0E00, 0x0E7F, 'th'),  # Thai
+    (0x3040, 0x30FF, 'ja'),  # Hiragana and Katakana
+    (0x1100, 0x11FF, 'ko'),  # Hangul Jamo
+    (0x3130, 0x318F, 'ko'),  # Hangul compatibility Jamo
+    (0xAC00, 0xD7AF, 'ko'),  # Hangul syllables
+)
+_ARABIC_BLOCK = (0x0600, 0x06FF)
+_CYRILLIC_BLOCK = (0x0400, 0x04FF)
+_HAN_BLOCK = (0x4E00, 0x9FFF)
+
+# Letters that single out one language within a shared script.
+ARABIC_SCRIPT_MARKERS = {
+    'ur': "ٹڈڑںےۓہھکیگپچ",  # Urdu letters, and Persian ones Arabic does not use
+    'ug': "ېۇۈۋ",
+    'ku': "ڕڵێ",
+}
+CYRILLIC_MARKERS = {
+    'tg': "ғӣқӯҳҷ",
+    'tt': "әөүҗңһ",
+}
+LATIN_MARKERS = {
+    'de': "ß", 'es': "ñ¿¡", 'pt': "ãõ", 'pl': "ąęłśźżń", 'cs': "řěů", 'ro': "ășț", 'tr': "ığş",
+    'az': "ə", 'sv': "å", 'no': "øæ", 'sq': "ë", 'bs': "đć",
+}
+
+# A few very frequent function words per language; a query is scored by how many it uses.
+# Quranic terms (surah, ayat) are left out: they appear in queries of every language.
+STOPWORDS = {
+    'en': "the of and to in is what about are how for with does say who",
+    'de': "der die das und ist nicht ein eine was über wie mit von zu",
+    'nl': "de het een en van is wat over hoe met niet zijn voor",
+    'es': "el la los las de que y en es por sobre qué cómo para una",
+    'pt': "o a os as de que e em é do da sobre para com uma não",
+    'it': "il lo la gli le di che e è per sulla cosa come una non del",
+    'ro': "și de la în este ce despre cum un o pentru cu nu",
+    'pl': "i w na nie jest to co o jak się że z do",
+    'cs': "a v na je to co o jak se že z do není",
+    'sv': "och i att det är en som om vad hur för med inte",
+    'no': "og i det er en som om hva hvordan for med ikke til",
+    'tr': "ve bir bu ne ile için hakkında nasıl da de mi değil",
+    'az': "və bir bu nə ilə üçün haqqında necə də deyil",
+    'id': "dan yang di ini itu apa tentang bagaimana dengan untuk tidak",
+    'ms': "dan yang di ini itu apa tentang bagaimana dengan untuk tidak ialah",
+    'sq': "dhe në është një për çfarë si me nuk të",
+    'bs': "i u je na šta o kako se da za sa nije",
+    'so': "iyo waa ku ka oo maxay sidee ah ee",
+    'sw': "na ya wa kwa ni nini kuhusu vipi katika hii",
+    'uz': "va bu bir nima haqida qanday uchun bilan emas",
+    'ru': "и в не на что это как о про с по для",
+    'bg': "и в не на какво това как за се е от с",
+    'ur': "کیا ہے میں کے کی اور سے کو کا یہ",
+    'ar': "في من على ما هو هي عن إلى الذي",
+}
+_STOPWORD_LANGUAGES = {}  # word -> languages listing it
+for _language, _words in STOPWORDS.items():
+    for _word in _words.split():
+        _STOPWORD_LANGUAGES.setdefault(_word, []).append(_language)
+
+# "in Urdu", then two-word names such as "in Bahasa Indonesia".
+_LANGUAGE_SUFFIX_RES = (
+    re.compile(r"\s+in\s+(\w+)\s*[.?!]*\s*$", re.IGNORECASE),
+    re.compile(r"\s+in\s+(\w+\s+\w+)\s*[.?!]*\s*$", re.IGNORECASE),
+)
+_WORD_RE = re.compile(r"\w+")
+
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def language_name_code(name):
+    """The language code for a language name such as "Urdu" or "Bahasa", or None."""
+    name = name.strip().casefold()
+    return LANGUAGE_NAMES.get(name) or LANGUAGE_NAMES.get(_fold(name))
+
+
+def split_language_suffix(text):
+    """Split "... in Urdu" into ("...", 'ur'); text without a known language suffix comes back with None."""
+    for match in _LANGUAGE_SUFFIX_RES:
+        found = match.search(text)
+        if found:
+            code = language_name_code(found.group(1))
+            if code:
+                return text[:found.start()], code
+    return text, None
+
+
+def detect_language(text, default=DEFAULT_LANGUAGE):
+    """Return (language code, is_rtl) for a query, from an "in <Language>" suffix or the text itself.
+
+    Non-Latin scripts are recognised from their Unicode blocks and marker letters; Latin and
+    Cyrillic text is scored against small stopword and marker-letter profiles. Text with no
+    evidence either way gets `default`.
+    """
+    _, code = split_language_suffix(text)
+    if code is None:
+        code = _detect_from_text(text) or default
+    return code, code in RTL_LANGUAGES
+
+
+def _detect_from_text(text):
+    arabic = cyrillic = han = latin = 0
+    for ch in text:
+        point = ord(ch)
+        if point < 0x80:
+            latin += ch.isalpha()
+            continue
+        if _ARABIC_BLOCK[0] <= point <= _ARABIC_BLOCK[1]:
+            arabic += 1
+        elif _CYRILLIC_BLOCK[0] <= point <= _CYRILLIC_BLOCK[1]:
+            cyrillic += 1
+        elif _HAN_BLOCK[0] <= point <= _HAN_BLOCK[1]:
+            han += 1
+        else:
+            for first, last, language in SCRIPT_RANGES:
+                if first <= point <= last:
+                    return language
+            if ch.isalpha():
+                latin += 1
+    if arabic and arabic >= latin:
+        return _best(text, ARABIC_SCRIPT_MARKERS, ('ur', 'ar')) or 'ar'
+    if han and han >= latin:
+        return 'zh'
+    if cyrillic and cyrillic >= latin:
+        return _best(text, CYRILLIC_MARKERS, ('ru', 'bg')) or 'ru'
+    if latin:
+        return _best(text.casefold(), LATIN_MARKERS, STOPWORDS)
+    return None
+
+
+def _best(text, markers, stopword_languages):
+    """The language with the most marker letters (weight 1) and stopwords (weight 2) in `text`."""
+    scores = {}
+    for language, letters in markers.items():
+        hits = sum(text.count(letter) for letter in letters)
+        if hits:
+            scores[language] = hits
+    for word in _WORD_RE.findall(text.casefold()):
+        for language in _STOPWORD_LANGUAGES.get(word, ()):
+            if language in stopword_languages:
+                scores[language] = scores.get(language, 0) + 2
+    if not scores:
+        return None
+    return max(scores, key=scores.get)
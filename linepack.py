@@ -0,0 +1,137 @@
+import unicodedata
+
+IRC_LINE_LIMIT = 512  # Bytes, including the trailing CRLF
+PACK_SEPARATOR = " | "
+
+# Directional embedding/override marks opened by these characters are closed by PDF (U+202C).
+_EMBEDDING_OPENERS = "\u202A\u202B\u202D\u202E"
+_POP_DIRECTIONAL = "\u202C"
+_JOINERS = "\u200C\u200D"
+
+
+def default_hostmask(nick):
+    """Pessimistic hostmask used until the server tells us our real one."""
+    return f"{nick}!~{nick[:10]}@{'x' * 63}"
+
+
+def line_budget(target, hostmask):
+    """Bytes available for the text of `PRIVMSG <target> :<text>` as relayed by the server."""
+    overhead = len(f":{hostmask} PRIVMSG {target} :\r\n".encode('utf-8'))
+    return IRC_LINE_LIMIT - overhead
+
+
+def _is_extending(char):
+    """Characters that must stay attached to the preceding one (combining marks, joiners, selectors)."""
+    return (unicodedata.combining(char)
+            or unicodedata.category(char) in ('Mn', 'Me', 'Mc')
+            or char in _JOINERS
+            or '\uFE00' <= char <= '\uFE0F')
+
+
+def _clusters(text):
+    """Split text into approximate grapheme clusters."""
+    cluster = ""
+    for char in text:
+        if cluster and (_is_extending(char) or cluster[-1] in _JOINERS):
+            cluster += char
+        else:
+            if cluster:
+                yield cluster
+            cluster = char
+    if cluster:
+        yield cluster
+
+
+def split_text(text, budget):
+    """Split `text` into pieces of at most `budget` UTF-8 bytes.
+
+    Breaks prefer whitespace, never fall inside a grapheme cluster, and directional embeddings
+    that are open at a break are closed at the end of the piece and reopened in the next one.
+    """
+    pieces = []
+    current = []
+    current_bytes = 0
+    open_marks = []
+    last_space = None  # (index in current, open marks at that point)
+
+    def closing_suffix(marks):
+        return _POP_DIRECTIONAL * len(marks)
+
+    reopened = []  # Marks reopened at the start of the current piece
+    for cluster in _clusters(text):
+        size = len(cluster.encode('utf-8'))
+        closing = len(closing_suffix(open_marks + [cluster] if cluster in _EMBEDDING_OPENERS
+                                     else open_marks).encode('utf-8'))
+        split = False
+        # The text carried over from a word break can still be too long, so keep splitting until the
+        # cluster fits; a piece holding nothing but reopened marks cannot get any shorter.
+        while current_bytes + size + closing > budget and current and current != reopened:
+            if last_space is not None and cluster != " ":
+                index, marks = last_space
+                head, tail = current[:index], current[index + 1:]
+            else:
+                head, tail, marks = current, [], list(open_marks)
+            head = "".join(head).rstrip()
+            if head.strip(_EMBEDDING_OPENERS + _POP_DIRECTIONAL):
+                pieces.append(head + closing_suffix(marks))
+            reopened = ["".join(marks)] if marks else []
+            current = reopened + tail
+            current_bytes = sum(len(c.encode('utf-8')) for c in current)
+            last_space = None
+            split = True
+        if split and cluster == " ":
+            continue
+        current.append(cluster)
+        current_bytes += size
+        if cluster in _EMBEDDING_OPENERS:
+            open_marks.append(cluster)
+        elif cluster == _POP_DIRECTIONAL and open_marks:
+            open_marks.pop()
+        elif cluster.isspace():
+            last_space = (len(current) - 1, list(open_marks))
+    if current:
+        piece = "".join(current).strip()
+        if piece and piece not in _EMBEDDING_OPENERS:
+            pieces.append(piece)
+    return [piece for piece in pieces if piece.strip()]
+
+
+class LinePacker:
+    """Incremental pack_lines: feed lines one at a time and take the packed lines as they fill up."""
+
+    def __init__(self, budget, separator=PACK_SEPARATOR):
+        self.budget = budget
+        self.separator = separator
+        self.separator_bytes = len(separator.encode('utf-8'))
+        self.current = None
+        self.current_bytes = 0
+
+    def add(self, line):
+        """Add a line and return the packed lines completed by it."""
+        packed = []
+        for piece in split_text(line, self.budget):
+            size = len(piece.encode('utf-8'))
+            if self.current is not None and self.current_bytes + self.separator_bytes + size <= self.budget:
+                self.current += self.separator + piece
+                self.current_bytes += self.separator_bytes + size
+            else:
+                if self.current is not None:
+                    packed.append(self.current)
+                self.current, self.current_bytes = piece, size
+        return packed
+
+    def flush(self):
+        """Return the partially filled line, if any, and start over."""
+        packed = [self.current] if self.current is not None else []
+        self.current, self.current_bytes = None, 0
+        return packed
+
+
+def pack_lines(lines, budget, separator=PACK_SEPARATOR):
+    """Split long lines to fit `budget` bytes and join consecutive short ones into shared lines."""
+    packer = LinePacker(budget, separator)
+    packed = []
+    for line in lines:
+        packed.extend(packer.add(line))
+    packed.extend(packer.flush())
+    return packed
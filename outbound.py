@@ -0,0 +1,233 @@
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict, deque
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes, served strictly in this order.
+PRIORITY_CONTROL = 0  # Short replies such as queue/stop notices
+PRIORITY_OWNER = 1    # Replies to the bot owner
+PRIORITY_NORMAL = 2   # Help text and other interactive replies
+PRIORITY_BULK = 3     # Verse output of query results
+PRIORITY_LANES = 4
+
+OUTBOUND_LINES = metrics.counter("quranbot_outbound_lines_total", "Lines sent to the IRC server",
+                                 ("connection", "priority"))
+OUTBOUND_WAIT_SECONDS = metrics.histogram("quranbot_outbound_wait_seconds", "Time a line spent queued before sending",
+                                          ("priority",))
+OUTBOUND_QUEUE_DEPTH = metrics.gauge("quranbot_outbound_queued_lines", "Lines waiting in the outbound queue",
+                                     ("connection", "priority"))
+_SCHEDULERS = weakref.WeakSet()
+OUTBOUND_QUEUE_DEPTH.set_function(lambda: {
+    (scheduler.name, priority): queued
+    for scheduler in list(_SCHEDULERS) for priority, queued in enumerate(scheduler.stats()["queued_by_lane"])
+})
+
+
+class TokenBucket:
+    """Token bucket matching the server's flood limits: `burst` lines, refilled at `rate` lines/sec."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def penalize(self, seconds):
+        """Empty the bucket and add `seconds` worth of debt, e.g. after an Excess Flood warning."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class OutboundScheduler:
+    """Queues outbound lines per target and sends them from one task under a global token bucket.
+
+    Lanes are served in priority order; within a lane, targets are served round-robin so one
+    long result cannot starve other users. Bulk senders can wait for room with
+    `wait_for_capacity`, which bounds the lines queued per target.
+
+    While paused (e.g. disconnected) lines stay queued. If `send_line` returns False the line is
+    put back at the head of its queue. `on_sent(target, tag, seq)` is called after each line goes
+    out, with the `seq` it was queued with.
+    """
+
+    def __init__(self, send_line, rate, burst, max_pending_per_target, name="default", on_sent=None):
+        self.send_line = send_line
+        self.on_sent = on_sent
+        self.name = name  # Connection label for metrics
+        self.bucket = TokenBucket(rate, burst)
+        self.max_pending_per_target = max_pending_per_target
+        self.lanes = [OrderedDict() for _ in range(PRIORITY_LANES)]
+        self._wakeup = asyncio.Event()
+        self._open = asyncio.Event()
+        self._open.set()
+        self._progress = asyncio.Condition()
+        self._notify_tasks = set()
+        self._task = None
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        _SCHEDULERS.add(self)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def pause(self):
+        """Stop sending; queued and newly queued lines wait for `resume`."""
+        self._open.clear()
+
+    def resume(self):
+        self._open.set()
+
+    @property
+    def paused(self):
+        return not self._open.is_set()
+
+    def enqueue(self, target, line, priority=PRIORITY_NORMAL, tag=None, seq=None):
+        """Queue a raw line for `target` without blocking."""
+        lane = self.lanes[priority]
+        lane.setdefault(target, deque()).append((line, tag, time.monotonic(), seq))
+        self._wakeup.set()
+
+    def pending(self, target, priority=PRIORITY_BULK):
+        queue = self.lanes[priority].get(target)
+        return len(queue) if queue else 0
+
+    async def wait_for_capacity(self, target, priority=PRIORITY_BULK):
+        async with self._progress:
+            await self._progress.wait_for(
+                lambda: self.pending(target, priority) < self.max_pending_per_target)
+
+    def backlog(self, priority=PRIORITY_BULK):
+        """{target: (monotonic time its oldest line was queued, tags of its lines)} for one lane."""
+        return {target: (queue[0][2], {item[1] for item in queue})
+                for target, queue in self.lanes[priority].items()}
+
+    async def drain(self, timeout):
+        """Wait up to `timeout` seconds for every queued line to be sent."""
+        try:
+            async with self._progress:
+                await asyncio.wait_for(self._progress.wait_for(lambda: not any(self.lanes)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Outbound queue not drained within %ss: %s", timeout, self.stats())
+
+    def discard(self, target=None, tag=None):
+        """Drop queued lines for `target` (all targets if None), optionally only those with `tag`."""
+        dropped = 0
+        for lane in self.lanes:
+            for lane_target in list(lane):
+                if target is not None and lane_target != target:
+                    continue
+                queue = lane[lane_target]
+                kept = deque(item for item in queue if tag is not None and item[1] != tag)
+                dropped += len(queue) - len(kept)
+                if kept:
+                    lane[lane_target] = kept
+                else:
+                    del lane[lane_target]
+        if dropped:
+            logger.info("Discarded %s queued line(s) for %s", dropped, target or 'all targets')
+            self._wake_waiters()
+        return dropped
+
+    def _wake_waiters(self):
+        """Let `wait_for_capacity` and `drain` callers re-check from synchronous code, such as `discard`."""
+        try:
+            task = asyncio.get_running_loop().create_task(self._notify_progress())
+        except RuntimeError:
+            return  # No event loop, so nobody can be waiting
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def _notify_progress(self):
+        async with self._progress:
+            self._progress.notify_all()
+
+    def penalize(self, seconds):
+        self.bucket.penalize(seconds)
+
+    def _next_line(self):
+        for priority, lane in enumerate(self.lanes):
+            if lane:
+                target, queue = next(iter(lane.items()))
+                item = queue.popleft()
+                if queue:
+                    lane.move_to_end(target)  # Round-robin between targets
+                else:
+                    del lane[target]
+                return priority, target, item
+        return None
+
+    def _requeue(self, priority, target, item):
+        """Put an unsent line back at the head of its target's queue, and that target first in its lane."""
+        lane = self.lanes[priority]
+        lane.setdefault(target, deque()).appendleft(item)
+        lane.move_to_end(target, last=False)
+
+    async def run(self):
+        while True:
+            if not any(self.lanes):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self._open.wait()
+            delay = self.bucket.delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            item = self._next_line()
+            if item is None:
+                continue
+            priority, target, (line, tag, enqueued, seq) = item
+            self.bucket.take()
+            if await self.send_line(line) is False:
+                self._requeue(priority, target, (line, tag, enqueued, seq))
+                continue
+            if self.on_sent:
+                self.on_sent(target, tag, seq)
+            wait = time.monotonic() - enqueued
+            OUTBOUND_LINES.inc(connection=self.name, priority=priority)
+            OUTBOUND_WAIT_SECONDS.observe(wait, priority=priority)
+            self.sent += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            await self._notify_progress()
+
+    def stats(self):
+        return {
+            "queued": sum(len(queue) for lane in self.lanes for queue in lane.values()),
+            "queued_by_lane": [sum(len(queue) for queue in lane.values()) for lane in self.lanes],
+            "targets": len({target for lane in self.lanes for target in lane}),
+            "sent": self.sent,
+            "avg_wait": round(self.total_wait / self.sent, 3) if self.sent else 0.0,
+            "max_wait": round(self.max_wait, 3)
+        }
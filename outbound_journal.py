@@ -0,0 +1,119 @@
+import itertools
+import logging
+import sqlite3
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_LINES = metrics.counter("quranbot_outbound_journal_lines_total", "Result lines through the outbound journal",
+                                ("event",))
+
+
+class OutboundJournal:
+    """On-disk copy of result lines that are queued but not yet sent, with a cursor per target.
+
+    Lines are numbered from one sequence shared by every connection, so each target's lines are
+    in order. The scheduler reports every line it sends; the target's cursor moves to that line
+    and the lines up to it are dropped. Lines still in the journal when the bot starts, and no
+    older than `max_age` seconds, are handed back to their connection once it has registered.
+
+    Bulk senders only queue a few lines ahead, so a result is also journaled by what it is rendered
+    from, with a count of its lines journaled so far. A result the bot restarted in the middle of
+    is handed back with it, to be rendered again from the first line it never queued.
+    Journal writes go through the database writer thread and are never waited for.
+    """
+
+    def __init__(self, database, max_age):
+        self.database = database
+        self.max_age = max_age
+        rows, last_seq, results = database.load_journal(time.time() - max_age)
+        self._sequence = itertools.count(last_seq + 1)
+        self._recovered = {}  # connection -> {target: [(seq, tag, line, created)]}
+        for seq, connection, target, tag, line, created in rows:
+            self._recovered.setdefault(connection, {}).setdefault(target, []).append((seq, tag, line, created))
+        self._results = {}  # connection -> {(target, tag): (pairs, language, rtl, budget, queued, updated)}
+        for connection, target, tag, *result in results:
+            self._results.setdefault(connection, {})[target, tag] = tuple(result)
+        if rows or results:
+            logger.info("Recovered %s unsent result line(s) and %s unfinished result(s) from the outbound journal.",
+                        len(rows), len(results))
+
+    def append(self, connection, target, tag, line):
+        """Journal a result line about to be queued; returns its sequence number."""
+        seq = next(self._sequence)
+        self._write(self.database.append_journal_line, seq, connection, target, tag, line, time.time())
+        JOURNAL_LINES.inc(event="appended")
+        return seq
+
+    def begin_result(self, connection, target, tag, surah_ayat_pairs, language, is_rtl, budget):
+        """Journal what the result about to be queued for `tag` is rendered from."""
+        self._write(self.database.begin_journal_result, connection, target, tag, list(surah_ayat_pairs),
+                    language, is_rtl, budget, time.time())
+
+    def end_result(self, connection, target, tag):
+        """Forget the result for `tag` once all of its lines are queued; the lines stay journaled."""
+        self._write(self.database.end_journal_result, connection, target, tag)
+
+    def mark_sent(self, connection, target, seq):
+        self._write(self.database.advance_journal_cursor, connection, target, seq, time.time())
+        JOURNAL_LINES.inc(event="sent")
+
+    def discard(self, connection, target=None, tag=None):
+        """Forget unsent lines, e.g. after !stop; arguments as for OutboundScheduler.discard."""
+        self._write(self.database.discard_journal_lines, connection, target, tag)
+        for recovered_target, lines in list(self._recovered.get(connection, {}).items()):
+            if target is None or recovered_target == target:
+                kept = [entry for entry in lines if tag is not None and entry[1] != tag]
+                JOURNAL_LINES.inc(len(lines) - len(kept), event="discarded")
+                if kept:
+                    self._recovered[connection][recovered_target] = kept
+                else:
+                    del self._recovered[connection][recovered_target]
+        for result_target, result_tag in list(self._results.get(connection, {})):
+            if (target is None or result_target == target) and (tag is None or result_tag == tag):
+                del self._results[connection][result_target, result_tag]
+
+    def take_recovered(self, connection):
+        """Lines and results left unsent by an earlier run for `connection`, handed out once.
+
+        Returns ({target: [(seq, tag, line)]}, {target: tags}, {target: {tag: (pairs, language, rtl,
+        budget, queued)}}). The second part lists results dropped because their first unsent line,
+        or their last journaled one, has meanwhile outlived `max_age`. The third lists results cut
+        off before all of their lines were journaled; `queued` is how many were.
+        """
+        min_created = time.time() - self.max_age
+        recovered, expired, results = {}, {}, {}
+        for target, lines in self._recovered.pop(connection, {}).items():
+            if lines[0][3] < min_created:
+                expired[target] = {tag for _, tag, _, _ in lines}
+                self._write(self.database.discard_journal_lines, connection, target)
+                JOURNAL_LINES.inc(len(lines), event="expired")
+            else:
+                recovered[target] = [(seq, tag, line) for seq, tag, line, _ in lines]
+        for (target, tag), (*result, updated) in self._results.pop(connection, {}).items():
+            if tag in expired.get(target, ()):
+                continue
+            if updated < min_created:
+                expired.setdefault(target, set()).add(tag)
+                self._write(self.database.end_journal_result, connection, target, tag)
+            else:
+                results.setdefault(target, {})[tag] = tuple(result)
+        return recovered, expired, results
+
+    @staticmethod
+    def _write(method, *args):
+        try:
+            future = method(*args)
+        except sqlite3.ProgrammingError as e:
+            # Lines still being sent while the bot shuts down, after the database has closed.
+            logger.debug("Outbound journal write skipped: %s", e)
+            return
+        future.add_done_callback(_log_write_error)
+
+
+def _log_write_error(future):
+    error = future.exception()
+    if error is not None:
+        logger.error("Outbound journal write failed: %s", error)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+import re
+import time
+import unicodedata
+import metrics
+from language_detect import detect_language, split_language_suffix
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_LOOKUPS = metrics.counter("quranbot_ai_cache_lookups_total", "AI answer cache lookups", ("result",))
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    """Normalize a query (Unicode NFKC, case-folded, whitespace collapsed) into a cache key."""
+    text = unicodedata.normalize("NFKC", query or "")
+    text = text.casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(query):
+    """Key for a query's answer: its detected language, then the normalized text without any
+    "in <Language>" suffix, so the same question in another language gets its own entry."""
+    text, _ = split_language_suffix(query or "")
+    normalized = normalize_query(text)
+    if not normalized:
+        return ""
+    language, _ = detect_language(query)
+    return f"{language}:{normalized}"
+
+
+class QueryCache:
+    """Persistent cache of parsed AI answers, stored in the bot's SQLite database."""
+
+    def __init__(self, database, ttl, max_entries):
+        self.database = database
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.entries = database.count_cached_answers()
+        metrics.gauge("quranbot_ai_cache_entries", "Answers held by the AI answer cache").set_function(
+            lambda: self.entries)
+        metrics.gauge("quranbot_ai_cache_hit_ratio", "Share of AI answer cache lookups that hit").set_function(
+            lambda: self.stats()["hit_ratio"])
+
+    async def get(self, query):
+        key = cache_key(query)
+        if not key:
+            return None
+        now = time.time()
+        payload = await asyncio.to_thread(self.database.get_cached_answer, key, now - self.ttl, now)
+        if payload is None:
+            self.misses += 1
+            AI_CACHE_LOOKUPS.inc(result="miss")
+            logger.info("AI cache miss for key: %s", key)
+            return None
+        self.hits += 1
+        AI_CACHE_LOOKUPS.inc(result="hit")
+        logger.info("AI cache hit for key: %s", key)
+        answer = json.loads(payload)
+        answer['ayats'] = [tuple(pair) for pair in answer.get('ayats', [])]
+        return answer
+
+    async def put(self, query, answer):
+        key = cache_key(query)
+        if not key or not answer or not answer.get('ayats'):
+            return
+        payload = json.dumps({
+            'language': answer.get('language', 'arabic'),
+            'rtl': answer.get('rtl', False),
+            'ayats': [list(pair) for pair in answer['ayats']]
+        })
+        self.entries = await asyncio.to_thread(self.database.store_cached_answer, key, payload, time.time(),
+                                               self.max_entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": self.entries,
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0
+        }
@@ -0,0 +1,57 @@
+import asyncio
+
+from database import format_ayat_lines, format_surah_header
+from language_detect import detect_language, split_language_suffix
+from linepack import LinePacker, split_text
+
+
+def is_phrase_query(query):
+    """A query wrapped in matching quotes is an exact phrase for the local full-text index."""
+    query = query.strip()
+    return len(query) > 2 and query[0] == query[-1] and query[0] in "\"'"
+
+
+async def local_search(database, query, language=None, is_rtl=False):
+    """Answer `query` from the local full-text index, in the same shape as an AI response.
+
+    The language, when not given, is detected from the query; an "in <Language>" suffix only
+    selects the translation and is not searched for.
+    """
+    if language is None:
+        language, is_rtl = detect_language(query)
+    text, _ = split_language_suffix(query)
+    ayats = await asyncio.to_thread(database.search, text, language)
+    if not ayats:
+        return None
+    return {'language': language, 'rtl': is_rtl, 'ayats': ayats}
+
+
+def response_pairs(response):
+    """The unique (surah, ayat) pairs of a response, sorted so each surah is contiguous."""
+    return sorted(set(response.get('ayats', [])), key=lambda x: (x[0], x[1]))
+
+
+async def render_verse_lines(database, surah_ayat_pairs, language, is_rtl, budget):
+    """Yield ready-to-send result lines as verses are read from `database`.
+
+    Each surah header goes on its own line and the surah's Ayat/translation lines are packed
+    into lines of at most `budget` bytes. Pairs should be sorted so each surah is contiguous.
+    Lines are produced only as fast as they are consumed, so a slow sender holds back the reads.
+    """
+    packer = None
+    current_surah = None
+    async for record in database.stream_ayats(surah_ayat_pairs, language):
+        if record.surah != current_surah:
+            if packer:
+                for line in packer.flush():
+                    yield line
+            current_surah = record.surah
+            packer = LinePacker(budget)
+            for line in split_text(format_surah_header(record), budget):
+                yield line
+        for text in format_ayat_lines(record, is_rtl):
+            for line in packer.add(text):
+                yield line
+    if packer:
+        for line in packer.flush():
+            yield line
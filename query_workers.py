@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import logging
+import logging.handlers
+import multiprocessing
+import signal
+import threading
+from contextlib import aclosing
+
+from ai_client import AIClient
+from database import Database
+from query_pipeline import is_phrase_query, local_search, render_verse_lines, response_pairs
+
+logger = logging.getLogger(__name__)
+
+# Result lines a worker may send ahead of the bot process before it waits for the sender.
+LINE_WINDOW = 8
+# Seconds between liveness checks of a worker that owes a job a reply.
+WORKER_CHECK_INTERVAL = 5
+# Seconds a worker gets to finish its jobs on shutdown before it is terminated.
+WORKER_STOP_TIMEOUT = 10
+
+
+class _WorkerLogHandler(logging.handlers.QueueHandler):
+    """Ships a worker's records to the bot process, formatted by `prepare` so they can be pickled."""
+
+    def enqueue(self, record):
+        self.queue.put_nowait(("log", record))
+
+
+def _worker_main(jobs, results, db_path, corpus_memory_cap, ai_settings, window, log_level):
+    # Ctrl+C reaches the whole process group; the bot process decides when workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_WorkerLogHandler(results))
+    root.setLevel(log_level)
+    asyncio.run(_serve(jobs, results, db_path, corpus_memory_cap, ai_settings, window))
+
+
+async def _serve(jobs, results, db_path, corpus_memory_cap, ai_settings, window):
+    """Run jobs from `jobs` concurrently until told to stop.
+
+    Messages in: ("query", job_id, query, cached_answer, budget), ("credit", job_id, lines),
+    ("cancel", job_id) and None to stop. Messages out: ("response", job_id, answer, fresh),
+    ("line", job_id, text) and ("done", job_id, error), where error is None on success.
+    """
+    database = Database(db_path, read_only=True)
+    database.load_corpus(corpus_memory_cap)
+    ai_client = AIClient(**ai_settings)
+    await ai_client.open()
+    running = {}  # job id -> (task, line credits)
+    try:
+        while True:
+            message = await asyncio.to_thread(jobs.get)
+            if message is None:
+                break
+            kind, job_id, *args = message
+            if kind == "query":
+                credits = asyncio.Semaphore(window)
+                task = asyncio.create_task(_run_job(database, ai_client, results, credits, job_id, *args))
+                running[job_id] = (task, credits)
+                task.add_done_callback(lambda _, job_id=job_id: running.pop(job_id, None))
+            elif job_id in running:
+                task, credits = running[job_id]
+                if kind == "cancel":
+                    task.cancel()
+                else:
+                    for _ in range(args[0]):
+                        credits.release()
+    finally:
+        tasks = [task for task, _ in running.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await ai_client.close()
+        database.close()
+
+
+async def _run_job(database, ai_client, results, credits, job_id, query, cached, budget):
+    error = None
+    try:
+        response, fresh = cached, False
+        if response is None and not is_phrase_query(query):
+            response = await ai_client.query_quran(query)
+            fresh = bool(response)
+            if not response:
+                logger.warning("AI response unavailable, falling back to local search.")
+        if not response:
+            response = await local_search(database, query)
+        results.put(("response", job_id, response, fresh))
+        if response and response.get('ayats'):
+            lines = render_verse_lines(database, response_pairs(response), response.get('language', 'arabic'),
+                                       response.get('rtl', False), budget)
+            async with aclosing(lines):
+                async for line in lines:
+                    await credits.acquire()
+                    results.put(("line", job_id, line))
+    except asyncio.CancelledError:
+        error = "cancelled"
+    except asyncio.TimeoutError:
+        error = "timeout"
+    except Exception as e:
+        logger.error("Query worker job %s failed: %s", job_id, e)
+        error = str(e) or type(e).__name__
+    results.put(("done", job_id, error))
+
+
+class _Worker:
+    def __init__(self, process, jobs):
+        self.process = process
+        self.jobs = jobs
+        self.active = 0
+
+
+class WorkerPool:
+    """Processes that answer queries for the bot process, each with its own AI session and
+    read-only database connections.
+
+    The bot process keeps IRC, the answer cache and every database write. A job goes to the
+    least loaded worker with any cached answer, and the worker streams the formatted result
+    lines back, at most `window` lines ahead of the sender.
+    """
+
+    def __init__(self, size, db_path, corpus_memory_cap, ai_settings, window=LINE_WINDOW):
+        self.size = size
+        self.db_path = db_path
+        self.corpus_memory_cap = corpus_memory_cap
+        self.ai_settings = ai_settings
+        self.window = window
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._jobs = {}  # job id -> asyncio.Queue of messages from the worker
+        self._ids = itertools.count(1)
+        self._results = None
+        self._reader = None
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._results = self._context.Queue()
+        log_level = logging.getLogger().getEffectiveLevel()
+        for index in range(self.size):
+            jobs = self._context.Queue()
+            process = self._context.Process(
+                target=_worker_main, name=f"query-worker-{index}", daemon=True,
+                args=(jobs, self._results, self.db_path, self.corpus_memory_cap, self.ai_settings,
+                      self.window, log_level))
+            process.start()
+            self._workers.append(_Worker(process, jobs))
+        self._reader = threading.Thread(target=self._read_results, name="query-worker-results", daemon=True)
+        self._reader.start()
+        logger.info("Started %s query worker process(es).", self.size)
+
+    def _read_results(self):
+        while True:
+            message = self._results.get()
+            if message is None:
+                return
+            if message[0] == "log":
+                record = message[1]
+                logging.getLogger(record.name).handle(record)
+            else:
+                self._loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message):
+        events = self._jobs.get(message[1])
+        if events is not None:  # Jobs closed early still report "done"
+            events.put_nowait(message)
+
+    async def run(self, query, budget, cached=None):
+        """Yield ("response", answer, fresh) and then one ("line", text) per result line.
+
+        `cached` is an answer already known to the bot process (from the cache or the resolver).
+        `fresh` is set when the answer came from the AI rather than `cached` or the local index.
+        Raises asyncio.TimeoutError or RuntimeError when the job fails; closing the generator
+        early cancels the job in its worker.
+        """
+        worker = min(self._workers, key=lambda worker: worker.active)
+        job_id = next(self._ids)
+        events = asyncio.Queue()
+        self._jobs[job_id] = events
+        worker.active += 1
+        worker.jobs.put(("query", job_id, query, cached, budget))
+        finished = False
+        consumed = 0
+        try:
+            while True:
+                kind, _, *payload = await self._next_event(events, worker)
+                if kind == "done":
+                    finished = True
+                    if payload[0] == "timeout":
+                        raise asyncio.TimeoutError()
+                    if payload[0]:
+                        raise RuntimeError(f"Query worker failed: {payload[0]}")
+                    return
+                yield (kind, *payload)
+                if kind == "line":
+                    consumed += 1
+                    if consumed % max(self.window // 2, 1) == 0:
+                        worker.jobs.put(("credit", job_id, max(self.window // 2, 1)))
+        finally:
+            if not finished:
+                worker.jobs.put(("cancel", job_id))
+            worker.active -= 1
+            del self._jobs[job_id]
+
+    @staticmethod
+    async def _next_event(events, worker):
+        while True:
+            try:
+                return await asyncio.wait_for(events.get(), WORKER_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                if not worker.process.is_alive():
+                    raise RuntimeError(f"{worker.process.name} exited with code {worker.process.exitcode}")
+
+    async def stop(self):
+        if not self._workers:
+            return
+        for worker in self._workers:
+            worker.jobs.put(None)
+        await asyncio.to_thread(self._join)
+        logger.info("Stopped query worker processes.")
+
+    def _join(self):
+        for worker in self._workers:
+            worker.process.join(WORKER_STOP_TIMEOUT)
+            if worker.process.is_alive():
+                logger.warning("%s did not stop in time; terminating it.", worker.process.name)
+                worker.process.terminate()
+                worker.process.join()
+            worker.jobs.close()
+        self._workers = []
+        self._results.put(None)
+        self._reader.join()
+        self._results.close()
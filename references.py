@@ -0,0 +1,76 @@
+import logging
+import re
+
+# Number of Ayats in each Surah, indexed by Surah number (index 0 is unused).
+SURAH_AYAT_COUNTS = (
+    0,
+    7, 286, 200, 176, 120, 165, 206, 75, 129, 109, 123, 111, 43, 52, 99, 128, 111, 110, 98, 135,
+    112, 78, 118, 64, 77, 227, 93, 88, 69, 60, 34, 30, 73, 54, 45, 83, 182, 88, 75, 85,
+    54, 53, 89, 59, 37, 35, 38, 29, 18, 45, 60, 49, 62, 55, 78, 96, 29, 22, 24, 13,
+    14, 11, 11, 18, 12, 12, 30, 52, 52, 44, 28, 28, 20, 56, 40, 31, 50, 40, 46, 42,
+    29, 19, 36, 25, 22, 17, 19, 26, 30, 20, 15, 21, 11, 8, 8, 19, 5, 8, 8, 11,
+    11, 8, 3, 9, 5, 4, 7, 3, 6, 3, 5, 4, 5, 6
+)
+
+logger = logging.getLogger(__name__)
+SURAH_COUNT = len(SURAH_AYAT_COUNTS) - 1
+
+# Longest range a single reference may expand to (the longest Surah).
+MAX_RANGE_AYATS = max(SURAH_AYAT_COUNTS)
+
+# One pass over the text recognises "Surah: 2, Ayat: 255", "2:255", "(2:255)", ranges such as
+# "62:9-11" and comma lists continuing the same Surah such as "2:255, 256, 258-260".
+_NUMBER = r"\d+"
+_REFERENCE_RE = re.compile(
+    rf"(?:Surah\s*:?\s*(?P<surah>{_NUMBER})\s*,\s*Ayat\s*:?\s*(?P<ayat>{_NUMBER})"
+    rf"|(?P<pair_surah>{_NUMBER})\s*:\s*(?P<pair_ayat>{_NUMBER}))"
+    rf"(?:\s*-\s*(?P<end>{_NUMBER})(?!\d|\s*:))?"
+    rf"(?P<more>(?:\s*,\s*{_NUMBER}(?:\s*-\s*{_NUMBER})?(?!\d|\s*:))*)",
+    re.IGNORECASE
+)
+_CONTINUATION_RE = re.compile(rf"({_NUMBER})(?:\s*-\s*({_NUMBER}))?")
+
+
+def verse_count(surah):
+    if 0 < surah <= SURAH_COUNT:
+        return SURAH_AYAT_COUNTS[surah]
+    return 0
+
+
+def expand_reference(surah, start, end=None, max_range=MAX_RANGE_AYATS):
+    """Expand one reference into valid (surah, ayat) pairs, clamped to the Surah and `max_range`."""
+    count = verse_count(surah)
+    end = start if end is None else end
+    if not count or start < 1 or start > count or end < start:
+        logger.debug("Discarding invalid reference %s:%s-%s", surah, start, end)
+        return []
+    end = min(end, count, start + max_range - 1)
+    return [(surah, ayat) for ayat in range(start, end + 1)]
+
+
+def parse_references(text, max_range=MAX_RANGE_AYATS, max_total=None):
+    """Parse Surah/Ayat references from `text` in one scan.
+
+    Returns validated, de-duplicated (surah, ayat) pairs in the order they first appear.
+    """
+    pairs = []
+    seen = set()
+
+    def add(candidates):
+        for pair in candidates:
+            if pair not in seen:
+                seen.add(pair)
+                pairs.append(pair)
+
+    for match in _REFERENCE_RE.finditer(text):
+        surah = int(match.group('surah') or match.group('pair_surah'))
+        start = int(match.group('ayat') or match.group('pair_ayat'))
+        end = int(match.group('end')) if match.group('end') else None
+        add(expand_reference(surah, start, end, max_range))
+        if match.group('more'):
+            for extra_start, extra_end in _CONTINUATION_RE.findall(match.group('more')):
+                add(expand_reference(surah, int(extra_start),
+                                     int(extra_end) if extra_end else None, max_range))
+        if max_total is not None and len(pairs) >= max_total:
+            return pairs[:max_total]
+    return pairs
@@ -0,0 +1,81 @@
+import logging
+from collections import OrderedDict
+
+import metrics
+from config import LANGUAGE_TABLE_MAPPING
+
+logger = logging.getLogger(__name__)
+
+RENDER_CACHE_LOOKUPS = metrics.counter("quranbot_render_cache_lookups_total", "Rendered result cache lookups",
+                                       ("result",))
+RENDER_CACHE_EVICTIONS = metrics.counter("quranbot_render_cache_evictions_total",
+                                         "Rendered results dropped from the cache", ("reason",))
+
+# Approximate bytes of bookkeeping per entry (key tuple, list and dict slots) on top of the line texts.
+ENTRY_OVERHEAD = 200
+
+
+class RenderCache:
+    """Bounded LRU of ready-to-send result lines, keyed by (verses, translation, rtl, line budget).
+
+    Entries are accounted by the UTF-8 size of their lines and evicted least recently used first
+    once the total exceeds `max_bytes`; a result larger than `max_entry_bytes` is not kept. The
+    cache is emptied when the database's `content_signature` changes, i.e. when the corpus is
+    reloaded from changed Quran tables, so edited verses are never served from stale lines.
+    """
+
+    def __init__(self, database, max_bytes, max_entry_bytes=None):
+        self.database = database
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self.bytes = 0
+        self._entries = OrderedDict()  # key -> (lines, size)
+        self._signature = database.content_signature
+        metrics.gauge("quranbot_render_cache_bytes", "Bytes held by the rendered result cache").set_function(
+            lambda: self.bytes)
+
+    @staticmethod
+    def key(surah_ayat_pairs, language, is_rtl, budget):
+        """Cache key for a result; languages sharing a translation table share entries."""
+        table = LANGUAGE_TABLE_MAPPING.get(language, 'english')
+        return tuple(surah_ayat_pairs), table, bool(is_rtl), budget
+
+    def _check_database(self):
+        signature = self.database.content_signature
+        if signature != self._signature:
+            if self._entries:
+                logger.info("Quran tables changed; dropping %s rendered result(s).", len(self._entries))
+                RENDER_CACHE_EVICTIONS.inc(len(self._entries), reason="content_changed")
+            self._entries.clear()
+            self.bytes = 0
+            self._signature = signature
+
+    def get(self, key):
+        """The cached lines for `key` as a tuple, or None."""
+        self._check_database()
+        entry = self._entries.get(key)
+        if entry is None:
+            RENDER_CACHE_LOOKUPS.inc(result="miss")
+            return None
+        self._entries.move_to_end(key)
+        RENDER_CACHE_LOOKUPS.inc(result="hit")
+        return entry[0]
+
+    def put(self, key, lines):
+        lines = tuple(lines)
+        size = ENTRY_OVERHEAD + sum(len(line.encode('utf-8')) for line in lines)
+        if not lines or size > self.max_entry_bytes:
+            return
+        self._check_database()
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[1]
+        self._entries[key] = (lines, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            RENDER_CACHE_EVICTIONS.inc(reason="size")
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.bytes}
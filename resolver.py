@@ -0,0 +1,238 @@
+import logging
+import re
+import unicodedata
+
+from database import normalize_arabic
+from language_detect import detect_language, split_language_suffix
+from references import expand_reference, parse_references, verse_count
+
+logger = logging.getLogger(__name__)
+
+# Common spellings of Surah names beyond those stored in the surahs table.
+SURAH_NAME_VARIANTS = {
+    1: ("fatiha", "fateha", "fatihah", "alhamd"), 2: ("baqara", "baqarah", "baqra", "bakara"),
+    3: ("al imran", "aal imran", "ale imran"), 4: ("nisa", "nisaa"), 5: ("maida", "maidah", "ma'idah"),
+    6: ("anam", "an'am"), 7: ("araf", "a'raf"), 8: ("anfal",), 9: ("tauba", "tawbah", "taubah", "baraah"),
+    10: ("yunus", "younus"), 11: ("hud", "hood"), 12: ("yusuf", "yousuf", "yousef", "yusef"), 13: ("rad", "ra'd"),
+    14: ("ibrahim",), 15: ("hijr",), 16: ("nahl",), 17: ("isra", "bani israil", "bani israel"),
+    18: ("kahf", "kahaf"), 19: ("maryam", "mariam"), 20: ("taha", "ta ha"), 21: ("anbiya",),
+    22: ("hajj",), 23: ("muminun", "mominoon"), 24: ("nur", "noor"), 25: ("furqan",), 26: ("shuara",),
+    27: ("naml",), 28: ("qasas",), 29: ("ankabut", "ankaboot"), 30: ("rum", "room"), 31: ("luqman", "lukman"),
+    32: ("sajda", "sajdah"), 33: ("ahzab",), 34: ("saba",), 35: ("fatir",), 36: ("yasin", "yaseen", "ya sin"),
+    37: ("saffat",), 38: ("sad", "saad"), 39: ("zumar",), 40: ("ghafir", "momin"), 41: ("fussilat",),
+    42: ("shura",), 43: ("zukhruf",), 44: ("dukhan",), 45: ("jathiya", "jasiya"), 46: ("ahqaf",),
+    47: ("muhammad",), 48: ("fath",), 49: ("hujurat",), 50: ("qaf",), 51: ("dhariyat", "zariyat"),
+    52: ("tur", "toor"), 53: ("najm",), 54: ("qamar",), 55: ("rahman", "rehman"), 56: ("waqia", "waqiah"),
+    57: ("hadid",), 58: ("mujadila", "mujadilah"), 59: ("hashr",), 60: ("mumtahina", "mumtahanah"),
+    61: ("saff",), 62: ("jumua", "jumuah", "juma", "jumma"), 63: ("munafiqun", "munafiqoon"),
+    64: ("taghabun",), 65: ("talaq",), 66: ("tahrim",), 67: ("mulk",), 68: ("qalam",), 69: ("haqqa", "haqqah"),
+    70: ("maarij", "ma'arij"), 71: ("nuh", "nooh"), 72: ("jinn",), 73: ("muzzammil", "muzammil"),
+    74: ("muddaththir", "muddassir", "mudassir"), 75: ("qiyama", "qiyamah"), 76: ("insan", "dahr"),
+    77: ("mursalat",), 78: ("naba",), 79: ("naziat", "nazi'at"), 80: ("abasa",), 81: ("takwir",),
+    82: ("infitar",), 83: ("mutaffifin", "tatfif"), 84: ("inshiqaq",), 85: ("buruj",), 86: ("tariq",),
+    87: ("ala", "a'la"), 88: ("ghashiya", "ghashiyah"), 89: ("fajr",), 90: ("balad",), 91: ("shams",),
+    92: ("lail", "layl"), 93: ("duha", "zuha"), 94: ("sharh", "inshirah", "alam nashrah"), 95: ("tin", "teen"),
+    96: ("alaq", "iqra"), 97: ("qadr",), 98: ("bayyina", "bayyinah"), 99: ("zalzala", "zilzal", "zalzalah"),
+    100: ("adiyat",), 101: ("qaria", "qariah"), 102: ("takathur",), 103: ("asr",), 104: ("humaza", "humazah"),
+    105: ("fil", "feel"), 106: ("quraish", "quraysh"), 107: ("maun", "ma'un"),
+    108: ("kauthar", "kawthar", "kausar"), 109: ("kafirun", "kafiroon"), 110: ("nasr",), 111: ("masad", "lahab"),
+    112: ("ikhlas",), 113: ("falaq",), 114: ("nas", "naas"),
+}
+
+# Verses known by their own name: (surah, first ayat, last ayat).
+NAMED_VERSES = {
+    ("ayatul kursi", "ayat al kursi", "ayat ul kursi", "ayatal kursi", "throne verse"): (2, 255, 255),
+    ("ayat an nur", "ayatul nur", "light verse"): (24, 35, 35),
+    ("ayat al dayn", "debt verse"): (2, 282, 282),
+}
+
+# Transliterated names that only ever mean the Surah, so they match on their own ("Yaseen in Urdu").
+# Other names are also names of prophets and people ("Ibrahim", "Maryam", "Yusuf") or ordinary words
+# and topics ("Fajr", "Qadr", "Nur"): on their own those queries go to the AI, and they only match
+# after "Surah" or with an article ("Al-Fajr").
+BARE_SURAH_NAMES = (
+    "fatiha", "fateha", "fatihah", "baqara", "baqarah", "baqra", "bakara", "aal imran", "ale imran",
+    "maida", "maidah", "araf", "a'raf", "yasin", "yaseen", "ya sin", "kahf", "kahaf", "muminun", "mominoon",
+    "furqan", "shuara", "naml", "qasas", "ankabut", "ankaboot", "ahzab", "saffat", "zumar", "fussilat",
+    "zukhruf", "jathiya", "jasiya", "ahqaf", "hujurat", "dhariyat", "zariyat", "waqia", "waqiah",
+    "mujadila", "mujadilah", "mumtahina", "mumtahanah", "munafiqun", "munafiqoon", "taghabun", "tahrim",
+    "haqqa", "haqqah", "maarij", "ma'arij", "muzzammil", "muzammil", "muddaththir", "muddassir",
+    "mudassir", "mursalat", "naziat", "nazi'at", "abasa", "takwir", "infitar", "mutaffifin", "tatfif",
+    "inshiqaq", "buruj", "ghashiya", "ghashiyah", "zalzala", "zilzal", "zalzalah", "adiyat", "qaria",
+    "qariah", "takathur", "humaza", "humazah", "kafirun", "kafiroon", "ikhlas", "falaq", "kauthar",
+    "kawthar", "kausar",
+)
+
+# Names shorter than this (once folded) are too likely to be ordinary words ("sad", "tin"),
+# so they only match after an explicit "Surah", even with an article.
+MIN_BARE_NAME_LENGTH = 4
+
+# Where a name may match: on its own, only when written with an article, or only after "Surah".
+BARE, WITH_ARTICLE, PREFIXED = "bare", "with_article", "prefixed"
+# Trigram similarity a misspelt name needs, with and without an explicit "Surah" before it.
+FUZZY_THRESHOLD_PREFIXED = 0.5
+FUZZY_THRESHOLD_BARE = 0.75
+# Letters a misspelt name may gain or lose; more means the query says more than a name ("Yaseen benefits").
+FUZZY_MAX_LENGTH_CHANGE = 2
+
+_ARTICLES = frozenset({"al", "an", "as", "at", "ad", "ar", "az", "ash", "adh", "ath", "el", "ul"})
+_APOSTROPHES_RE = re.compile(r"['`‘’ʻʼʾʿ]")
+_WORD_RE = re.compile(r"\w+")
+_REPEAT_RE = re.compile(r"(.)\1+")
+_ARABIC_ARTICLE = "ال"
+_SURAH_PREFIX_RE = re.compile(r"^\s*(?:surah|surat|sura|soorah|chapter|سورة|سوره)\b\.?\s*",
+                              re.IGNORECASE)
+_REFERENCES_ONLY_RE = re.compile(r"[\d\s:,\-]*\d\s*:\s*\d[\d\s:,\-]*")
+_VERSE_WORD = r"(?:ayat|ayah|aya|ayaat|ayahs|verses?|v)"
+_NAME_REFERENCE_RE = re.compile(
+    rf"(?P<name>.+?)(?:(?:\s*[:,.]\s*|\s+)(?:{_VERSE_WORD}\.?\s*:?\s*)?"
+    rf"(?P<start>\d+)(?:\s*(?:-|to)\s*(?P<end>\d+))?)?",
+    re.IGNORECASE
+)
+
+
+def fold_name(text):
+    """Reduce a Surah name to a spelling-insensitive key: no articles, accents, doubled letters or e/o vowels."""
+    text = unicodedata.normalize("NFKD", normalize_arabic(text).casefold())
+    text = _APOSTROPHES_RE.sub("", "".join(ch for ch in text if not unicodedata.combining(ch)))
+    words = _WORD_RE.findall(text.replace("-", " "))
+    if len(words) > 1 and words[0] in _ARTICLES:
+        words = words[1:]
+    key = "".join(words).replace("e", "i").replace("o", "u")
+    if key.startswith(_ARABIC_ARTICLE) and len(key) > 4:
+        key = key[len(_ARABIC_ARTICLE):]
+    key = _REPEAT_RE.sub(r"\1", key)
+    if len(key) > 3 and key[-1] == "h" and key[-2] in "aiu":
+        key = key[:-1]
+    return key
+
+
+def has_article(name):
+    """Whether a name is written with the definite article, as in "Al-Fajr", "An Nas" or "الفجر"."""
+    name = normalize_arabic(name.strip()).casefold()
+    if name.startswith(_ARABIC_ARTICLE):
+        return True
+    words = _WORD_RE.findall(name.replace("-", " "))
+    return len(words) > 1 and words[0] in _ARTICLES
+
+
+def _trigrams(key):
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class Resolver:
+    """Answers plain Surah and verse lookups ("Surah Al-Fateha", "Ayatul Kursi", "2:255",
+    "Yaseen 1-10 in Urdu") without the AI.
+
+    Names come from the surahs table plus SURAH_NAME_VARIANTS and NAMED_VERSES, folded into
+    spelling-insensitive keys. Exact keys are a dict lookup; misspellings of BARE_SURAH_NAMES are
+    matched through a trigram index. Named verses and BARE_SURAH_NAMES match on their own, other
+    names need "Surah" or an article and must be spelt as a known variant. The whole text must be a
+    name, optionally with ayats. Anything else resolves to None and goes to the AI as before.
+    """
+
+    def __init__(self, surah_rows=()):
+        self._bare_keys = {fold_name(name) for name in BARE_SURAH_NAMES}
+        self._keys = {}  # folded name -> (surah number or (surah, start, end), BARE/WITH_ARTICLE/PREFIXED)
+        self._trigram_index = {}  # trigram -> folded names containing it
+        self._trigram_counts = {}  # folded name -> number of its trigrams
+        for surah, name_ar, name_en, name_en_translation, *_ in surah_rows:
+            self._add(name_ar, surah)
+            self._add(name_en, surah)
+            # Translated names are ordinary words ("The Cow", "Repentance") so they need "Surah".
+            self._add(name_en_translation, surah, needs_prefix=True)
+        for surah, variants in SURAH_NAME_VARIANTS.items():
+            for variant in variants:
+                self._add(variant, surah)
+        for names, verses in NAMED_VERSES.items():
+            for name in names:
+                self._add(name, verses, usage=BARE)
+        logger.info("Resolver indexed %s name(s) for %s Surah(s).", len(self._keys), len(surah_rows))
+
+    @classmethod
+    def from_database(cls, database):
+        return cls(database.load_surah_rows())
+
+    def _add(self, name, target, needs_prefix=False, usage=None):
+        key = fold_name(name or "")
+        if len(key) < 2 or key in self._keys:
+            return
+        if usage is None:
+            if key in self._bare_keys:
+                usage = BARE
+            elif needs_prefix or len(key) < MIN_BARE_NAME_LENGTH:
+                usage = PREFIXED
+            else:
+                usage = WITH_ARTICLE
+        self._keys[key] = (target, usage)
+        trigrams = _trigrams(key)
+        self._trigram_counts[key] = len(trigrams)
+        for trigram in trigrams:
+            self._trigram_index.setdefault(trigram, set()).add(key)
+
+    def resolve(self, query):
+        """An answer shaped like the AI's ({'language', 'rtl', 'ayats'}), or None if the query is not a plain lookup."""
+        text, _ = split_language_suffix(query.strip())
+        ayats = self._resolve_text(text.strip(" \t.?!"))
+        if not ayats:
+            return None
+        language, is_rtl = detect_language(query)
+        return {'language': language, 'rtl': is_rtl, 'ayats': ayats}
+
+    def _resolve_text(self, text):
+        if _REFERENCES_ONLY_RE.fullmatch(text):
+            return parse_references(text)
+        prefix = _SURAH_PREFIX_RE.match(text)
+        if prefix:
+            text = text[prefix.end():]
+        match = _NAME_REFERENCE_RE.fullmatch(text)
+        if not match:
+            return None
+        name, start, end = match.group("name"), match.group("start"), match.group("end")
+        if name.isdigit():
+            if not prefix and start is None:
+                return None  # A bare number is not clearly a Surah
+            target = int(name)
+        else:
+            target = self._lookup(name, bool(prefix))
+        if target is None:
+            return None
+        if isinstance(target, tuple):
+            return None if start else expand_reference(*target)
+        if start is None:
+            return expand_reference(target, 1, verse_count(target))
+        return expand_reference(target, int(start), int(end) if end else None)
+
+    def _lookup(self, name, prefixed):
+        key = fold_name(name)
+        article = has_article(name)
+
+        def allowed(usage):
+            return prefixed or usage == BARE or (usage == WITH_ARTICLE and article)
+
+        entry = self._keys.get(key)
+        if entry:
+            target, usage = entry
+            return target if allowed(usage) else None
+        if len(key) < MIN_BARE_NAME_LENGTH:
+            return None
+        threshold = FUZZY_THRESHOLD_PREFIXED if prefixed else FUZZY_THRESHOLD_BARE
+        trigrams = _trigrams(key)
+        shared = {}
+        for trigram in trigrams:
+            for candidate in self._trigram_index.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        best, best_score = None, threshold
+        for candidate, count in shared.items():
+            target, usage = self._keys[candidate]
+            # Names that are also people or words must be spelt exactly: "Surah Yusuf story" is a
+            # question about the story, not a misspelling of Yusuf.
+            if usage != BARE or abs(len(candidate) - len(key)) > FUZZY_MAX_LENGTH_CHANGE:
+                continue
+            score = 2 * count / (len(trigrams) + self._trigram_counts[candidate])
+            if score >= best_score:
+                best, best_score = target, score
+        if best is not None:
+            logger.debug("Resolved %r to %s by similarity %.2f", name, best, best_score)
+        return best
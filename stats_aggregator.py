@@ -0,0 +1,86 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StatsAggregator:
+    """Write-behind buffer for channel/user counters.
+
+    Increments and last-seen timestamps are accumulated in memory and written in one
+    transaction every `flush_interval` seconds, after `flush_events` events, and on stop.
+    """
+
+    def __init__(self, database, flush_interval, flush_events):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self._channels = {}  # channel -> [message_count, last_activity]
+        self._users = {}  # nick -> [total_commands, successful_queries, failed_queries, last_seen]
+        self._events = 0
+        self._task = None
+        self._pending_flush = None
+        self._flush_lock = asyncio.Lock()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def record_channel(self, channel, inc_message, last_activity):
+        self._add_channel(channel, inc_message, last_activity)
+        self._record_event()
+
+    def record_user(self, nick, inc_total, inc_success, inc_fail, last_seen):
+        self._add_user(nick, inc_total, inc_success, inc_fail, last_seen)
+        self._record_event()
+
+    def _add_channel(self, channel, inc_message, last_activity):
+        entry = self._channels.setdefault(channel, [0, 0])
+        entry[0] += inc_message
+        entry[1] = max(entry[1], last_activity)
+
+    def _add_user(self, nick, inc_total, inc_success, inc_fail, last_seen):
+        entry = self._users.setdefault(nick, [0, 0, 0, 0])
+        entry[0] += inc_total
+        entry[1] += inc_success
+        entry[2] += inc_fail
+        entry[3] = max(entry[3], last_seen)
+
+    def _record_event(self):
+        self._events += 1
+        if self._events >= self.flush_events and (self._pending_flush is None or self._pending_flush.done()):
+            self._pending_flush = asyncio.create_task(self.flush())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._channels and not self._users:
+                return
+            channels, self._channels = self._channels, {}
+            users, self._users = self._users, {}
+            self._events = 0
+            channel_rows = [(channel, count, last) for channel, (count, last) in channels.items()]
+            user_rows = [(nick, total, success, fail, last) for nick, (total, success, fail, last) in users.items()]
+            try:
+                await asyncio.to_thread(self.database.apply_stats_batch, channel_rows, user_rows)
+                logger.debug("Flushed stats for %s channel(s) and %s user(s).", len(channel_rows), len(user_rows))
+            except Exception as e:
+                logger.error("Failed to flush stats, keeping them for the next flush: %s", e)
+                for row in channel_rows:
+                    self._add_channel(*row)
+                for row in user_rows:
+                    self._add_user(*row)
@@ -0,0 +1,114 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected
+
+
+def _controller(concurrency=1, max_queue=10, channel_quota=3, deadline=60, shed_latency=600):
+    return AdmissionController(concurrency, max_queue, channel_quota, deadline, shed_latency, initial_service_time=1.0)
+
+
+def test_free_slot_is_granted_at_once():
+    async def scenario():
+        controller = _controller(concurrency=2)
+        first = await controller.admit("#a")
+        second = await controller.admit("#b")
+        assert controller.stats()["running"] == 2
+        first.release()
+        first.release()  # Releasing twice frees the slot once
+        second.release()
+        assert controller.stats()["running"] == 0
+    asyncio.run(scenario())
+
+
+def test_channel_quota_counts_waiting_and_running_queries():
+    async def scenario():
+        controller = _controller(channel_quota=2)
+        held = await controller.admit("#Chan")
+        waiter = asyncio.create_task(controller.admit("#chan"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("#CHAN")
+        assert rejected.value.message_key == "channel_busy"
+        waiter.cancel()
+        held.release()
+    asyncio.run(scenario())
+
+
+def test_waiting_queries_are_admitted_owner_first_then_by_quietest_channel():
+    async def scenario():
+        controller = _controller()
+        held = await controller.admit("#busy")
+        order = []
+
+        async def query(channel, owner=False):
+            ticket = await controller.admit(channel, owner=owner)
+            order.append(channel)
+            ticket.release()
+
+        tasks = [asyncio.create_task(query("#busy"))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(query("#quiet")))
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(query("owner", owner=True)))
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 3
+        held.release()
+        await asyncio.gather(*tasks)
+        assert order == ["owner", "#busy", "#quiet"]
+    asyncio.run(scenario())
+
+
+def test_full_queue_sheds_new_queries():
+    async def scenario():
+        controller = _controller(max_queue=1)
+        held = await controller.admit("#a")
+        waiter = asyncio.create_task(controller.admit("#b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("#c")
+        assert rejected.value.reason == "shed"
+        held.release()
+        (await waiter).release()
+    asyncio.run(scenario())
+
+
+def test_long_estimated_wait_sheds_all_but_the_owner():
+    async def scenario():
+        controller = _controller(shed_latency=0.5)
+        held = await controller.admit("#a")
+        with pytest.raises(AdmissionRejected):
+            await controller.admit("#b")
+        owner = asyncio.create_task(controller.admit("owner", owner=True))
+        await asyncio.sleep(0)
+        held.release()
+        (await owner).release()
+    asyncio.run(scenario())
+
+
+def test_waiting_past_the_deadline_expires():
+    async def scenario():
+        controller = _controller(deadline=0.05)
+        held = await controller.admit("#a")
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("#b")
+        assert rejected.value.reason == "expired"
+        assert controller.stats()["waiting"] == 0
+        held.release()
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = _controller()
+        held = await controller.admit("#a")
+        waiter = asyncio.create_task(controller.admit("#b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert controller.stats()["waiting"] == 0
+        held.release()
+        assert controller.stats()["running"] == 0
+    asyncio.run(scenario())
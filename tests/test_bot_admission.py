@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import bot
+from admission import AdmissionController, AdmissionRejected
+from resolver import Resolver
+
+CACHED_ANSWER = {'language': 'en', 'rtl': False, 'ayats': [(2, 255)]}
+
+
+class _Cache:
+    def __init__(self, answers):
+        self.answers = answers
+
+    async def get(self, query):
+        return self.answers.get(query)
+
+
+class _AIClient:
+    def __init__(self):
+        self.queries = []
+
+    async def query_quran(self, query, cache_checked=False):
+        self.queries.append(query)
+        return CACHED_ANSWER
+
+
+def _bot(cache_answers):
+    """A bot with only what process_locally needs: a saturated, shedding admission controller."""
+    instance = bot.QuranIRCBot.__new__(bot.QuranIRCBot)
+    instance.resolver = Resolver()
+    instance.query_cache = _Cache(cache_answers)
+    instance.ai_client = _AIClient()
+    instance.admission = AdmissionController(1, 0, 5, 60, 600)
+    instance.active_tasks = {}
+    instance.sent = []
+
+    async def send_verse_lines(target, nick, pairs, language, is_rtl):
+        instance.sent.append(pairs)
+        return len(pairs)
+
+    async def admit_query(target, nick):
+        return await instance.admission.admit(target)
+
+    instance.send_verse_lines = send_verse_lines
+    instance.admit_query = admit_query
+    return instance
+
+
+def test_cached_answer_skips_a_saturated_admission_controller():
+    async def scenario():
+        instance = _bot({"what about the throne": CACHED_ANSWER})
+        held = await instance.admission.admit("#busy")  # The only slot, and no room to queue
+        response, lines = await instance.process_locally("#c", "alice", "what about the throne")
+        assert response == CACHED_ANSWER and lines == 1
+        assert instance.ai_client.queries == []
+        held.release()
+    asyncio.run(scenario())
+
+
+def test_cache_miss_still_takes_an_admission_slot():
+    async def scenario():
+        instance = _bot({})
+        held = await instance.admission.admit("#busy")
+        with pytest.raises(AdmissionRejected):
+            await instance.process_locally("#c", "alice", "what about patience")
+        held.release()
+        response, _ = await instance.process_locally("#c", "alice", "what about patience")
+        assert instance.ai_client.queries == ["what about patience"]
+        assert instance.admission.stats()["running"] == 0
+    asyncio.run(scenario())
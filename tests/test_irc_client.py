@@ -0,0 +1,44 @@
+import asyncio
+
+from irc_client import IRCClient
+
+
+async def _server():
+    """A local server that accepts connections and never answers."""
+    async def handle(reader, writer):
+        await reader.read()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_failed_registration_send_closes_the_connection():
+    async def scenario():
+        server, port = await _server()
+        client = IRCClient("127.0.0.1", port, "QuranBot", "", [])
+        sent = []
+
+        async def send_command(command):
+            sent.append(command)
+            return False
+        client.send_command = send_command
+        await client.connect()
+        assert sent == ["CAP LS"]
+        assert not client.connected and client.writer is None
+        assert client._health_task is None and client.failures == 1
+        server.close()
+    asyncio.run(scenario())
+
+
+def test_reconnecting_replaces_the_health_monitor():
+    async def scenario():
+        server, port = await _server()
+        client = IRCClient("127.0.0.1", port, "QuranBot", "", [])
+        await client.connect()
+        first = client._health_task
+        await client.connect()
+        assert first.cancelled()
+        assert client._health_task is not first and not client._health_task.done()
+        await client.shutdown()
+        await client.outbound.stop()
+        server.close()
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+from irc_parser import HANDLED_COMMANDS, decode, parse_line, peek_command
+
+
+def test_privmsg_with_prefix_and_trailing():
+    message = parse_line(b":Nick!user@host PRIVMSG #channel :!Quran 2:255\r\n")
+    assert message.prefix == "Nick!user@host"
+    assert message.nick == "Nick"
+    assert message.command == "PRIVMSG"
+    assert message.params == ["#channel", "!Quran 2:255"]
+    assert message.tags == {}
+
+
+def test_tags_are_parsed_and_unescaped():
+    message = parse_line(b"@time=2024-01-01T00:00:00Z;msgid=abc;note=a\\sb\\:c\\\\;flag "
+                         b":Nick!u@h PRIVMSG #c :hi")
+    assert message.tags == {"time": "2024-01-01T00:00:00Z", "msgid": "abc", "note": "a b;c\\", "flag": ""}
+    assert message.nick == "Nick"
+    assert message.params == ["#c", "hi"]
+
+
+def test_numeric_without_prefix_and_lowercase_command():
+    assert parse_line(b"001 QuranBot :Welcome").command == "001"
+    message = parse_line(b"ping :irc.example.net")
+    assert message.command == "PING"
+    assert message.prefix is None and message.nick is None
+    assert message.params == ["irc.example.net"]
+
+
+def test_trailing_may_contain_colons_and_be_empty():
+    assert parse_line(b":n!u@h PRIVMSG #c ::) 1:2").params == ["#c", ":) 1:2"]
+    assert parse_line(b":n!u@h PRIVMSG #c :").params == ["#c", ""]
+    assert parse_line(b":n!u@h MODE #c +o  Nick").params == ["#c", "+o", "Nick"]
+
+
+def test_malformed_lines():
+    assert parse_line(b"") is None
+    assert parse_line(b"\r\n") is None
+    assert parse_line(b":prefix-only") is None
+    assert parse_line(b"@tags-only") is None
+    assert parse_line(b"@a=b :prefix") is None
+
+
+def test_non_utf8_falls_back_to_latin1():
+    message = parse_line(b":n!u@h PRIVMSG #c :caf\xe9")
+    assert message.params[-1] == "café"
+    assert decode("سلام".encode("utf-8")) == "سلام"
+
+
+def test_peek_command():
+    assert peek_command(b"PING :irc.example.net\r\n") == b"PING"
+    assert peek_command(b":n!u@h PRIVMSG #c :hi") == b"PRIVMSG"
+    assert peek_command(b"@time=x :n!u@h  PRIVMSG #c :hi") == b"PRIVMSG"
+    assert peek_command(b":server 372 Bot :- motd") == b"372"
+    assert peek_command(b"QUIT\r\n") == b"QUIT"
+
+
+def test_peek_command_on_malformed_lines():
+    assert peek_command(b"") == b""
+    assert peek_command(b"@tags-only") == b""
+    assert peek_command(b":prefix-only") == b""
+
+
+def test_peek_agrees_with_parse_for_handled_commands():
+    lines = [b":n!u@h PRIVMSG #c :hi", b"PING :x", b"@a=b PONG server :qb1", b":s 001 Bot :Welcome",
+             b":s 433 * Bot :Nickname is already in use", b"ERROR :Closing link"]
+    for line in lines:
+        assert peek_command(line) in HANDLED_COMMANDS
+        assert peek_command(line).decode() == parse_line(line).command
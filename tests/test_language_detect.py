@@ -0,0 +1,45 @@
+import pytest
+
+from language_detect import DEFAULT_LANGUAGE, detect_language, language_name_code, split_language_suffix
+
+
+@pytest.mark.parametrize("query, language, rtl", [
+    ("اللہ کی رحمت کے بارے میں کیا ہے", "ur", True),
+    ("آیت الکرسی", "ur", True),  # Urdu-only letters, no stopwords
+    ("ما هو الصبر في القرآن", "ar", True),
+    ("صبر", "ar", True),  # Arabic script without Urdu letters defaults to Arabic
+    ("What does the Quran say about patience?", "en", False),
+    ("Was sagt der Koran über Geduld", "de", False),
+    ("¿Qué dice el Corán sobre la paciencia?", "es", False),
+    ("Что говорит Коран о терпении", "ru", False),
+])
+def test_detects_the_language_of_the_text(query, language, rtl):
+    assert detect_language(query) == (language, rtl)
+
+
+@pytest.mark.parametrize("query, language", [
+    ("Surah Al-Fateha in Urdu", "ur"),
+    ("patience in Hindi", "hi"),
+    ("sabar in Bahasa Indonesia", "id"),
+    ("اللہ کی رحمت in English", "en"),  # The suffix wins over the script
+])
+def test_language_suffix_wins(query, language):
+    assert detect_language(query)[0] == language
+
+
+@pytest.mark.parametrize("query", ["", "2:255", "Ayatul Kursi", "!!!"])
+def test_no_evidence_gives_the_default(query):
+    assert detect_language(query) == (DEFAULT_LANGUAGE, False)
+    assert detect_language(query, default="ur") == ("ur", True)
+
+
+def test_split_language_suffix():
+    assert split_language_suffix("Yaseen in Urdu") == ("Yaseen", "ur")
+    assert split_language_suffix("Yaseen in urdu.") == ("Yaseen", "ur")
+    assert split_language_suffix("faith in God") == ("faith in God", None)
+
+
+def test_language_name_code():
+    assert language_name_code("Urdu") == "ur"
+    assert language_name_code(" ESPAÑOL ") == "es"
+    assert language_name_code("Klingon") is None
@@ -0,0 +1,70 @@
+import random
+import unicodedata
+
+from linepack import LinePacker, default_hostmask, line_budget, split_text
+
+RLE, PDF = "\u202B", "\u202C"  # Right-to-left embedding and its closing mark
+MARKS = RLE + PDF
+WORDS = [
+    "بِسْمِ", "اللَّهِ", "الرَّحْمَٰنِ", "الرَّحِيمِ", "ٱلْحَمْدُ", "لِلَّهِ",  # Arabic with harakat
+    "اللہ", "کے", "نام", "سے", "جو", "رحمان", "اور", "رحیم", "ہے",  # Urdu
+    "In", "the", "name", "of", "Allah", "(2:255)", "|",
+    "ٱلرَّحْمَٰنِٱلرَّحِيمِمَٰلِكِيَوْمِٱلدِّينِ",  # A word longer than the smaller budgets
+]
+
+
+def _content(text):
+    return "".join(ch for ch in text if ch not in MARKS and not ch.isspace())
+
+
+def _random_text(rng):
+    """Words in Arabic, Urdu and English, some embedded right-to-left, optionally all inside a second embedding."""
+    parts = []
+    for _ in range(rng.randint(1, 40)):
+        word = rng.choice(WORDS)
+        if rng.random() < 0.3:
+            word = RLE + word + PDF
+        parts.append(word)
+    text = " ".join(parts)
+    return RLE + text + PDF if rng.random() < 0.5 else text
+
+
+def test_pieces_never_exceed_the_budget():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        text = _random_text(rng)
+        budget = rng.randint(24, 120)
+        pieces = split_text(text, budget)
+        for piece in pieces:
+            assert len(piece.encode('utf-8')) <= budget, (text, budget, piece)
+            assert not unicodedata.combining(piece[0]), (text, budget, piece)
+        assert _content("".join(pieces)) == _content(text)
+
+
+def test_embeddings_are_balanced_in_every_piece():
+    text = RLE + " ".join(["الرَّحْمَٰنِ"] * 30) + PDF
+    pieces = split_text(text, 60)
+    assert len(pieces) > 1
+    for piece in pieces:
+        assert piece.count(RLE) == piece.count(PDF), piece
+        assert len(piece.encode('utf-8')) <= 60
+
+
+def test_breaks_at_whitespace():
+    assert split_text("aaa bbb ccc", 7) == ["aaa bbb", "ccc"]
+    assert split_text("short", 100) == ["short"]
+    assert split_text("abcdefghij", 4) == ["abcd", "efgh", "ij"]
+
+
+def test_line_packer_joins_lines_within_the_budget():
+    packer = LinePacker(20)
+    packed = packer.add("one") + packer.add("two") + packer.add("a longer third line")
+    packed += packer.flush()
+    assert packed == ["one | two", "a longer third line"]
+    assert all(len(line.encode('utf-8')) <= 20 for line in packed)
+
+
+def test_line_budget_accounts_for_the_relayed_prefix():
+    hostmask = default_hostmask("QuranBot")
+    budget = line_budget("#channel", hostmask)
+    assert len(f":{hostmask} PRIVMSG #channel :{'x' * budget}\r\n".encode('utf-8')) == 512
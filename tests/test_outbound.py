@@ -0,0 +1,47 @@
+import asyncio
+
+from outbound import PRIORITY_BULK, OutboundScheduler
+
+
+def _scheduler(max_pending=2):
+    async def send_line(line):
+        return True
+    return OutboundScheduler(send_line, rate=1, burst=1, max_pending_per_target=max_pending, name="test")
+
+
+def test_discard_releases_a_blocked_wait_for_capacity():
+    async def scenario():
+        scheduler = _scheduler()  # Never started, so nothing is sent
+        scheduler.enqueue("#c", "PRIVMSG #c :one", PRIORITY_BULK, "nick")
+        scheduler.enqueue("#c", "PRIVMSG #c :two", PRIORITY_BULK, "nick")
+        waiter = asyncio.create_task(scheduler.wait_for_capacity("#c"))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        assert scheduler.discard("#c", "nick") == 2
+        await asyncio.wait_for(waiter, 1)
+    asyncio.run(scenario())
+
+
+def test_discard_releases_a_blocked_drain():
+    async def scenario():
+        scheduler = _scheduler()
+        scheduler.pause()
+        scheduler.start()
+        scheduler.enqueue("#c", "PRIVMSG #c :one", PRIORITY_BULK, "nick")
+        drain = asyncio.create_task(scheduler.drain(30))
+        await asyncio.sleep(0.01)
+        assert not drain.done()
+        scheduler.discard()
+        await asyncio.wait_for(drain, 1)
+        await scheduler.stop()
+    asyncio.run(scenario())
+
+
+def test_discard_by_tag_keeps_other_lines():
+    async def scenario():
+        scheduler = _scheduler()
+        scheduler.enqueue("#c", "PRIVMSG #c :a", PRIORITY_BULK, "alice")
+        scheduler.enqueue("#c", "PRIVMSG #c :b", PRIORITY_BULK, "bob")
+        assert scheduler.discard("#c", "alice") == 1
+        assert scheduler.pending("#c") == 1
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import pytest
+
+from database import Database
+from outbound_journal import OutboundJournal
+
+PAIRS = [(36, 1), (36, 2), (36, 3)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "quran.db")
+
+
+def _restart(path, journal=None, max_age=600):
+    """Close the database as a stopped bot would, and open a new journal on it."""
+    if journal:
+        journal.database.execute_write(lambda conn: None)  # Wait for the queued journal writes
+        journal.database.close()
+    return OutboundJournal(Database(path), max_age)
+
+
+def test_unfinished_result_is_handed_back_with_its_queued_count(path):
+    journal = _restart(path)
+    journal.begin_result("conn", "#c", "alice", PAIRS, "ur", True, 400)
+    first = journal.append("conn", "#c", "alice", "line 1")
+    journal.append("conn", "#c", "alice", "line 2")
+    journal.append("conn", "#c", "bob", "other result")
+    journal.mark_sent("conn", "#c", first)
+    journal = _restart(path, journal)
+    recovered, expired, results = journal.take_recovered("conn")
+    assert [line for _, _, line in recovered["#c"]] == ["line 2", "other result"]
+    assert expired == {}
+    assert results == {"#c": {"alice": (PAIRS, "ur", True, 400, 2)}}
+    assert journal.take_recovered("conn") == ({}, {}, {})  # Handed out once
+    journal.database.close()
+
+
+def test_finished_result_replays_only_its_lines(path):
+    journal = _restart(path)
+    journal.begin_result("conn", "#c", "alice", PAIRS, "en", False, 400)
+    journal.append("conn", "#c", "alice", "line 1")
+    journal.end_result("conn", "#c", "alice")
+    journal.append("conn", "#c", "alice", "completion")
+    journal = _restart(path, journal)
+    recovered, _, results = journal.take_recovered("conn")
+    assert [line for _, _, line in recovered["#c"]] == ["line 1", "completion"]
+    assert results == {}
+    journal.database.close()
+
+
+def test_discarded_result_is_not_resumed(path):
+    journal = _restart(path)
+    journal.begin_result("conn", "#c", "alice", PAIRS, "en", False, 400)
+    journal.append("conn", "#c", "alice", "line 1")
+    journal.discard("conn", "#c", "alice")
+    journal = _restart(path, journal)
+    assert journal.take_recovered("conn") == ({}, {}, {})
+    journal.database.close()
+
+
+def test_stale_result_expires(path):
+    journal = _restart(path)
+    journal.begin_result("conn", "alice", "alice", PAIRS, "en", False, 400)
+    journal.database.execute_write(lambda conn: conn.execute("UPDATE outbound_result SET updated = updated - 60"))
+    journal = _restart(path, journal, max_age=30)
+    assert journal.take_recovered("conn") == ({}, {"alice": {"alice"}}, {})
+    journal = _restart(path, journal, max_age=30)
+    assert journal.take_recovered("conn") == ({}, {}, {})
+    journal.database.close()
@@ -0,0 +1,55 @@
+from references import MAX_RANGE_AYATS, expand_reference, parse_references, verse_count
+
+
+def test_pair_and_range():
+    assert parse_references("2:255-257") == [(2, 255), (2, 256), (2, 257)]
+    assert parse_references("(1:1)") == [(1, 1)]
+
+
+def test_surah_ayat_form():
+    assert parse_references("Surah: 2, Ayat: 255") == [(2, 255)]
+    assert parse_references("surah 36, ayat 1") == [(36, 1)]
+
+
+def test_comma_continuations_stay_in_the_surah():
+    assert parse_references("2:255, 256, 258-260") == [(2, 255), (2, 256), (2, 258), (2, 259), (2, 260)]
+
+
+def test_continuation_does_not_swallow_the_next_reference():
+    assert parse_references("2:255, 3:1") == [(2, 255), (3, 1)]
+    assert parse_references("62:9-10, 63:1") == [(62, 9), (62, 10), (63, 1)]
+
+
+def test_pairs_are_deduplicated_in_first_seen_order():
+    assert parse_references("3:2, 2:255 and 3:2") == [(3, 2), (2, 255)]
+
+
+def test_out_of_range_references_are_dropped():
+    assert parse_references("1:8") == []
+    assert parse_references("115:1") == []
+    assert parse_references("0:1") == []
+    assert parse_references("2:0") == []
+    assert parse_references("2:10-5") == []
+
+
+def test_range_end_is_clamped_to_the_surah():
+    assert parse_references("1:6-20") == [(1, 6), (1, 7)]
+    assert expand_reference(114, 5, 100) == [(114, 5), (114, 6)]
+
+
+def test_max_range_and_max_total():
+    assert len(parse_references("2:1-286")) == 286
+    assert len(parse_references("2:1-286", max_range=10)) == 10
+    assert parse_references("1:1-7, 2:1", max_total=3) == [(1, 1), (1, 2), (1, 3)]
+    assert MAX_RANGE_AYATS == verse_count(2)
+
+
+def test_text_without_references():
+    assert parse_references("What does the Quran say about patience?") == []
+
+
+def test_verse_count():
+    assert verse_count(1) == 7
+    assert verse_count(114) == 6
+    assert verse_count(0) == 0
+    assert verse_count(115) == 0
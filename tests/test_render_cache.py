@@ -0,0 +1,65 @@
+import sqlite3
+import time
+
+import pytest
+
+from database import Database
+from render_cache import RenderCache
+
+LINES = ["Surah 1: The Opening", "Ayat 1: بِسْمِ ٱللَّهِ | Translation: In the name of Allah"]
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "quran.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE surahs (id INTEGER PRIMARY KEY, name_ar TEXT, name_en TEXT, "
+                 "name_en_translation TEXT, type TEXT)")
+    conn.execute("CREATE TABLE arabic (number INTEGER PRIMARY KEY, surah_id INTEGER, number_in_surah INTEGER, "
+                 "text TEXT)")
+    conn.execute("CREATE TABLE english (id INTEGER PRIMARY KEY, ayah_id INTEGER, data TEXT)")
+    conn.execute("INSERT INTO surahs VALUES (1, 'الفاتحة', 'Al-Faatiha', 'The Opening', 'Meccan')")
+    for ayat in range(1, 8):
+        conn.execute("INSERT INTO arabic VALUES (?, 1, ?, ?)", (ayat, ayat, f"آية {ayat}"))
+        conn.execute("INSERT INTO english (ayah_id, data) VALUES (?, ?)", (ayat, f"Verse {ayat}"))
+    conn.commit()
+    conn.close()
+    database = Database(str(path))
+    database.load_corpus(1024 * 1024)
+    yield database
+    database.close()
+
+
+def test_unrelated_writes_keep_cached_renders(database):
+    cache = RenderCache(database, 1024 * 1024)
+    key = cache.key([(1, 1)], 'en', False, 400)
+    cache.put(key, LINES)
+    for index in range(300):
+        database.log_query(f"nick{index}", "#channel", "Ayatul Kursi", True, 3)
+        database.store_cached_answer(f"en:query {index}", '{"ayats": [[2, 255]]}', time.time(), 5000)
+        database.append_journal_line(index + 1, "QuranBot", "#channel", "nick", "line", time.time()).result()
+    database.execute_write(lambda conn: conn.execute("PRAGMA wal_checkpoint(TRUNCATE)"))
+    database.load_corpus(1024 * 1024)  # Reloading unchanged Quran tables keeps the cache too
+    assert cache.get(key) == tuple(LINES)
+
+
+def test_reloading_changed_quran_tables_drops_cached_renders(database):
+    cache = RenderCache(database, 1024 * 1024)
+    key = cache.key([(1, 1)], 'en', False, 400)
+    cache.put(key, LINES)
+    database.execute_write(lambda conn: conn.execute("UPDATE english SET data = 'In the name of God' WHERE id = 1"))
+    assert cache.get(key) == tuple(LINES)  # Not reloaded yet
+    database.load_corpus(1024 * 1024)
+    assert cache.get(key) is None
+    assert cache.stats() == {"entries": 0, "bytes": 0}
+
+
+def test_entries_are_bounded_by_bytes(database):
+    cache = RenderCache(database, 2000, max_entry_bytes=1000)
+    for surah in range(1, 11):
+        cache.put(cache.key([(surah, 1)], 'en', False, 400), ["x" * 300])
+    assert cache.bytes <= 2000
+    assert cache.get(cache.key([(1, 1)], 'en', False, 400)) is None
+    assert cache.get(cache.key([(10, 1)], 'en', False, 400)) == ("x" * 300,)
+    cache.put(cache.key([(11, 1)], 'en', False, 400), ["x" * 1500])  # Larger than one entry may be
+    assert cache.get(cache.key([(11, 1)], 'en', False, 400)) is None
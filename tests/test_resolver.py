@@ -0,0 +1,92 @@
+import pytest
+
+from resolver import Resolver, fold_name, has_article
+
+SURAH_ROWS = [
+    (1, "الفاتحة", "Al-Faatiha", "The Opening"),
+    (2, "البقرة", "Al-Baqara", "The Cow"),
+    (14, "ابراهيم", "Ibrahim", "Abraham"),
+    (19, "مريم", "Maryam", "Mary"),
+    (36, "يس", "Yaseen", "Yaseen"),
+    (89, "الفجر", "Al-Fajr", "The Dawn"),
+]
+
+
+@pytest.fixture(scope="module")
+def resolver():
+    return Resolver(SURAH_ROWS)
+
+
+def _ayats(resolver, query):
+    answer = resolver.resolve(query)
+    return None if answer is None else answer["ayats"]
+
+
+@pytest.mark.parametrize("query", ["Ibrahim", "Maryam", "Muhammad", "Yusuf", "Fajr", "Duha", "Qadr", "Nur",
+                                   "Rahman", "Imran", "Ibrahim 1-5", "مريم", "The Cow", "Mary", "Sad", "14"])
+def test_ambiguous_bare_names_go_to_the_ai(resolver, query):
+    assert resolver.resolve(query) is None
+
+
+@pytest.mark.parametrize("query, surah, count", [
+    ("Surah Ibrahim", 14, 52),
+    ("Surah Maryam", 19, 98),
+    ("Surah Muhammad", 47, 38),
+    ("Surah Fajr", 89, 30),
+    ("Surah The Cow", 2, 286),
+    ("Surah Sad", 38, 88),
+    ("surat yusuf", 12, 111),
+    ("سورة مريم", 19, 98),
+    ("Surah 14", 14, 52),
+])
+def test_prefixed_names_resolve(resolver, query, surah, count):
+    ayats = _ayats(resolver, query)
+    assert ayats[0] == (surah, 1)
+    assert len(ayats) == count
+
+
+@pytest.mark.parametrize("query, surah", [
+    ("Al-Baqarah", 2), ("Al Imran", 3), ("Al-Fajr", 89), ("Ar-Rahman", 55),  # Written with an article
+    ("Yaseen", 36), ("Fatiha", 1), ("Kahf", 18), ("Ikhlas", 112),  # Names that only mean the Surah
+    ("Baqarra", 2), ("Yasen", 36),  # Spelling variants of those
+])
+def test_unambiguous_bare_names_resolve(resolver, query, surah):
+    assert _ayats(resolver, query)[0] == (surah, 1)
+
+
+def test_verse_ranges_and_named_verses(resolver):
+    assert _ayats(resolver, "Ayatul Kursi") == [(2, 255)]
+    assert _ayats(resolver, "2:255-257") == [(2, 255), (2, 256), (2, 257)]
+    assert _ayats(resolver, "Al-Baqarah 255") == [(2, 255)]
+    assert _ayats(resolver, "Surah Ibrahim 1-5") == [(14, ayat) for ayat in range(1, 6)]
+
+
+def test_language_suffix_selects_the_translation(resolver):
+    answer = resolver.resolve("Yaseen in Urdu")
+    assert answer["language"] == "ur" and answer["rtl"]
+    assert len(answer["ayats"]) == 83
+    assert resolver.resolve("Surah Al-Fateha in English")["language"] == "en"
+
+
+def test_topic_queries_go_to_the_ai(resolver):
+    assert resolver.resolve("What does the Quran say about patience?") is None
+    assert resolver.resolve("Kursi") is None
+
+
+@pytest.mark.parametrize("query", ["Surah Yusuf story", "Surah Ibrahim dua", "Al-Fajr meaning",
+                                   "Surah Yaseen benefits", "Surah Kahf on Friday", "Ayatul Kursi meaning"])
+def test_names_followed_by_other_words_go_to_the_ai(resolver, query):
+    assert resolver.resolve(query) is None
+
+
+def test_misspelt_names_match_only_when_distinctive(resolver):
+    assert _ayats(resolver, "Surah Waqiya")[0] == (56, 1)
+    assert _ayats(resolver, "Zalzalla")[0] == (99, 1)
+    assert resolver.resolve("Surah Ibrahm") is None  # Names of people must be a known spelling
+
+
+def test_fold_name_and_article():
+    assert fold_name("Al-Faatiha") == fold_name("fateha") == fold_name("Fatihah")
+    assert fold_name("Yaseen") == fold_name("Ya-Sin")
+    assert has_article("Al-Fajr") and has_article("an nas") and has_article("الفجر")
+    assert not has_article("Fajr") and not has_article("Alaq")
@@ -0,0 +1,144 @@
+import atexit
+import logging
+import logging.config
+import logging.handlers
+import queue
+import random
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """Per-category sampling and token-bucket rate limits, applied before a record is queued.
+
+    Each rule names a logger (its children included), the highest level it applies to, and any
+    of `sample` (fraction of records kept), `rate` (records per second) and `burst`. The most
+    specific rule wins. Dropped records are counted and reported on the next record that passes.
+    """
+
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = [self._make_rule(rule) for rule in rules]
+        self._by_logger = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_rule(rule):
+        level = rule.get("level", "INFO")
+        burst = float(rule.get("burst", rule.get("rate", 0)) or 0)
+        return {
+            "logger": rule["logger"],
+            "level": logging.getLevelName(level) if isinstance(level, str) else level,
+            "sample": float(rule.get("sample", 1.0)),
+            "rate": float(rule["rate"]) if "rate" in rule else None,
+            "burst": max(burst, 1.0),
+            "tokens": max(burst, 1.0),
+            "updated": time.monotonic(),
+            "suppressed": 0,
+        }
+
+    def _rule_for(self, name):
+        if name not in self._by_logger:
+            matches = [rule for rule in self.rules
+                       if name == rule["logger"] or name.startswith(rule["logger"] + ".")]
+            self._by_logger[name] = max(matches, key=lambda rule: len(rule["logger"]), default=None)
+        return self._by_logger[name]
+
+    def filter(self, record):
+        rule = self._rule_for(record.name)
+        if rule is None or record.levelno > rule["level"]:
+            return True
+        with self._lock:
+            allowed = rule["sample"] >= 1.0 or random.random() < rule["sample"]
+            if allowed and rule["rate"] is not None:
+                now = time.monotonic()
+                rule["tokens"] = min(rule["burst"], rule["tokens"] + (now - rule["updated"]) * rule["rate"])
+                rule["updated"] = now
+                if rule["tokens"] >= 1:
+                    rule["tokens"] -= 1
+                else:
+                    allowed = False
+            if not allowed:
+                rule["suppressed"] += 1
+                return False
+            if rule["suppressed"]:
+                record.suppressed = rule["suppressed"]
+                rule["suppressed"] = 0
+        return True
+
+
+class TruncatingFilter(logging.Filter):
+    """Merges a record's arguments and cuts messages longer than `max_length` characters.
+
+    Runs on the listener thread, so large payloads are only rendered off the event loop.
+    """
+
+    def __init__(self, max_length):
+        super().__init__()
+        self.max_length = max_length
+
+    def filter(self, record):
+        if getattr(record, "truncated", False):  # Already handled for another handler
+            return True
+        message = record.getMessage()
+        if len(message) > self.max_length:
+            message = f"{message[:self.max_length]}... [{len(message) - self.max_length} chars truncated]"
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message = f"{message} [{suppressed} similar message(s) suppressed]"
+        record.msg = message
+        record.args = None
+        record.truncated = True
+        return True
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are; the listener lives in this process, so nothing is pre-formatted."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(config):
+    """Configure logging from a dictConfig mapping plus an optional `pipeline` section.
+
+    The handlers attached to the root logger are moved behind a queue served by a listener
+    thread, so formatting and file I/O happen off the caller's thread. `pipeline` keys:
+    `queue` (default true), `max_message_length` and `rate_limits` (see RateLimitFilter).
+    Returns the QueueListener, or None when the queue is disabled.
+    """
+    config = dict(config)
+    pipeline = config.pop("pipeline", None) or {}
+    logging.config.dictConfig(config)
+
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    rate_limits = RateLimitFilter(pipeline.get("rate_limits") or [])
+    use_queue = pipeline.get("queue", True) and handlers
+    max_length = pipeline.get("max_message_length")
+    truncating = TruncatingFilter(int(max_length)) if max_length else None
+    for handler in handlers:
+        if not use_queue:
+            handler.addFilter(rate_limits)
+        if truncating:
+            handler.addFilter(truncating)
+    if not use_queue:
+        return None
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _LocalQueueHandler(log_queue)
+    queue_handler.addFilter(rate_limits)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging, listener)
+    return listener
+
+
+def stop_logging(listener):
+    """Flush queued records and stop the listener thread; safe to call more than once."""
+    if listener is not None and listener._thread is not None:
+        listener.stop()